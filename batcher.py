@@ -0,0 +1,116 @@
+import os
+import time
+import threading
+import itertools
+from collections import deque
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any
+from typing import Callable
+from typing import Optional
+
+from metrics import METRICS
+
+
+class Clip(object):
+
+    def __init__(self, item: Any, seconds: float) -> None:
+        self.item = item
+        self.seconds = seconds
+        self.future = Future()
+        self.queued_at = time.perf_counter()
+
+
+class Batcher(object):
+
+    def __init__(
+        self,
+        infer: Callable[[list[Any]], list[Any]],
+        stage: str,
+        max_wait: Optional[float] = None,
+        max_batch_seconds: Optional[float] = None
+    ) -> None:
+        self.infer = infer
+        self.stage = stage
+        self.max_wait = float(os.environ.get("batch_max_wait", 0.1)) if max_wait is None else max_wait
+        self.max_batch_seconds = float(os.environ.get("batch_max_seconds", 300)) if max_batch_seconds is None else max_batch_seconds
+
+        self.cond = threading.Condition()
+        # One FIFO per request; batches take clips from them in turn, so a long job cannot hold back a short one.
+        self.pending = OrderedDict()
+        self.pending_seconds = 0.0
+        self.keys = itertools.count()
+        self.thread = None
+
+    def submit(self, items: list[tuple[Any, float]]) -> list[Future]:
+        clips = [Clip(item, seconds) for item, seconds in items]
+        if not clips:
+            return []
+        with self.cond:
+            self.pending[next(self.keys)] = deque(clips)
+            self.pending_seconds += sum(clip.seconds for clip in clips)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._work, daemon=True)
+                self.thread.start()
+            self.cond.notify_all()
+
+        return [clip.future for clip in clips]
+
+    def _wait_time(self) -> Optional[float]:
+        if not self.pending:
+            return None
+        if self.pending_seconds >= self.max_batch_seconds:
+            return 0.0
+        oldest = min(clips[0].queued_at for clips in self.pending.values())
+
+        return max(0.0, oldest + self.max_wait - time.perf_counter())
+
+    def _take(self) -> list[Clip]:
+        batch = []
+        seconds = 0.0
+        while self.pending:
+            key = next(iter(self.pending))
+            clips = self.pending.pop(key)
+            clip = clips[0]
+            # A single clip longer than the limit still goes through, on its own.
+            if batch and seconds + clip.seconds > self.max_batch_seconds:
+                self.pending[key] = clips
+                self.pending.move_to_end(key, last=False)
+                break
+            clips.popleft()
+            self.pending_seconds -= clip.seconds
+            if clips:
+                self.pending[key] = clips
+            # Callers cancel the futures of requests they gave up on, those clips are dropped here.
+            if clip.future.set_running_or_notify_cancel():
+                batch.append(clip)
+                seconds += clip.seconds
+
+        return batch
+
+    def _work(self) -> None:
+        while True:
+            with self.cond:
+                while True:
+                    wait_time = self._wait_time()
+                    if wait_time == 0.0:
+                        break
+                    self.cond.wait(wait_time)
+                batch = self._take()
+                METRICS.set(self.stage, "batch_pending_seconds", self.pending_seconds)
+            if not batch:
+                continue
+
+            METRICS.add(self.stage, "batches")
+            METRICS.add(self.stage, "batch_clips", len(batch))
+            METRICS.set(self.stage, "batch_size", len(batch))
+            try:
+                results = self.infer([clip.item for clip in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"Expected {len(batch)} results, got {len(results)}")
+            except BaseException as e:
+                for clip in batch:
+                    clip.future.set_exception(e)
+                continue
+            for clip, result in zip(batch, results):
+                clip.future.set_result(result)
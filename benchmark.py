@@ -0,0 +1,581 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import types
+from pathlib import Path
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import soundfile as sf
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+SAMPLE_TEXTS = [
+    "今天的天气真不错，我们一起去公园散步吧。",
+    "I think we should leave before the rain starts.",
+    "今日はとても楽しかったです、また会いましょう。",
+    "오늘 저녁에 같이 밥 먹을래요?",
+    "这件事情我们明天再讨论，好吗？",
+    "Could you please repeat that one more time?",
+    "ちょっと待ってください、すぐに戻ります。",
+    "정말 고마워요, 덕분에 살았어요!"
+]
+# Sentences without a merge point at the end, so the integrator has something to merge.
+OPEN_TEXTS = ["我觉得这个方案还可以，", "but maybe we should wait,", "でもまだ分からないけど、"]
+
+SAMPLE_RATE = 48000
+
+
+def format_time(time_ms):
+    h, m = divmod(time_ms, 3600000)
+    m, s = divmod(m, 60000)
+    s, ms = divmod(s, 1000)
+
+    return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
+
+
+def make_burst(rng, frames):
+    t = np.arange(frames) / SAMPLE_RATE
+    envelope = np.sin(np.pi * np.arange(frames) / frames) ** 0.5
+    if rng.random() < 0.7:
+        f0 = rng.uniform(100.0, 300.0) * (1.0 + 0.05 * np.sin(2.0 * np.pi * rng.uniform(3.0, 6.0) * t))
+        phase = 2.0 * np.pi * np.cumsum(f0) / SAMPLE_RATE
+        burst = sum(np.sin(k * phase) / k for k in range(1, 6))
+    else:
+        burst = rng.normal(0.0, 0.5, frames)
+
+    return (rng.uniform(0.05, 0.3) * envelope * burst).astype(np.float32)
+
+
+def make_corpus(corpus_path, episodes=4, episode_seconds=60.0, seed=0):
+    rng = np.random.default_rng(seed)
+    episode_path = corpus_path / "episodes"
+    chunk_path = corpus_path / "chunks"
+    for path in (episode_path, chunk_path):
+        shutil.rmtree(path, ignore_errors=True)
+        path.mkdir(parents=True, exist_ok=True)
+
+    text_count = 0
+    for n in range(1, episodes + 1):
+        name = f"ep{n:03d}"
+        segments = []
+        blocks = []
+        frame = 0
+        index = 1
+        while frame < episode_seconds * SAMPLE_RATE:
+            silence = np.zeros(int(rng.uniform(0.3, 1.0) * SAMPLE_RATE), dtype=np.float32)
+            burst = make_burst(rng, int(rng.uniform(1.0, 4.0) * SAMPLE_RATE))
+            texts = OPEN_TEXTS if text_count % 3 == 2 else SAMPLE_TEXTS
+            text = texts[text_count % len(texts)]
+            text_count += 1
+
+            start_ms = (frame + len(silence)) * 1000 // SAMPLE_RATE
+            end_ms = (frame + len(silence) + len(burst)) * 1000 // SAMPLE_RATE
+            blocks.append(f"{index}\n{format_time(start_ms)} --> {format_time(end_ms)}\n{text}\n\n")
+            segments.extend((silence, burst))
+            frame += len(silence) + len(burst)
+
+            # Chunks look like what the transcriber writes next to each sliced clip.
+            chunk_name = f"{name}_{index}"
+            sf.write(str(chunk_path / f"{chunk_name}.wav"), burst, SAMPLE_RATE, subtype="PCM_24", endian="LITTLE", format="WAV")
+            with chunk_path.joinpath(f"{chunk_name}.srt").open('w', encoding="utf-8") as f:
+                f.write(f"1\n00:00:00,000 --> {format_time(len(burst) * 1000 // SAMPLE_RATE)}\n{text}\n\n")
+            index += 1
+
+        sf.write(str(episode_path / f"{name}.wav"), np.concatenate(segments), SAMPLE_RATE, subtype="PCM_24", endian="LITTLE", format="WAV")
+        with episode_path.joinpath(f"{name}.srt").open('w', encoding="utf-8") as f:
+            f.writelines(blocks)
+
+    return corpus_path
+
+
+def audio_seconds(paths):
+    return sum(sf.info(str(path)).duration for path in paths)
+
+
+def chunk_paths(corpus_path, suffix):
+    # Sorted by episode and then by chunk index, the order the merger expects.
+    return sorted(
+        corpus_path.joinpath("chunks").glob(f"*{suffix}"),
+        key=lambda path: (path.stem.split("_")[0], int(path.stem.split("_")[1]))
+    )
+
+
+def drain(generator):
+    for _ in generator:
+        pass
+
+
+def bench_i18n(corpus_path, output_path):
+    from i18n import I18nAuto
+
+    count = 1000
+    start = time.perf_counter()
+    for _ in range(count):
+        I18nAuto()
+
+    return {"seconds": time.perf_counter() - start, "files": count, "audio_seconds": 0.0}
+
+
+def bench_slicer(corpus_path, output_path):
+    from slicer import Slicer
+
+    slicer = Slicer()
+    paths = sorted(corpus_path.joinpath("episodes").glob("*.wav"))
+    start = time.perf_counter()
+    if shutil.which("ffmpeg"):
+        drain(slicer([str(path) for path in paths], str(output_path)))
+    else:
+        # Without ffmpeg only the slicing itself can be measured.
+        for path in paths:
+            audio_data, _ = sf.read(str(path), dtype="int32")
+            slicer.slice(audio_data)
+
+    return {"seconds": time.perf_counter() - start, "files": len(paths), "audio_seconds": audio_seconds(paths)}
+
+
+def bench_normalizer(corpus_path, output_path):
+    from normalizer import Normalizer
+
+    paths = chunk_paths(corpus_path, ".wav")
+    start = time.perf_counter()
+    drain(Normalizer()([str(path) for path in paths], str(output_path)))
+
+    return {"seconds": time.perf_counter() - start, "files": len(paths), "audio_seconds": audio_seconds(paths)}
+
+
+def bench_true_peak(corpus_path, output_path):
+    from codec import read_audio
+    from normalizer import Normalizer
+    from normalizer import true_peak
+
+    paths = chunk_paths(corpus_path, ".wav")
+    clips = [read_audio(path) for path in paths]
+    normalizer = Normalizer()
+    # The peak measurement alone, then the whole per-file normalize it is part of; sample peak before, true peak after.
+    sites = {
+        "peak": (lambda y, sr: np.max(np.abs(y)), lambda y, sr: true_peak(y)),
+        "normalize": (lambda y, sr: normalizer.normalize(y, sr), lambda y, sr: normalizer.normalize(y, sr, use_true_peak=True))
+    }
+    results = {}
+    for site, (sample_peak, oversampled_peak) in sites.items():
+        timings = []
+        for measure in (sample_peak, oversampled_peak):
+            measure(*clips[0])
+            start = time.perf_counter()
+            for y, sr in clips:
+                measure(y, sr)
+            timings.append(time.perf_counter() - start)
+        results[site] = {"before_seconds": timings[0], "after_seconds": timings[1]}
+
+    return {"seconds": results["normalize"]["after_seconds"], "files": len(paths), "audio_seconds": audio_seconds(paths), "sites": results}
+
+
+def bench_store(corpus_path, output_path):
+    from normalizer import Normalizer
+    from store import STORE
+
+    # The other benchmarks run with the store off; this one points it at a fresh directory and runs the same work twice.
+    STORE.root = output_path / "artifacts"
+    paths = chunk_paths(corpus_path, ".wav")
+    start = time.perf_counter()
+    drain(Normalizer()([str(path) for path in paths], str(output_path / "cold")))
+    cold_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    drain(Normalizer()([str(path) for path in paths], str(output_path / "warm")))
+    warm_seconds = time.perf_counter() - start
+    sites = {"normalizer_rerun": {"before_seconds": cold_seconds, "after_seconds": warm_seconds}}
+
+    return {"seconds": warm_seconds, "files": len(paths), "audio_seconds": audio_seconds(paths), "sites": sites}
+
+
+def bench_merger(corpus_path, output_path):
+    from merger import Merger
+
+    merger = Merger()
+    audio_paths = chunk_paths(corpus_path, ".wav")
+    subtitle_paths = chunk_paths(corpus_path, ".srt")
+    episodes = sorted({path.stem.split("_")[0] for path in audio_paths})
+    start = time.perf_counter()
+    # Merger keeps its subtitle index across files, so it is fed one episode per call.
+    for episode in episodes:
+        drain(merger(
+            [str(path) for path in audio_paths if path.stem.split("_")[0] == episode],
+            [str(path) for path in subtitle_paths if path.stem.split("_")[0] == episode],
+            str(output_path)
+        ))
+
+    return {"seconds": time.perf_counter() - start, "files": len(audio_paths), "audio_seconds": audio_seconds(audio_paths)}
+
+
+def bench_integrator(corpus_path, output_path):
+    from integrator import srt_pack_wav
+
+    paths = sorted(corpus_path.joinpath("episodes").glob("*.wav"))
+    start = time.perf_counter()
+    srt_pack_wav(corpus_path / "episodes", output_path, "bench", output_path / "temp", rebuild=True)
+
+    return {"seconds": time.perf_counter() - start, "files": len(paths), "audio_seconds": audio_seconds(paths)}
+
+
+def bench_selector(corpus_path, output_path):
+    from integrator import srt_pack_wav
+    from selector import ReferenceIndex
+
+    srt_pack_wav(corpus_path / "episodes", output_path, "bench", output_path / "temp", rebuild=True)
+    mapping_list_path = output_path / "bench" / "packed_mapping.list"
+    start = time.perf_counter()
+    reference_index = ReferenceIndex(mapping_list_path).build()
+    seconds = time.perf_counter() - start
+    paths = [mapping_list_path.parent / Path(path).name for path in reference_index.columns["path"]]
+
+    reference_index.query("bench")
+    start = time.perf_counter()
+    for _ in range(100):
+        reference_index.query("bench")
+    query_seconds = (time.perf_counter() - start) / 100
+
+    return {"seconds": seconds, "files": len(reference_index), "audio_seconds": audio_seconds(paths), "query_ms": query_seconds * 1000}
+
+
+def bench_deduper(corpus_path, output_path):
+    from deduper import FINGERPRINT_BITS
+    from deduper import FingerprintIndex
+    from deduper import fingerprint_files
+
+    paths = chunk_paths(corpus_path, ".wav")
+    start = time.perf_counter()
+    fingerprints = fingerprint_files(paths)
+    seconds = time.perf_counter() - start
+
+    # A dataset-sized index: random fingerprints with one in ten a noisy copy of an earlier clip.
+    rng = np.random.default_rng(0)
+    bits = rng.integers(0, 2, (200000, FINGERPRINT_BITS), dtype=np.uint8)
+    copies = np.flatnonzero(rng.random(len(bits)) < 0.1)
+    copies = copies[copies > 0]
+    bits[copies] = bits[rng.integers(0, copies)] ^ (rng.random((len(copies), FINGERPRINT_BITS)) < 0.05)
+    index = FingerprintIndex()
+    for row in np.packbits(bits, axis=1):
+        index.add(row.tobytes(), 5.0)
+    start = time.perf_counter()
+    index.duplicates()
+    index_seconds = time.perf_counter() - start
+
+    return {"seconds": seconds, "files": len(fingerprints), "audio_seconds": audio_seconds(paths), "index_clips": len(index), "index_seconds": index_seconds}
+
+
+def bench_langid(corpus_path, output_path):
+    from py3langid import langid
+    from integrator import LangClassifier
+
+    lines = [f"{SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)]}{i % 50000}\n" for i in range(100000)]
+    langid.set_languages(langs=None)
+    start = time.perf_counter()
+    for line in lines:
+        langid.classify(line)
+    per_line_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    LangClassifier()(lines)
+
+    return {"seconds": time.perf_counter() - start, "files": len(lines), "audio_seconds": 0.0, "per_line_seconds": per_line_seconds}
+
+
+def cut_cues(path, output_path, raw):
+    from codec import open_pcm24
+    from codec import read_audio
+    from codec import write_audio
+    from codec import write_segments
+
+    # One-second cues, the way srt_split_wav cuts an episode; the same target is overwritten to keep the disk flat.
+    if raw:
+        reader = open_pcm24(path)
+        for start in range(0, len(reader), reader.sample_rate):
+            write_segments(output_path / "cue.wav", [reader[start:start + reader.sample_rate]], reader.sample_rate)
+    else:
+        y, sr = read_audio(path)
+        for start in range(0, len(y), sr):
+            write_audio(output_path / "cue.wav", y[start:start + sr], sr)
+
+
+def bench_codec(corpus_path, output_path):
+    import librosa
+    from codec import read_audio
+    from codec import read_segment
+    from codec import audio_duration
+
+    episodes = sorted(corpus_path.joinpath("episodes").glob("*.wav"))
+    chunks = chunk_paths(corpus_path, ".wav")
+    # One entry per call site: (old reader, new reader, files it sees).
+    sites = {
+        "split": (lambda path: librosa.load(path, sr=None), lambda path: read_audio(path), episodes),
+        "merge": (lambda path: librosa.load(path, sr=None), lambda path: read_audio(path), chunks),
+        "transcode": (lambda path: librosa.load(path, sr=32000), lambda path: read_audio(path, 32000), chunks),
+        "duration": (lambda path: librosa.get_duration(y=librosa.load(path)[0], sr=22050), audio_duration, chunks),
+        # PCM_24 sites against the decoding codec path instead of librosa: memory-mapped views copied as raw bytes.
+        "cue": (lambda path: cut_cues(path, output_path, False), lambda path: cut_cues(path, output_path, True), episodes),
+        "segment": (lambda path: read_audio(path), lambda path: read_segment(path), chunks)
+    }
+    results = {}
+    total = 0.0
+    for site, (old_read, new_read, paths) in sites.items():
+        old_read(paths[0])
+        new_read(paths[0])
+        start = time.perf_counter()
+        for path in paths:
+            old_read(path)
+        old_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        for path in paths:
+            new_read(path)
+        new_seconds = time.perf_counter() - start
+        total += new_seconds
+        results[site] = {"before_seconds": old_seconds, "after_seconds": new_seconds}
+
+    return {"seconds": total, "files": sum(len(paths) for _, _, paths in sites.values()), "audio_seconds": 0.0, "sites": results}
+
+
+class MockAutoModel(object):
+
+    def __init__(self, **kwargs) -> None:
+        self.kwargs = kwargs
+
+    def generate(self, input, **kwargs):
+        items = input if isinstance(input, list) else [input]
+        return [{"text": f"<|zh|><|NEUTRAL|><|Speech|>{SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)]}"} for i in range(len(items))]
+
+
+def bench_transcriber(corpus_path, output_path):
+    # The real model is never loaded, so this measures everything around the inference call offline.
+    funasr = types.ModuleType("funasr")
+    funasr.AutoModel = MockAutoModel
+    sys.modules.setdefault("funasr", funasr)
+    import transcriber
+    transcriber.AutoModel = MockAutoModel
+
+    paths = chunk_paths(corpus_path, ".wav")
+    start = time.perf_counter()
+    drain(transcriber.Transcriber(lang="auto").Transcriber([str(path) for path in paths], str(output_path)))
+
+    return {"seconds": time.perf_counter() - start, "files": len(paths), "audio_seconds": audio_seconds(paths)}
+
+
+def bench_batcher(corpus_path, output_path):
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from concurrent.futures import wait
+    from batcher import Batcher
+
+    paths = chunk_paths(corpus_path, ".wav")
+    durations = {path: sf.info(str(path)).duration for path in paths}
+    model_lock = threading.Lock()
+
+    def generate(items):
+        # Fixed launch cost plus a per-clip cost, roughly how a batched generate call scales on one GPU.
+        with model_lock:
+            time.sleep(0.05 + 0.002 * len(items))
+        return [str(item) for item in items]
+
+    # One user sends the whole corpus, a few others send two clips each at the same moment.
+    jobs = [paths] + [paths[i:i + 2] for i in range(0, min(len(paths), 16), 2)]
+
+    def run(transcribe):
+        latencies = [0.0] * len(jobs)
+
+        def job(i):
+            start = time.perf_counter()
+            transcribe(jobs[i])
+            latencies[i] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+            list(executor.map(job, range(len(jobs))))
+
+        return time.perf_counter() - start, sum(latencies[1:]) / max(1, len(jobs) - 1)
+
+    batcher = Batcher(generate, "benchmark", max_wait=0.02, max_batch_seconds=60.0)
+    old_seconds, old_latency = run(generate)
+    new_seconds, new_latency = run(lambda job: wait(batcher.submit([(path, durations[path]) for path in job])))
+    sites = {
+        "total": {"before_seconds": old_seconds, "after_seconds": new_seconds},
+        "small_job_latency": {"before_seconds": old_latency, "after_seconds": new_latency}
+    }
+
+    return {"seconds": new_seconds, "files": sum(len(job) for job in jobs), "audio_seconds": 0.0, "sites": sites}
+
+
+def bench_startup(corpus_path, output_path):
+    import subprocess
+
+    # A fresh interpreter per run; -X importtime reports every module's own and cumulative import time on stderr.
+    env = dict(os.environ, temp_dir=str(output_path / "temp"))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main_webui"],
+        cwd=Path(__file__).parent,
+        env=env,
+        capture_output=True,
+        text=True
+    )
+    if proc.returncode != 0:
+        error = proc.stderr.strip().splitlines()[-1]
+        # A dependency missing in this environment is a skip, like a missing module in the in-process benchmarks.
+        if error.startswith(("ModuleNotFoundError:", "ImportError:")):
+            raise ImportError(error)
+        raise RuntimeError(error)
+
+    imports = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Only top-level entries, their cumulative times add up to the whole start-up.
+        if not name[1:].startswith(" "):
+            imports[name.strip()] = int(cumulative) / 1e6
+    heaviest = dict(sorted(imports.items(), key=lambda item: item[1], reverse=True)[:10])
+
+    return {"seconds": sum(imports.values()), "files": 1, "audio_seconds": 0.0, "imports": heaviest}
+
+
+BENCHMARKS = {
+    "i18n": bench_i18n,
+    "slicer": bench_slicer,
+    "normalizer": bench_normalizer,
+    "merger": bench_merger,
+    "integrator": bench_integrator,
+    "langid": bench_langid,
+    "codec": bench_codec,
+    "transcriber": bench_transcriber,
+    "selector": bench_selector,
+    "deduper": bench_deduper,
+    "store": bench_store,
+    "true_peak": bench_true_peak,
+    "batcher": bench_batcher,
+    "startup": bench_startup
+}
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+
+def run_benchmark(name, corpus_path, output_path):
+    shutil.rmtree(output_path, ignore_errors=True)
+    output_path.mkdir(parents=True, exist_ok=True)
+    with redirect_stdout(io.StringIO()):
+        result = BENCHMARKS[name](corpus_path, output_path)
+    result["rtf"] = result["seconds"] / result["audio_seconds"] if result["audio_seconds"] else None
+    result["files_per_s"] = result["files"] / result["seconds"] if result["seconds"] else None
+    result["peak_rss_mb"] = peak_rss_mb()
+
+    return result
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get("benchmarks", {}).get(name)
+        if base is None:
+            continue
+        for key in ("seconds", "peak_rss_mb"):
+            if result.get(key) is None or base.get(key) is None:
+                continue
+            if result[key] > base[key] * (1.0 + tolerance):
+                regressions.append(f"{name}.{key}: {result[key]:.3f} > {base[key]:.3f} * {1.0 + tolerance:.2f}")
+
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description="G-SoMapper 性能测试")
+    parser.add_argument("benchmarks", type=str, nargs="*", default=list(BENCHMARKS), help=f"要运行的测试：{' '.join(BENCHMARKS)}")
+    parser.add_argument("--corpus", type=str, default="bench_corpus", help="合成测试数据的目录")
+    parser.add_argument("--episodes", type=int, default=4, help="合成的音频数量")
+    parser.add_argument("--episode-seconds", type=float, default=60.0, help="每个合成音频的时长（秒）")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--repeat", type=int, default=1, help="每项测试的重复次数，取最快的一次")
+    parser.add_argument("--output", type=str, default=None, help="保存测试结果的 JSON 路径")
+    parser.add_argument("--baseline", type=str, default=None, help="作为对比基准的 JSON 路径")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="相对基准允许的退化比例")
+    args = parser.parse_args()
+
+    # I18nAuto reads its locale files relative to the repository root.
+    os.chdir(Path(__file__).parent)
+    os.environ.setdefault("LANG", "zh_CN.UTF-8")
+    # Cache hits would turn every rerun into a no-op and hide real regressions.
+    os.environ["artifact_dir"] = ""
+    corpus_path = make_corpus(Path(args.corpus).absolute(), args.episodes, args.episode_seconds, args.seed)
+    output_path = corpus_path / "output"
+
+    results = {}
+    failures = []
+    for name in args.benchmarks:
+        runs = []
+        for _ in range(args.repeat):
+            # A fresh process per run keeps peak RSS attributable to a single benchmark.
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                try:
+                    runs.append(executor.submit(run_benchmark, name, corpus_path, output_path).result())
+                except Exception as e:
+                    # Only a missing module or command means the benchmark cannot run here; anything else is a broken stage.
+                    if isinstance(e, ImportError) or (isinstance(e, FileNotFoundError) and e.filename is not None and shutil.which(e.filename) is None):
+                        print(f"{name}：跳过，{e}")
+                    else:
+                        failures.append(name)
+                        print(f"{name}：失败，{type(e).__name__}: {e}")
+                    break
+        if not runs:
+            continue
+        results[name] = min(runs, key=lambda run: run["seconds"])
+        result = results[name]
+        rtf = f"{result['rtf']:.4f}" if result["rtf"] is not None else "-"
+        rss = f"{result['peak_rss_mb']:.0f} MB" if result["peak_rss_mb"] is not None else "-"
+        print(f"{name}：{result['seconds']:.3f} s，RTF {rtf}，{result['files_per_s']:.1f} 个/s，峰值内存 {rss}")
+        if "query_ms" in result:
+            print(f"  查询：{result['query_ms']:.2f} ms")
+        if "index_seconds" in result:
+            print(f"  索引 {result['index_clips']} 条：{result['index_seconds']:.2f} s")
+        if "per_line_seconds" in result:
+            print(f"  逐行：{result['per_line_seconds']:.3f} s，加速 {result['per_line_seconds'] / result['seconds']:.1f}x")
+        for module, seconds in result.get("imports", {}).items():
+            print(f"  {module}：{seconds:.3f} s")
+        for site, seconds in result.get("sites", {}).items():
+            print(f"  {site}：原 {seconds['before_seconds']:.3f} s，现 {seconds['after_seconds']:.3f} s，加速 {seconds['before_seconds'] / seconds['after_seconds']:.1f}x")
+
+    report = {
+        "config": {"episodes": args.episodes, "episode_seconds": args.episode_seconds, "seed": args.seed},
+        "benchmarks": results
+    }
+    if args.output is not None:
+        with open(args.output, 'w', encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if failures:
+        print(f"运行失败：{'，'.join(failures)}")
+    if args.baseline is not None:
+        with open(args.baseline, 'r', encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("config") != report["config"]:
+            print("基准的测试配置与本次不同，对比结果仅供参考")
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"性能退化：{regression}")
+        if regressions:
+            sys.exit(1)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+import os
+import json
+import time
+import socket
+import threading
+import traceback
+from pathlib import Path
+from typing import Any
+from typing import Callable
+from typing import Generator
+from typing import Optional
+from argparse import ArgumentParser
+from itertools import groupby
+from uuid import uuid4
+
+from metrics import METRICS
+from scanner import check_pattern
+from scanner import scan
+
+STATES = ("pending", "claimed", "done", "failed")
+
+
+class Task(object):
+
+    def __init__(self, data: dict[str, Any], path: Path) -> None:
+        self.id = data["id"]
+        self.stage = data["stage"]
+        self.args = data["args"]
+        self.attempts = data.get("attempts", 0)
+        self.errors = data.get("errors", [])
+        self.data = data
+        self.path = path
+
+
+class TaskQueue(object):
+    # One JSON file per task, moved between state directories by rename, the one operation that stays atomic on shared storage.
+
+    def __init__(self, root: str, lease_seconds: Optional[float] = None, max_attempts: Optional[int] = None) -> None:
+        self.root = Path(root)
+        self.lease_seconds = float(os.environ.get("queue_lease_seconds", 60)) if lease_seconds is None else lease_seconds
+        self.max_attempts = int(os.environ.get("queue_max_attempts", 3)) if max_attempts is None else max_attempts
+        for state in (*STATES, "tmp"):
+            self.root.joinpath(state).mkdir(parents=True, exist_ok=True)
+
+    def _write(self, path: Path, data: dict[str, Any]) -> None:
+        temp_path = self.root / "tmp" / f"{uuid4()}.json"
+        with temp_path.open('w', encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def _take(self, path: Path) -> Optional[dict[str, Any]]:
+        # Whoever renames the file away owns it; everyone else gets FileNotFoundError.
+        taken_path = self.root / "tmp" / f"{path.name}.{uuid4()}"
+        try:
+            os.rename(path, taken_path)
+        except FileNotFoundError:
+            return None
+        try:
+            with taken_path.open('r', encoding="utf-8") as f:
+                return json.load(f)
+        finally:
+            taken_path.unlink(missing_ok=True)
+
+    def _now(self) -> float:
+        # Leases are judged by the file server's clock, so hosts with skewed clocks still agree on what expired.
+        clock_path = self.root / "clock"
+        clock_path.touch()
+        return clock_path.stat().st_mtime
+
+    def put(self, stage: str, args: dict[str, Any]) -> str:
+        # Ids sort by submission time, so tasks are claimed first in, first out.
+        task_id = f"{time.time_ns():020d}-{uuid4().hex[:8]}"
+        self._write(self.root / "pending" / f"{task_id}.json", {"id": task_id, "stage": stage, "args": args, "attempts": 0, "errors": []})
+
+        return task_id
+
+    def claim(self, worker_id: str, stages: Optional[list[str]] = None) -> Optional[Task]:
+        self.reclaim()
+        for name in sorted(os.listdir(self.root / "pending")):
+            pending_path = self.root / "pending" / name
+            if stages is not None:
+                try:
+                    with pending_path.open('r', encoding="utf-8") as f:
+                        if json.load(f)["stage"] not in stages:
+                            continue
+                except (FileNotFoundError, json.JSONDecodeError):
+                    continue
+            claimed_path = self.root / "claimed" / f"{Path(name).stem}.{worker_id}.json"
+            try:
+                # Touched first, rename keeps the mtime and the lease starts from it.
+                os.utime(pending_path)
+                os.rename(pending_path, claimed_path)
+            except FileNotFoundError:
+                continue
+            with claimed_path.open('r', encoding="utf-8") as f:
+                return Task(json.load(f), claimed_path)
+
+        return None
+
+    def heartbeat(self, task: Task) -> bool:
+        try:
+            os.utime(task.path)
+            return True
+        except FileNotFoundError:
+            # Reclaimed after a missed lease; the task runs elsewhere now.
+            return False
+
+    def complete(self, task: Task, result: Optional[dict[str, Any]] = None) -> bool:
+        data = self._take(task.path)
+        if data is None:
+            return False
+        self._write(self.root / "done" / f"{task.id}.json", {**data, "result": result or {}, "finished": time.time()})
+
+        return True
+
+    def _retry(self, data: dict[str, Any], error: str) -> None:
+        data["attempts"] = data.get("attempts", 0) + 1
+        data["errors"] = data.get("errors", []) + [error]
+        state = "failed" if data["attempts"] >= self.max_attempts else "pending"
+        self._write(self.root / state / f"{data['id']}.json", data)
+
+    def fail(self, task: Task, error: str) -> bool:
+        data = self._take(task.path)
+        if data is None:
+            return False
+        self._retry(data, error)
+
+        return True
+
+    def reclaim(self) -> int:
+        now = self._now()
+        count = 0
+        for name in os.listdir(self.root / "claimed"):
+            claimed_path = self.root / "claimed" / name
+            try:
+                expired = claimed_path.stat().st_mtime < now - self.lease_seconds
+            except FileNotFoundError:
+                continue
+            if not expired:
+                continue
+            data = self._take(claimed_path)
+            if data is not None:
+                self._retry(data, f"lease expired: {name.split('.', 1)[1].rsplit('.', 1)[0]}")
+                count += 1
+
+        return count
+
+    def cancel(self, task_ids: list[str]) -> None:
+        # Only tasks nobody has claimed yet; running ones finish and are ignored.
+        for task_id in task_ids:
+            self._take(self.root / "pending" / f"{task_id}.json")
+
+    def result(self, task_id: str) -> Optional[tuple[str, dict[str, Any]]]:
+        for state in ("done", "failed"):
+            try:
+                with self.root.joinpath(state, f"{task_id}.json").open('r', encoding="utf-8") as f:
+                    return state, json.load(f)
+            except FileNotFoundError:
+                continue
+
+        return None
+
+    def wait(self, task_ids: list[str], poll: float = 1.0) -> Generator[tuple[str, str, dict[str, Any]], None, None]:
+        remaining = list(task_ids)
+        while remaining:
+            finished = False
+            for task_id in list(remaining):
+                outcome = self.result(task_id)
+                if outcome is not None:
+                    remaining.remove(task_id)
+                    finished = True
+                    yield task_id, *outcome
+            if remaining and not finished:
+                # The waiting side reclaims too, a job whose workers all died still comes back for the next one.
+                self.reclaim()
+                time.sleep(poll)
+
+    def status(self) -> dict[str, int]:
+        return {state: len(os.listdir(self.root / state)) for state in STATES}
+
+
+def run_stage(stage: str, args: dict[str, Any], instances: dict[str, Any]) -> dict[str, Any]:
+    before = METRICS.snapshot().get(stage, {}).get("failures", 0.0)
+    if stage == "integrator":
+        from integrator import pair_pack_wav_task
+        return pair_pack_wav_task(args)
+    if stage == "slicer":
+        from slicer import Slicer
+        messages = Slicer(**args.get("params", {}))(args["inputs"], args["output"])
+    elif stage == "normalizer":
+        from normalizer import Normalizer
+        messages = Normalizer()(args["inputs"], args["output"], **args.get("params", {}))
+    elif stage == "transcriber":
+        # The model is loaded once per worker and kept for every task after the first.
+        if stage not in instances:
+            from transcriber import Transcriber
+            instances[stage] = Transcriber()
+        messages = instances[stage].Transcriber(args["inputs"], args["output"])
+    else:
+        raise ValueError(f"Unknown stage: {stage}")
+    last_msg = ''
+    for last_msg, _ in messages:
+        pass
+    # Stages report a bad file and carry on; for the queue the task as a whole has failed and is retried.
+    if METRICS.snapshot().get(stage, {}).get("failures", 0.0) > before:
+        raise RuntimeError(last_msg)
+
+    return {"message": last_msg}
+
+
+def work(
+    queue: TaskQueue,
+    stages: Optional[list[str]] = None,
+    worker_id: Optional[str] = None,
+    exit_when_empty: bool = False,
+    poll: float = 2.0,
+    handler: Callable[[str, dict[str, Any], dict[str, Any]], dict[str, Any]] = run_stage
+) -> int:
+    worker_id = f"{socket.gethostname()}-{os.getpid()}" if worker_id is None else worker_id
+    instances = {}
+    count = 0
+    while True:
+        task = queue.claim(worker_id, stages)
+        if task is None:
+            if exit_when_empty and not queue.status()["claimed"]:
+                return count
+            time.sleep(poll)
+            continue
+
+        print(f"{worker_id}：开始 {task.stage} {task.id}")
+        stop = threading.Event()
+
+        def beat() -> None:
+            while not stop.wait(queue.lease_seconds / 3):
+                if not queue.heartbeat(task):
+                    return
+
+        heart = threading.Thread(target=beat, daemon=True)
+        heart.start()
+        try:
+            result = handler(task.stage, task.args, instances)
+        except Exception as e:
+            stop.set()
+            heart.join()
+            queue.fail(task, f"{worker_id}: {e}\n{traceback.format_exc()}")
+            print(f"{worker_id}：失败 {task.stage} {task.id}，{e}")
+            continue
+        stop.set()
+        heart.join()
+        if queue.complete(task, result):
+            count += 1
+            print(f"{worker_id}：完成 {task.stage} {task.id}")
+        else:
+            print(f"{worker_id}：租约已过期，结果作废 {task.stage} {task.id}")
+
+
+def enqueue(queue: TaskQueue, stage: str, directory: Path, pattern: str, output: Path, params: dict[str, Any], batch: int = 1) -> list[str]:
+    paths = [str(Path(path).absolute()) for path in scan(directory, check_pattern(pattern), ordered=True)]
+    if stage == "normalizer":
+        # Chunks of one episode share an output folder that the normalizer clears first, so they travel as one task.
+        groups = [list(group) for _, group in groupby(paths, key=lambda path: Path(path).stem.split("_")[0])]
+    else:
+        groups = [paths[i:i + batch] for i in range(0, len(paths), max(1, batch))]
+
+    return [queue.put(stage, {"inputs": group, "output": str(output.absolute()), "params": params}) for group in groups]
+
+
+def main():
+    parser = ArgumentParser(description="多机共享的任务队列：任务目录需位于所有机器都能以相同路径访问的共享存储上")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    enqueue_parser = subparsers.add_parser("enqueue", help="将目录中的文件按阶段拆分为任务并加入队列")
+    enqueue_parser.add_argument("queue", type=str, help="队列目录")
+    enqueue_parser.add_argument("stage", type=str, choices=["slicer", "normalizer", "transcriber"], help="处理阶段")
+    enqueue_parser.add_argument("input", type=str, help="输入目录")
+    enqueue_parser.add_argument("output", type=str, help="输出目录")
+    enqueue_parser.add_argument("--glob", type=str, default="**/*", help="匹配模式")
+    enqueue_parser.add_argument("--params", type=str, default="{}", help="传给该阶段的参数（JSON）")
+    enqueue_parser.add_argument("--batch", type=int, default=1, help="每个任务包含的文件数")
+
+    work_parser = subparsers.add_parser("work", help="从队列中领取并执行任务")
+    work_parser.add_argument("queue", type=str, help="队列目录")
+    work_parser.add_argument("--stages", type=str, nargs="+", default=None, help="只领取这些阶段的任务")
+    work_parser.add_argument("--exit-when-empty", action="store_true", help="队列为空时退出")
+
+    status_parser = subparsers.add_parser("status", help="查看队列状态")
+    status_parser.add_argument("queue", type=str, help="队列目录")
+    args = parser.parse_args()
+
+    queue = TaskQueue(args.queue)
+    if args.command == "enqueue":
+        task_ids = enqueue(queue, args.stage, Path(args.input), args.glob, Path(args.output), json.loads(args.params), args.batch)
+        print(f"已加入 {len(task_ids)} 个任务 -> {args.queue}")
+    elif args.command == "work":
+        count = work(queue, args.stages, exit_when_empty=args.exit_when_empty)
+        print(f"已完成 {count} 个任务")
+    else:
+        print("，".join(f"{state} {count}" for state, count in queue.status().items()))
+
+
+if __name__ == '__main__':
+    main()
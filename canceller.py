@@ -0,0 +1,59 @@
+import threading
+from contextlib import contextmanager
+from subprocess import Popen
+from typing import Generator
+
+import psutil
+
+
+def terminate_tree(pid: int, timeout: float = 5.0) -> None:
+    try:
+        parent = psutil.Process(pid)
+        procs = parent.children(recursive=True) + [parent]
+    except psutil.NoSuchProcess:
+        return
+
+    # SIGTERM first so that ffmpeg and the models can release their files and memory; SIGKILL only the stragglers.
+    for proc in procs:
+        try:
+            proc.terminate()
+        except psutil.NoSuchProcess:
+            pass
+    _, alive = psutil.wait_procs(procs, timeout=timeout)
+    for proc in alive:
+        try:
+            proc.kill()
+        except psutil.NoSuchProcess:
+            pass
+
+
+class CancelToken(object):
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.procs = set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.event.is_set()
+
+    def cancel(self) -> None:
+        with self.lock:
+            self.event.set()
+            procs = list(self.procs)
+        for proc in procs:
+            # The stage thread is blocked reading from the child, so it is the one that reaps it.
+            threading.Thread(target=terminate_tree, args=(proc.pid,), daemon=True).start()
+
+    @contextmanager
+    def attach(self, proc: Popen) -> Generator[Popen, None, None]:
+        with self.lock:
+            if self.event.is_set():
+                proc.terminate()
+            self.procs.add(proc)
+        try:
+            yield proc
+        finally:
+            with self.lock:
+                self.procs.discard(proc)
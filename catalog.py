@@ -0,0 +1,180 @@
+import sqlite3
+from pathlib import Path
+from typing import Optional
+from argparse import ArgumentParser
+
+CATALOG_NAME = "catalog.db"
+CATALOG_COLUMNS = (
+    "clip_id", "pair", "position", "path", "speaker", "language", "text", "text_length",
+    "duration", "sample_rate", "source", "source_start", "source_end", "duplicate_of"
+)
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS clips (
+    clip_id TEXT PRIMARY KEY,
+    pair TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    speaker TEXT NOT NULL,
+    language TEXT NOT NULL,
+    text TEXT NOT NULL,
+    text_length INTEGER NOT NULL,
+    duration REAL,
+    sample_rate INTEGER,
+    source TEXT,
+    source_start REAL,
+    source_end REAL,
+    duplicate_of TEXT
+);
+CREATE INDEX IF NOT EXISTS clips_pair ON clips (pair, position);
+CREATE INDEX IF NOT EXISTS clips_speaker ON clips (speaker, language, duration);
+CREATE INDEX IF NOT EXISTS clips_language ON clips (language, duration);
+CREATE INDEX IF NOT EXISTS clips_duration ON clips (duration);
+CREATE INDEX IF NOT EXISTS clips_sample_rate ON clips (sample_rate);
+CREATE INDEX IF NOT EXISTS clips_source ON clips (source, source_start, source_end);
+CREATE INDEX IF NOT EXISTS clips_text_length ON clips (text_length);
+"""
+GROUP_COLUMNS = ("speaker", "language", "sample_rate", "pair", "source")
+
+
+def clip_id(path: str) -> str:
+    return Path(path).stem
+
+
+class Catalog(object):
+
+    def __init__(self, catalog_path: Path) -> None:
+        self.catalog_path = Path(catalog_path)
+        self.connection = sqlite3.connect(self.catalog_path)
+        # WAL lets the WebUI and the CLI read while a pack run is still writing.
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self) -> "Catalog":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def pairs(self) -> set[str]:
+        return {pair for pair, in self.connection.execute("SELECT DISTINCT pair FROM clips")}
+
+    def drop_pairs(self, pairs: set[str]) -> None:
+        with self.connection:
+            self.connection.executemany("DELETE FROM clips WHERE pair = ?", ((pair,) for pair in pairs))
+
+    def replace_pair(self, pair: str, rows: list[dict[str, str | float | int | None]]) -> None:
+        # One transaction per pair, so an interrupted run never leaves half a pair behind.
+        with self.connection:
+            self.connection.execute("DELETE FROM clips WHERE pair = ?", (pair,))
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO clips ({', '.join(CATALOG_COLUMNS)}) VALUES ({', '.join('?' * len(CATALOG_COLUMNS))})",
+                (tuple({**row, "pair": pair, "position": position}.get(column) for column in CATALOG_COLUMNS) for position, row in enumerate(rows))
+            )
+
+    def mark_duplicates(self, duplicates: dict[str, str]) -> None:
+        with self.connection:
+            self.connection.execute("UPDATE clips SET duplicate_of = NULL WHERE duplicate_of IS NOT NULL")
+            self.connection.executemany("UPDATE clips SET duplicate_of = ? WHERE clip_id = ?", ((kept, dup) for dup, kept in duplicates.items()))
+
+    @staticmethod
+    def _where(
+        speaker: Optional[str] = None,
+        language: Optional[str] = None,
+        min_seconds: Optional[float] = None,
+        max_seconds: Optional[float] = None,
+        min_text_length: Optional[int] = None,
+        sample_rate: Optional[int] = None,
+        skip_duplicates: bool = False
+    ) -> tuple[str, list[str | float | int]]:
+        conditions = []
+        params = []
+        for condition, value in (
+            ("speaker = ?", speaker),
+            ("language = ?", language),
+            ("duration >= ?", min_seconds),
+            ("duration <= ?", max_seconds),
+            ("text_length >= ?", min_text_length),
+            ("sample_rate = ?", sample_rate)
+        ):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        if skip_duplicates:
+            conditions.append("duplicate_of IS NULL")
+
+        return (f" WHERE {' AND '.join(conditions)}" if conditions else ""), params
+
+    def query(self, **filters) -> list[dict[str, str | float | int | None]]:
+        where, params = self._where(**filters)
+        cursor = self.connection.execute(f"SELECT {', '.join(CATALOG_COLUMNS)} FROM clips{where} ORDER BY pair, position", params)
+
+        return [dict(zip(CATALOG_COLUMNS, row)) for row in cursor]
+
+    def totals(self, group_by: tuple[str, ...] = ("speaker", "language"), **filters) -> list[dict[str, str | float | int | None]]:
+        if not set(group_by) <= set(GROUP_COLUMNS):
+            raise ValueError(f"Cannot group by {group_by}, expected some of {GROUP_COLUMNS}")
+        where, params = self._where(**filters)
+        columns = ", ".join(group_by)
+        cursor = self.connection.execute(
+            f"SELECT {columns + ', ' if columns else ''}COUNT(*), SUM(duration) FROM clips{where}{f' GROUP BY {columns} ORDER BY {columns}' if columns else ''}",
+            params
+        )
+
+        return [dict(zip((*group_by, "clips", "seconds"), row)) for row in cursor]
+
+    def export_list(self, list_path: Path, **filters) -> int:
+        # Same line format and order as packed_mapping.list, so the result drops in wherever the full list is used.
+        where, params = self._where(**filters)
+        cursor = self.connection.execute(f"SELECT path, speaker, language, text FROM clips{where} ORDER BY pair, position", params)
+        count = 0
+        with Path(list_path).open('w', encoding="utf-8") as mapping_list:
+            for path, speaker, language, text in cursor:
+                mapping_list.write(f"{path}|{speaker}|{language}|{text}\n")
+                count += 1
+
+        return count
+
+
+def main():
+    parser = ArgumentParser(description="查询打包数据集的目录数据库")
+    parser.add_argument("catalog", type=str, help=f"{CATALOG_NAME} 的路径，与 packed_mapping.list 位于同一目录")
+    parser.add_argument("--export", type=str, default=None, help="按条件导出列表文件的路径，不指定时只输出统计")
+    parser.add_argument("--group-by", type=str, nargs="*", default=["speaker", "language"], choices=GROUP_COLUMNS, help="统计时的分组")
+    parser.add_argument("--speaker", type=str, default=None, help="说话人")
+    parser.add_argument("--language", type=str, default=None, help="语言，例如 ZH、EN、JA、KO")
+    parser.add_argument("--min-seconds", type=float, default=None, help="最短时长（秒）")
+    parser.add_argument("--max-seconds", type=float, default=None, help="最长时长（秒）")
+    parser.add_argument("--min-text-length", type=int, default=None, help="最少字数")
+    parser.add_argument("--sample-rate", type=int, default=None, help="采样率")
+    parser.add_argument("--skip-duplicates", action="store_true", help="跳过查重时判定为重复的音频")
+    args = parser.parse_args()
+    filters = {
+        "speaker": args.speaker,
+        "language": args.language,
+        "min_seconds": args.min_seconds,
+        "max_seconds": args.max_seconds,
+        "min_text_length": args.min_text_length,
+        "sample_rate": args.sample_rate,
+        "skip_duplicates": args.skip_duplicates
+    }
+
+    catalog_path = Path(args.catalog)
+    if not catalog_path.exists():
+        print(f"目录数据库不存在：{catalog_path}")
+        return
+
+    with Catalog(catalog_path) as catalog:
+        if args.export is not None:
+            count = catalog.export_list(Path(args.export), **filters)
+            print(f"已导出 {count} 条音频 -> {args.export}")
+            return
+        for total in catalog.totals(tuple(args.group_by), **filters):
+            group = "|".join(str(total[column]) for column in args.group_by)
+            print(f"{group + '|' if group else ''}{total['clips']} 条|{(total['seconds'] or 0.0) / 3600:.2f} 小时")
+
+
+if __name__ == '__main__':
+    main()
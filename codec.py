@@ -0,0 +1,273 @@
+import os
+import struct
+import subprocess as subp
+from pathlib import Path
+from subprocess import Popen
+from contextlib import nullcontext
+from typing import Optional
+
+import numpy as np
+import soundfile as sf
+
+from canceller import CancelToken
+
+# Containers libsndfile reads natively, everything else goes through ffmpeg.
+SOUNDFILE_SUFFIXES = {".wav", ".flac", ".ogg", ".aif", ".aiff"}
+FFMPEG_FORMATS = {"f32le": ("pcm_f32le", np.float32), "s32le": ("pcm_s32le", np.int32)}
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class WavLayout(object):
+
+    def __init__(self, offset: int, frames: int, channels: int, sample_rate: int, bits: int, is_float: bool) -> None:
+        self.offset = offset
+        self.frames = frames
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.bits = bits
+        self.is_float = is_float
+
+    @property
+    def dtype(self) -> Optional[str]:
+        if self.is_float:
+            return {32: "<f4", 64: "<f8"}.get(self.bits)
+        return {16: "<i2", 32: "<i4"}.get(self.bits)
+
+
+def wav_layout(path) -> Optional[WavLayout]:
+    with open(path, "rb") as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+            return None
+        fmt = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            chunk_id, chunk_size = struct.unpack("<4sI", chunk)
+            if chunk_id == b"fmt ":
+                body = f.read(chunk_size)
+                format_tag, channels, sample_rate, _, block_align, bits = struct.unpack("<HHIIHH", body[:16])
+                if format_tag == WAVE_FORMAT_EXTENSIBLE and len(body) >= 26:
+                    format_tag = struct.unpack("<H", body[24:26])[0]
+                if format_tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT):
+                    return None
+                fmt = (channels, sample_rate, block_align, bits, format_tag == WAVE_FORMAT_IEEE_FLOAT)
+            elif chunk_id == b"data":
+                if fmt is None:
+                    return None
+                channels, sample_rate, block_align, bits, is_float = fmt
+                # Streams that were never finalised leave the size at 0 or 0xFFFFFFFF, libsndfile copes with those better.
+                if chunk_size in (0, 0xFFFFFFFF):
+                    return None
+                # A truncated file claims more data than it holds; libsndfile reads what is there, and so does the memmap.
+                chunk_size = min(chunk_size, os.fstat(f.fileno()).st_size - f.tell())
+                # Nothing left to map, an empty memmap is an error where libsndfile just returns no frames.
+                if chunk_size < block_align:
+                    return None
+                return WavLayout(f.tell(), chunk_size // block_align, channels, sample_rate, bits, is_float)
+            else:
+                f.seek(chunk_size, 1)
+            if chunk_size % 2:
+                f.seek(1, 1)
+
+
+class Pcm24Segment(object):
+
+    def __init__(self, raw: np.ndarray, channels: int, sample_rate: int) -> None:
+        self.raw = raw
+        self.channels = channels
+        self.sample_rate = sample_rate
+
+    def __len__(self) -> int:
+        return len(self.raw) // (3 * self.channels)
+
+    def _shifted(self) -> np.ndarray:
+        # Each 3-byte sample lands in the top of an int32, which keeps the sign without any bit twiddling.
+        words = np.zeros((len(self.raw) // 3, 4), dtype=np.uint8)
+        words[:, 1:] = self.raw.reshape(-1, 3)
+        shifted = words.view("<i4").reshape(-1)
+
+        return shifted.reshape(-1, self.channels) if self.channels > 1 else shifted
+
+    def int32(self) -> np.ndarray:
+        return self._shifted() >> 8
+
+    def float32(self) -> np.ndarray:
+        # Same scale libsndfile uses for 24-bit data, so the values match sf.read exactly.
+        y = self._shifted().astype(np.float32)
+        y *= np.float32(1.0 / (1 << 31))
+
+        return y
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        y = self.float32()
+        return y if dtype is None else y.astype(dtype)
+
+
+class Pcm24Reader(object):
+
+    def __init__(self, path, layout: Optional[WavLayout] = None) -> None:
+        layout = wav_layout(path) if layout is None else layout
+        if layout is None or layout.is_float or layout.bits != 24:
+            raise ValueError(f"Not a 24-bit PCM WAV: {path}")
+        self.path = path
+        self.channels = layout.channels
+        self.sample_rate = layout.sample_rate
+        self.frames = layout.frames
+        self.data = np.memmap(path, dtype=np.uint8, mode="r", offset=layout.offset, shape=(layout.frames * layout.channels * 3,))
+
+    def __len__(self) -> int:
+        return self.frames
+
+    def segment(self, start: int, stop: int) -> Pcm24Segment:
+        start, stop, _ = slice(start, stop).indices(self.frames)
+        frame_size = 3 * self.channels
+
+        return Pcm24Segment(self.data[start * frame_size:max(start, stop) * frame_size], self.channels, self.sample_rate)
+
+    def __getitem__(self, key: slice) -> Pcm24Segment:
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise TypeError("Pcm24Reader only supports contiguous slices")
+        return self.segment(*key.indices(self.frames)[:2])
+
+
+def open_pcm24(path) -> Optional[Pcm24Reader]:
+    if Path(path).suffix.lower() != ".wav":
+        return None
+    layout = wav_layout(path)
+    if layout is None or layout.is_float or layout.bits != 24:
+        return None
+
+    return Pcm24Reader(path, layout)
+
+
+def _to_mono(y: np.ndarray) -> np.ndarray:
+    # Same downmix as librosa.to_mono, so moving a stage over does not change its output.
+    return y.mean(axis=1, dtype=np.float32) if y.ndim > 1 else y
+
+
+def _read_mmap(path, layout: WavLayout) -> np.ndarray:
+    data = np.memmap(path, dtype=layout.dtype, mode="r", offset=layout.offset, shape=(layout.frames * layout.channels,))
+    if layout.channels > 1:
+        data = data.reshape(-1, layout.channels)
+    if layout.is_float:
+        y = data if layout.bits == 32 else data.astype(np.float32)
+    else:
+        y = data.astype(np.float32)
+        y *= np.float32(1.0 / (1 << (layout.bits - 1)))
+
+    return _to_mono(y)
+
+
+def ffmpeg_decode(
+    path,
+    sample_rate: int,
+    sample_format: str = "f32le",
+    cancel: Optional[CancelToken] = None
+) -> np.ndarray:
+    codec, dtype = FFMPEG_FORMATS[sample_format]
+    # An argument list keeps spaces and quotes in file names from reaching a shell.
+    ffmpeg_cmd = [
+        "ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error",
+        "-i", str(path),
+        "-vn", "-acodec", codec, "-f", sample_format, "-ac", "1", "-ar", str(sample_rate),
+        "pipe:1"
+    ]
+
+    with Popen(ffmpeg_cmd, stdin=subp.DEVNULL, stdout=subp.PIPE, stderr=subp.PIPE) as proc, \
+         (cancel.attach(proc) if cancel is not None else nullcontext()):
+        proc_out, proc_err = proc.communicate()
+        if proc.returncode != 0:
+            raise RuntimeError(proc_err.decode("utf-8", errors="replace"))
+
+    return np.frombuffer(proc_out, dtype=dtype)
+
+
+def ffprobe_sample_rate(path) -> int:
+    ffprobe_cmd = [
+        "ffprobe", "-v", "error", "-select_streams", "a:0",
+        "-show_entries", "stream=sample_rate", "-of", "default=noprint_wrappers=1:nokey=1",
+        str(path)
+    ]
+    proc = subp.run(ffprobe_cmd, stdin=subp.DEVNULL, capture_output=True)
+    if proc.returncode != 0 or not proc.stdout.strip():
+        raise RuntimeError(proc.stderr.decode("utf-8", errors="replace"))
+
+    return int(proc.stdout.split()[0])
+
+
+def read_audio(path, sample_rate: Optional[int] = None) -> tuple[np.ndarray, int]:
+    path = str(path)
+    suffix = Path(path).suffix.lower()
+    if suffix not in SOUNDFILE_SUFFIXES:
+        sr = sample_rate or ffprobe_sample_rate(path)
+        return ffmpeg_decode(path, sr), sr
+
+    layout = wav_layout(path) if suffix == ".wav" else None
+    if layout is not None and layout.dtype is not None:
+        y, sr = _read_mmap(path, layout), layout.sample_rate
+    elif layout is not None and not layout.is_float and layout.bits == 24:
+        reader = Pcm24Reader(path, layout)
+        y, sr = _to_mono(reader[:].float32()), reader.sample_rate
+    else:
+        y, sr = sf.read(path, dtype="float32")
+        y = _to_mono(y)
+    if sample_rate is not None and sr != sample_rate:
+        # Imported here, librosa costs about a second of start-up and is only needed to resample.
+        import librosa
+        y = librosa.resample(np.asarray(y), orig_sr=sr, target_sr=sample_rate, res_type="soxr_hq")
+        sr = sample_rate
+
+    return y, sr
+
+
+def read_segment(path) -> tuple[Pcm24Segment | np.ndarray, int]:
+    # Mono PCM_24 stays a lazy view over the file, anything else is decoded as usual.
+    reader = open_pcm24(path)
+    if reader is not None and reader.channels == 1:
+        return reader[:], reader.sample_rate
+
+    return read_audio(path)
+
+
+def audio_duration(path) -> float:
+    if Path(path).suffix.lower() in SOUNDFILE_SUFFIXES:
+        return sf.info(str(path)).duration
+    probe_cmd = ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", str(path)]
+    proc = subp.run(probe_cmd, stdin=subp.DEVNULL, capture_output=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.decode("utf-8", errors="replace"))
+
+    return float(proc.stdout.split()[0])
+
+
+def write_segments(path, segments: list[Pcm24Segment], sample_rate: int) -> None:
+    # The bytes are already PCM_24, so they go straight to disk behind the same header libsndfile would write.
+    channels = segments[0].channels if segments else 1
+    size = sum(len(segment.raw) for segment in segments)
+    pad = size % 2
+    with open(path, "wb") as f:
+        f.write(struct.pack(
+            "<4sI4s4sIHHIIHH4sI",
+            b"RIFF", 36 + size + pad, b"WAVE",
+            b"fmt ", 16, WAVE_FORMAT_PCM, channels, sample_rate, sample_rate * channels * 3, channels * 3, 24,
+            b"data", size
+        ))
+        for segment in segments:
+            f.write(segment.raw)
+        if pad:
+            f.write(b"\0")
+
+
+def write_audio(path, audio_data: np.ndarray, sample_rate: int, subtype: str = "PCM_24") -> None:
+    sf.write(
+        str(path),
+        audio_data,
+        sample_rate,
+        subtype=subtype,
+        endian="LITTLE",
+        format="WAV"
+    )
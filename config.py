@@ -2,6 +2,7 @@ import os
 import sys
 
 import gradio as gr
+import psutil
 
 
 class Config:
@@ -15,4 +16,9 @@ class Config:
         self.gr_is_share = True if os.environ.get("is_share", "False").lower() == "true" else False
         self.gr_server_name = "0.0.0.0"
 
+        self.sched_cpu_budget = int(os.environ.get("cpu_budget", os.cpu_count() or 1))
+        self.sched_memory_budget = int(os.environ.get("memory_budget", psutil.virtual_memory().total * 0.8 // (1 << 20)))
+        # Server-side input directories are limited to these roots, separated like PATH; the project's input folder unless set, none when empty.
+        self.ingest_roots = [root for root in os.environ.get("ingest_roots", "input").split(os.pathsep) if root]
+
         self.os_name = sys.platform
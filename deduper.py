@@ -0,0 +1,185 @@
+import time
+from pathlib import Path
+from typing import Optional
+from argparse import ArgumentParser
+from contextlib import closing
+
+import numpy as np
+
+from codec import read_audio
+from metrics import METRICS
+from metrics import StageRun
+from prefetcher import PREFETCHER
+
+FINGERPRINT_BITS = 256
+FINGERPRINT_BYTES = FINGERPRINT_BITS // 8
+GRID_SIZE = 16
+BAND_RANGE = (300.0, 4000.0)
+FLOOR_RATIO = 1e-3
+LSH_TABLES = 12
+LSH_BITS = 20
+MAX_BUCKET = 64
+MAX_DISTANCE = 48
+MAX_DURATION_RATIO = 1.1
+PROJECTIONS = np.random.default_rng(0).standard_normal((FINGERPRINT_BITS, GRID_SIZE * GRID_SIZE)).astype(np.float32)
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint16)
+
+
+def fingerprint(y: np.ndarray, sr: int) -> bytes:
+    # Band energies over a fixed time grid, so clips of any length compare bit by bit; only their shape is kept, not their level.
+    y = np.asarray(y, dtype=np.float32)
+    # Nothing above 4 kHz is used, so the clip is box-filtered down to about 8 kHz first; the FFTs get several times cheaper.
+    factor = max(1, int(sr // (2 * BAND_RANGE[1])))
+    if factor > 1:
+        y = y[:len(y) // factor * factor].reshape(-1, factor).mean(axis=1)
+        sr = sr / factor
+    n_fft = 1 << max(8, int(np.ceil(np.log2(sr * 0.064))))
+    if len(y) < n_fft:
+        y = np.pad(y, (0, n_fft - len(y)))
+    frames = np.lib.stride_tricks.sliding_window_view(y, n_fft)[::n_fft // 2]
+    spectrum = np.square(np.abs(np.fft.rfft(frames * np.hanning(n_fft).astype(np.float32), axis=1)))
+
+    freqs = np.fft.rfftfreq(n_fft, 1.0 / sr)
+    edges = np.geomspace(BAND_RANGE[0], min(BAND_RANGE[1], sr / 2), GRID_SIZE + 1)
+    bands = (freqs[:, None] >= edges[None, :-1]) & (freqs[:, None] < edges[None, 1:])
+    energy = spectrum @ bands.astype(np.float32)
+
+    # Cumulative energy sampled at even fractions of the clip, which works for any frame count.
+    cumulative = np.vstack((np.zeros((1, GRID_SIZE)), np.cumsum(energy, axis=0)))
+    positions = np.linspace(0, len(energy), GRID_SIZE + 1)
+    grid = np.diff(np.stack([np.interp(positions, np.arange(len(cumulative)), cumulative[:, band]) for band in range(GRID_SIZE)], axis=1), axis=0)
+    # Cells far below the loudest one are flattened to one level, they would only follow the noise floor.
+    log_grid = np.log(np.maximum(grid, grid.max() * FLOOR_RATIO) + 1e-20)
+    # SimHash: each bit is the side of a fixed random hyperplane, so the Hamming distance follows the angle between two grids.
+    bits = PROJECTIONS @ (log_grid - log_grid.mean()).reshape(-1) > 0
+
+    return np.packbits(bits.reshape(-1)).tobytes()
+
+
+def hamming(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return POPCOUNT[np.bitwise_xor(a, b)].sum(axis=-1)
+
+
+class FingerprintIndex(object):
+
+    def __init__(self, seed: int = 0) -> None:
+        rng = np.random.default_rng(seed)
+        # Bit-sampling LSH: clips that differ in few bits agree on all sampled bits of at least one table.
+        self.tables = [rng.choice(FINGERPRINT_BITS, LSH_BITS, replace=False) for _ in range(LSH_TABLES)]
+        self.fingerprints = []
+        self.durations = []
+
+    def __len__(self) -> int:
+        return len(self.fingerprints)
+
+    def add(self, fingerprint: bytes, duration: float) -> int:
+        self.fingerprints.append(fingerprint)
+        self.durations.append(duration)
+        return len(self.fingerprints) - 1
+
+    def _candidates(self, packed: np.ndarray) -> np.ndarray:
+        bits = np.unpackbits(packed, axis=1)
+        weights = (1 << np.arange(LSH_BITS, dtype=np.uint64))
+        pairs = []
+        for table in self.tables:
+            keys = bits[:, table].astype(np.uint64) @ weights
+            order = np.argsort(keys, kind="stable")
+            sorted_keys = keys[order]
+            starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+            ends = np.r_[starts[1:], len(order)]
+            for start, end in zip(starts[ends - starts > 1], ends[ends - starts > 1]):
+                members = np.sort(order[start:end])
+                # A crowded bucket is mostly silence or noise; comparing against its first members keeps the work linear.
+                heads = members[:MAX_BUCKET]
+                left, right = np.meshgrid(heads, members, indexing="ij")
+                keep = left < right
+                pairs.append(np.stack((left[keep], right[keep]), axis=1))
+        if not pairs:
+            return np.zeros((0, 2), dtype=np.int64)
+
+        return np.unique(np.concatenate(pairs).astype(np.int64), axis=0)
+
+    def duplicates(self, max_distance: int = MAX_DISTANCE) -> dict[int, tuple[int, int]]:
+        if len(self) < 2:
+            return {}
+        packed = np.frombuffer(b"".join(self.fingerprints), dtype=np.uint8).reshape(-1, FINGERPRINT_BYTES)
+        durations = np.asarray(self.durations, dtype=np.float64)
+        pairs = self._candidates(packed)
+        if not len(pairs):
+            return {}
+        distances = hamming(packed[pairs[:, 0]], packed[pairs[:, 1]])
+        ratios = np.maximum(durations[pairs[:, 0]], durations[pairs[:, 1]]) / np.maximum(np.minimum(durations[pairs[:, 0]], durations[pairs[:, 1]]), 1e-6)
+        matched = (distances <= max_distance) & (ratios <= MAX_DURATION_RATIO)
+
+        # Union-find over the confirmed pairs; the earliest clip of each group is the one that stays.
+        parent = list(range(len(self)))
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i, j in pairs[matched]:
+            root_i, root_j = find(int(i)), find(int(j))
+            if root_i != root_j:
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+        distance_of = {(int(i), int(j)): int(d) for (i, j), d in zip(pairs[matched], distances[matched])}
+
+        duplicates = {}
+        for i in range(len(self)):
+            root = find(i)
+            if root != i:
+                duplicates[i] = (root, distance_of.get((root, i), int(hamming(packed[root], packed[i]))))
+
+        return duplicates
+
+
+def fingerprint_file(audio_path: Path, run: Optional[StageRun] = None) -> tuple[str, float]:
+    if run is not None:
+        run.read(audio_path)
+    y, sr = read_audio(audio_path)
+
+    return fingerprint(y, sr).hex(), len(y) / sr
+
+
+def fingerprint_files(audio_paths: list[Path], run: Optional[StageRun] = None) -> list[tuple[str, float]]:
+    results = []
+    reads = PREFETCHER.read(lambda audio_path: fingerprint_file(audio_path, run), audio_paths, run)
+    with closing(reads):
+        for _, future in reads:
+            results.append(future.result())
+
+    return results
+
+
+def find_duplicates(fingerprints: list[tuple[str, float]], max_distance: int = MAX_DISTANCE) -> dict[int, tuple[int, int]]:
+    index = FingerprintIndex()
+    for fingerprint_hex, duration in fingerprints:
+        index.add(bytes.fromhex(fingerprint_hex), duration)
+
+    return index.duplicates(max_distance)
+
+
+def main():
+    parser = ArgumentParser(description="查找 packed_mapping.list 中重复的音频")
+    parser.add_argument("input", type=str, help="packed_mapping.list 的路径")
+    parser.add_argument("--max-distance", type=int, default=MAX_DISTANCE, help=f"判定为重复的最大汉明距离（共 {FINGERPRINT_BITS} 位）")
+    args = parser.parse_args()
+    mapping_list_path = Path(args.input)
+
+    with mapping_list_path.open('r', encoding="utf-8") as mapping_list:
+        lines = [line for line in mapping_list if line.strip()]
+    audio_paths = [mapping_list_path.parent / Path(line.split('|')[0]).name for line in lines]
+    run = METRICS.run("deduper")
+    start_time = time.perf_counter()
+    with run.time("analysis"):
+        duplicates = find_duplicates(fingerprint_files(audio_paths, run), args.max_distance)
+    for i, (kept, distance) in sorted(duplicates.items()):
+        print(f"{audio_paths[i]}|{audio_paths[kept]}|{distance}")
+    run.close()
+    print(f"在 {len(lines)} 条音频中找到 {len(duplicates)} 条重复，用时 {time.perf_counter() - start_time:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
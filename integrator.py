@@ -1,16 +1,96 @@
 import os
+import json
+import time
 import shutil
+import hashlib
+import multiprocessing
 from pathlib import Path
+from typing import Optional
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+from functools import lru_cache
+from itertools import islice
+from contextlib import closing
+from uuid import NAMESPACE_URL
 from uuid import uuid4
+from uuid import uuid5
 
-import librosa
 import numpy as np
 import soundfile as sf
-from py3langid.langid import classify
-from py3langid.langid import set_languages
+from py3langid import langid
+from py3langid.langid import visit_counts
+from scipy.sparse import csr_matrix
+
+from catalog import CATALOG_NAME
+from catalog import Catalog
+from catalog import clip_id
+from codec import Pcm24Segment
+from codec import open_pcm24
+from codec import read_audio
+from codec import read_segment
+from codec import write_audio
+from codec import write_segments
+from deduper import find_duplicates
+from deduper import fingerprint_files
+from metrics import METRICS
+from prefetcher import PREFETCHER
+from profiler import PROFILER
+from sharder import list_pack_shards
+from store import link_or_copy
+from broker import TaskQueue
+
+
+class LangClassifier(object):
+
+    def __init__(self, langs: Optional[list[str]] = None) -> None:
+        langid.set_languages(langs=langs)
+        self.identifier = langid.IDENTIFIER
+        self.classes = [lang.upper() for lang in self.identifier.nb_classes]
+        self.nb_ptc = np.asarray(self.identifier.nb_ptc, dtype=np.float32)
+        self.nb_pc = np.asarray(self.identifier.nb_pc, dtype=np.float32)
+        self.cache = {}
+
+    def _extract(self, texts: list[str]) -> tuple[csr_matrix, np.ndarray]:
+        indptr = [0]
+        indices = []
+        counts = []
+        for text in texts:
+            visits = visit_counts(
+                self.identifier.tk_nextmove,
+                self.identifier._rowbase,
+                self.identifier.tk_output,
+                self.identifier._encode(text)
+            )
+            if visits:
+                indices.extend(visits.keys())
+                counts.extend(visits.values())
+            indptr.append(len(indices))
+        features = csr_matrix(
+            (np.log1p(np.asarray(counts, dtype=np.float32)), indices, indptr),
+            shape=(len(texts), self.nb_ptc.shape[0])
+        )
+        featureless = np.diff(indptr) == 0
+
+        return features, featureless
+
+    def __call__(self, texts: list[str]) -> list[str]:
+        pending = [text for text in dict.fromkeys(texts) if text not in self.cache]
+        if pending:
+            features, featureless = self._extract(pending)
+            scores = features @ self.nb_ptc + self.nb_pc
+            best = scores.argmax(axis=1)
+            # Same fallback as py3langid when no feature is found.
+            best[featureless] = 0
+            for text, i in zip(pending, best):
+                self.cache[text] = self.classes[i]
+
+        return [self.cache[text] for text in texts]
 
-set_languages(langs=None)
+
+@lru_cache(maxsize=None)
+def get_classifier(langs: Optional[tuple[str, ...]] = None) -> LangClassifier:
+    return LangClassifier(list(langs) if langs else None)
 
 
 def unformat(timestamp) -> int:
@@ -19,41 +99,79 @@ def unformat(timestamp) -> int:
     return h * 3600000 + m * 60000 + s * 1000 + ms
 
 
-def srt_split_wav(subtitle_path, audio_path, output_dir):
+def read_wav(audio_path, run, sample_rate=None):
+    run.read(audio_path)
+    with run.time("decode"):
+        return read_audio(audio_path, sample_rate)
+
+
+def read_wav_segment(audio_path, run):
+    run.read(audio_path)
+    with run.time("decode"):
+        return read_segment(audio_path)
+
+
+def write_wav(audio_path, y, sr, subtype, run):
+    with run.time("encode"):
+        write_audio(audio_path, y, sr, subtype)
+    run.wrote(audio_path)
+
+
+def write_wav_segments(audio_path, segments, sr, run):
+    with run.time("encode"):
+        write_segments(audio_path, segments, sr)
+    run.wrote(audio_path)
+
+
+def srt_split_wav(subtitle_path, audio_path, output_dir, run=None):
+    if run is None:
+        run = METRICS.run("integrator")
+
+    times = {}
     with subtitle_path.open('r', encoding="utf-8") as subtitle, output_dir.joinpath("splitted_mapping.list").open('w', encoding="utf-8") as mapping_list:
         subtitle_data = subtitle.read().split("\n\n")
-        y, sr = librosa.load(audio_path, sr=None)
+        reader = open_pcm24(audio_path)
+        if reader is not None and reader.channels == 1:
+            # Cues are cut straight out of the mapped file and copied as raw PCM_24, nothing is decoded.
+            run.read(audio_path)
+            y, sr = reader, reader.sample_rate
+        else:
+            y, sr = read_wav(audio_path, run)
 
-        for block in range(len(subtitle_data) - 1):
-            lines = subtitle_data[block].split('\n')
-            audio_name = f"{lines[0]}.wav"
-            text = '\n'.join(lines[2:])
-            mapping_list.write(f"{audio_name}|{text}\n")
+        with PREFETCHER.writer(run) as writer:
+            for block in range(len(subtitle_data) - 1):
+                lines = subtitle_data[block].split('\n')
+                audio_name = f"{lines[0]}.wav"
+                text = '\n'.join(lines[2:])
+                mapping_list.write(f"{audio_name}|{text}\n")
 
-            start_time, end_time = [unformat(timestamp) for timestamp in lines[1].split(" --> ")]
+                start_time, end_time = [unformat(timestamp) for timestamp in lines[1].split(" --> ")]
 
-            start_time_sec = start_time / 1000
-            end_time_sec = end_time / 1000
+                start_time_sec = start_time / 1000
+                end_time_sec = end_time / 1000
+                times[audio_name] = (start_time_sec, end_time_sec)
 
-            audio_segment = y[int(start_time_sec * sr):int(end_time_sec * sr)]
+                audio_segment = y[int(start_time_sec * sr):int(end_time_sec * sr)]
 
-            sf.write(
-                str(output_dir / audio_name),
-                audio_segment,
-                sr,
-                subtype="PCM_24",
-                endian="LITTLE",
-                format="WAV"
-            )
+                if isinstance(audio_segment, Pcm24Segment):
+                    writer.submit(write_wav_segments, output_dir / audio_name, [audio_segment], sr, run)
+                else:
+                    writer.submit(write_wav, output_dir / audio_name, audio_segment, sr, "PCM_24", run)
 
+    return times
+
+
+def mapping_merge_wav(input_dir, mapping_list_path, output_dir, times=None, run=None):
+    if run is None:
+        run = METRICS.run("integrator")
 
-def mapping_merge_wav(input_dir, mapping_list_path, output_dir):
     with mapping_list_path.open('r', encoding="utf-8") as mapping_list, \
          output_dir.joinpath("merged_mapping.list").open("w", encoding="utf-8") as new_mapping_list:
         lines = list(mapping_list)
         counter = 1
         texts_buffer = []
         audio_paths_buffer = []
+        groups = []
 
         print(f"\n{mapping_list_path}")
         for line in lines:
@@ -66,26 +184,7 @@ def mapping_merge_wav(input_dir, mapping_list_path, output_dir):
                 new_mapping_list.write(f"{new_audio_name}|{merged_text}\n")
 
                 audio_paths_buffer.append(audio_path)
-
-                y = []
-                sr = None
-                for audio_path in audio_paths_buffer:
-                    y_temp, sr_temp = librosa.load(audio_path, sr=None)
-                    if sr is None:
-                        sr = sr_temp
-                    elif sr != sr_temp:
-                        raise ValueError("Sampling rates do not match.")
-                    y.append(y_temp)
-                merged_audio, sr = np.concatenate(y), sr
-
-                sf.write(
-                    str(output_dir / new_audio_name),
-                    merged_audio,
-                    sr,
-                    subtype="PCM_24",
-                    endian="LITTLE",
-                    format="WAV"
-                )
+                groups.append((new_audio_name, list(audio_paths_buffer)))
 
                 audio_paths_buffer.clear()
                 texts_buffer.clear()
@@ -94,33 +193,93 @@ def mapping_merge_wav(input_dir, mapping_list_path, output_dir):
                 texts_buffer.append(text)
                 audio_paths_buffer.append(audio_path)
 
-
-def list_pack_wav(mapping_list_path, output_dir, speaker):
-    new_mapping_list_path = output_dir / "packed_mapping.list"
+    # Groups are known up front, so every segment is read ahead in order regardless of where a group ends.
+    # A merged clip spans from the start of its first cue to the end of its last one.
+    spans = {
+        new_audio_name: (times[audio_paths[0].name][0], times[audio_paths[-1].name][1])
+        for new_audio_name, audio_paths in groups
+        if times is not None and audio_paths[0].name in times and audio_paths[-1].name in times
+    }
+    reads = PREFETCHER.read(lambda audio_path: read_wav_segment(audio_path, run), (audio_path for _, audio_paths in groups for audio_path in audio_paths), run)
+    with closing(reads), PREFETCHER.writer(run) as writer:
+        for new_audio_name, audio_paths in groups:
+            y = []
+            sr = None
+            for _, future in islice(reads, len(audio_paths)):
+                y_temp, sr_temp = future.result()
+                if sr is None:
+                    sr = sr_temp
+                elif sr != sr_temp:
+                    raise ValueError("Sampling rates do not match.")
+                y.append(y_temp)
+            if all(isinstance(y_temp, Pcm24Segment) for y_temp in y):
+                writer.submit(write_wav_segments, output_dir / new_audio_name, y, sr, run)
+                continue
+            merged_audio, sr = np.concatenate(y), sr
+
+            writer.submit(write_wav, output_dir / new_audio_name, merged_audio, sr, "PCM_24", run)
+
+    return spans
+
+
+def is_final_format(audio_path, sample_rate=None, subtype="PCM_24"):
+    info = sf.info(str(audio_path))
+
+    return (
+        info.format == "WAV"
+        and info.subtype == subtype
+        and info.endian in ("FILE", "LITTLE")
+        and info.channels == 1
+        and (sample_rate is None or info.samplerate == sample_rate)
+    )
+
+
+def list_pack_wav(mapping_list_path, output_dir, speaker, classifier=None, sample_rate=None, subtype="PCM_24", new_mapping_list_path=None, clip_key=None, spans=None, run=None):
+    if run is None:
+        run = METRICS.run("integrator")
+    if new_mapping_list_path is None:
+        new_mapping_list_path = output_dir / "packed_mapping.list"
+    if classifier is None:
+        classifier = LangClassifier()
 
     with mapping_list_path.open('r', encoding="utf-8") as mapping_list, new_mapping_list_path.open('a', encoding="utf-8") as new_mapping_list:
         lines = list(mapping_list)
+        with run.time("analysis"):
+            languages = classifier([line.split('|')[1] for line in lines])
 
-        for line in lines:
+        transcodes = []
+        clips = []
+        for i, (line, language) in enumerate(zip(lines, languages), start=1):
             text = line.split('|')[1]
-            language = classify(text)[0].upper()
-            new_audio_file_name = f"{speaker}_{uuid4()}.wav"
+            clip_uuid = uuid4() if clip_key is None else uuid5(NAMESPACE_URL, f"{speaker}/{clip_key}/{i}")
+            new_audio_file_name = f"{speaker}_{clip_uuid}.wav"
             new_mapping_list.write(f"./{output_dir.parts[-2]}/{output_dir.parts[-1]}/{new_audio_file_name}|{speaker}|{language}|{text}")
 
             audio_path = line.split('|')[0]
             source_audio_path = mapping_list_path.parent / audio_path
             dest_audio_path = output_dir / new_audio_file_name
-
-            y, sr = librosa.load(source_audio_path, sr=None)
-
-            sf.write(
-                str(dest_audio_path),
-                y,
-                sr,
-                subtype="PCM_24",
-                endian="LITTLE",
-                format="WAV"
-            )
+            span = (spans or {}).get(audio_path, (None, None))
+            clip = {"clip_id": Path(new_audio_file_name).stem, "duration": None, "sample_rate": None, "source_start": span[0], "source_end": span[1]}
+            clips.append(clip)
+
+            run.add("files")
+            if is_final_format(source_audio_path, sample_rate, subtype):
+                with run.time("encode"):
+                    link_or_copy(source_audio_path, dest_audio_path)
+                run.wrote(dest_audio_path)
+                info = sf.info(str(dest_audio_path))
+                clip["duration"], clip["sample_rate"] = info.frames / info.samplerate, info.samplerate
+                continue
+            transcodes.append((source_audio_path, dest_audio_path, clip))
+
+    reads = PREFETCHER.read(lambda transcode: read_wav(transcode[0], run, sample_rate), transcodes, run)
+    with closing(reads), PREFETCHER.writer(run) as writer:
+        for (_, dest_audio_path, clip), future in reads:
+            y, sr = future.result()
+            clip["duration"], clip["sample_rate"] = len(y) / sr, sr
+            writer.submit(write_wav, dest_audio_path, y, sr, subtype, run)
+
+    return clips
 
 
 class TempDir:
@@ -134,30 +293,370 @@ class TempDir:
         shutil.rmtree(self.path, ignore_errors=True)
 
 
-def srt_pack_wav(input_path, output_path, speaker, temp_path):
-    temp_path = Path(os.environ.get("TEMP", "temp"))
-    splited_path = temp_path / "splitted"
-    merged_path = temp_path / "merged"
+def pair_pack_wav(subtitle_path, audio_path, pair_name, output_path, speaker, temp_path, langs=None, sample_rate=None, subtype="PCM_24", clip_key=None, fingerprint=False, run=None):
+    if run is None:
+        run = METRICS.run("integrator")
+    splitted_dir = temp_path / "splitted" / pair_name
+    merged_dir = temp_path / "merged" / pair_name
+    fragment_path = temp_path / "packed" / f"{pair_name}.list"
+    output_dir = output_path / speaker
+    for path in (splitted_dir, merged_dir, fragment_path.parent, output_dir):
+        path.mkdir(parents=True, exist_ok=True)
+    fragment_path.unlink(missing_ok=True)
+    for kind in ("clips", "fingerprints"):
+        sidecar_path(fragment_path, kind).unlink(missing_ok=True)
+
+    times = srt_split_wav(subtitle_path, audio_path, splitted_dir, run)
+    spans = mapping_merge_wav(splitted_dir, splitted_dir / "splitted_mapping.list", merged_dir, times, run)
+    clips = list_pack_wav(
+        merged_dir / "merged_mapping.list",
+        output_dir,
+        speaker,
+        get_classifier(langs),
+        sample_rate,
+        subtype,
+        fragment_path,
+        pair_name if clip_key is None else clip_key,
+        spans,
+        run
+    )
+    shutil.rmtree(splitted_dir, ignore_errors=True)
+    shutil.rmtree(merged_dir, ignore_errors=True)
+    for clip in clips:
+        clip["source"] = str(audio_path)
+    with sidecar_path(fragment_path, "clips").open('w', encoding="utf-8") as f:
+        json.dump(clips, f, ensure_ascii=False)
+    if fingerprint:
+        # Fingerprinted here so the work is spread over the pack workers; the main process only compares them.
+        with fragment_path.open('r', encoding="utf-8") as fragment:
+            clip_paths = [output_dir / line.split('|')[0].rsplit('/', 1)[-1] for line in fragment]
+        with run.time("analysis"):
+            fingerprints = fingerprint_files(clip_paths, run)
+        with sidecar_path(fragment_path, "fingerprints").open('w', encoding="utf-8") as f:
+            json.dump(fingerprints, f)
+
+    return fragment_path
+
+
+def sidecar_path(fragment_path, kind):
+    return fragment_path.with_name(f"{fragment_path.stem}.{kind}.json")
+
+
+def pair_pack_wav_in_worker(*args):
+    # Worker processes keep their own registry, so the counters travel back with the result.
+    run = METRICS.run("integrator")
+    fragment_path = pair_pack_wav(*args, run=run)
+
+    return fragment_path, dict(run.values)
+
+
+def pair_task_args(arg):
+    subtitle_path, audio_path, pair_name, output_path, speaker, _, langs, sample_rate, subtype, clip_key, fingerprint = arg
+    # Absolute paths, a worker on another machine sees the same shared storage under the same mount point.
+    return {
+        "subtitle": str(Path(subtitle_path).absolute()),
+        "audio": str(Path(audio_path).absolute()),
+        "pair": pair_name,
+        "output": str(Path(output_path).absolute()),
+        "speaker": speaker,
+        "langs": list(langs) if langs else None,
+        "sample_rate": sample_rate,
+        "subtype": subtype,
+        "clip_key": clip_key,
+        "fingerprint": fingerprint
+    }
+
+
+def pair_pack_wav_task(task_args):
+    # The fragment and its sidecars travel back in the result, the worker's temp directory is its own.
+    temp_path = Path(os.environ.get("TEMP", "temp")) / str(uuid4())
+    with TempDir(temp_path):
+        fragment_path, values = pair_pack_wav_in_worker(
+            Path(task_args["subtitle"]),
+            Path(task_args["audio"]),
+            task_args["pair"],
+            Path(task_args["output"]),
+            task_args["speaker"],
+            temp_path,
+            tuple(task_args["langs"]) if task_args["langs"] else None,
+            task_args["sample_rate"],
+            task_args["subtype"],
+            task_args["clip_key"],
+            task_args["fingerprint"]
+        )
+        result = {"values": values}
+        with fragment_path.open('r', encoding="utf-8") as fragment:
+            result["lines"] = list(fragment)
+        for kind in ("clips", "fingerprints"):
+            if sidecar_path(fragment_path, kind).exists():
+                with sidecar_path(fragment_path, kind).open('r', encoding="utf-8") as f:
+                    result[kind] = json.load(f)
+
+    return result
+
+
+def write_fragment(temp_path, pair_name, result):
+    fragment_path = temp_path / "packed" / f"{pair_name}.list"
+    fragment_path.parent.mkdir(parents=True, exist_ok=True)
+    with fragment_path.open('w', encoding="utf-8") as fragment:
+        fragment.writelines(result["lines"])
+    for kind in ("clips", "fingerprints"):
+        sidecar_path(fragment_path, kind).unlink(missing_ok=True)
+        if kind in result:
+            with sidecar_path(fragment_path, kind).open('w', encoding="utf-8") as f:
+                json.dump(result[kind], f, ensure_ascii=False)
+
+    return fragment_path
+
+
+def hash_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+
+def file_state(path, previous=None):
+    stat = path.stat()
+    state = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    # Unchanged size and mtime: trust the recorded hash instead of reading the file again.
+    if previous is not None and all(previous.get(key) == value for key, value in state.items()):
+        state["sha256"] = previous["sha256"]
+    else:
+        state["sha256"] = hash_file(path)
+
+    return state
+
+
+def load_manifest(manifest_path):
+    if not manifest_path.exists():
+        return {"params": None, "pairs": {}}
+    with manifest_path.open('r', encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest_path, manifest):
+    temp_manifest_path = manifest_path.with_suffix(".tmp")
+    with temp_manifest_path.open('w', encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(temp_manifest_path, manifest_path)
+
+
+def drop_pair_outputs(output_dir, entry):
+    for clip_name in entry.get("clips", []):
+        output_dir.joinpath(clip_name).unlink(missing_ok=True)
+
+
+def write_mapping_list(new_mapping_list_path, entries, dedupe=None, run=None):
+    lines = [line for entry in entries for line in entry["lines"]]
+    duplicates_path = new_mapping_list_path.with_name("duplicates.list")
+    if dedupe is None:
+        duplicates_path.unlink(missing_ok=True)
+        duplicates = {}
+    else:
+        fingerprints = [fingerprint for entry in entries for fingerprint in entry["fingerprints"]]
+        with run.time("analysis"):
+            duplicates = find_duplicates(fingerprints)
+        run.set("duplicates", len(duplicates))
+        with duplicates_path.open('w', encoding="utf-8") as duplicates_list:
+            for i, (kept, distance) in sorted(duplicates.items()):
+                duplicates_list.write(f"{lines[i].split('|')[0]}|{lines[kept].split('|')[0]}|{distance}\n")
+        print(f"查重：在 {len(lines)} 条音频中找到 {len(duplicates)} 条重复 -> {duplicates_path}{'，已从列表中移除' if dedupe == 'drop' else ''}")
+
+    # Dropped clips stay on disk, the manifest still owns them and reuses them on the next run.
+    with new_mapping_list_path.open('w', encoding="utf-8") as new_mapping_list:
+        for i, line in enumerate(lines):
+            if dedupe != "drop" or i not in duplicates:
+                new_mapping_list.write(line)
+
+    return {clip_id(lines[i].split('|')[0]): clip_id(lines[kept].split('|')[0]) for i, (kept, _) in duplicates.items()}
+
+
+def catalog_rows(lines, clips):
+    rows = []
+    for line, clip in zip(lines, clips):
+        path, speaker, language, text = line.rstrip("\n").split('|', 3)
+        rows.append({**clip, "path": path, "speaker": speaker, "language": language, "text": text, "text_length": len(text.strip())})
+
+    return rows
+
 
-    for subtitle_path in input_path.rglob("*.srt"):
-        output_dir = splited_path / subtitle_path.stem
-        output_dir.mkdir(parents=True, exist_ok=True)
-        audio_path = subtitle_path.with_suffix(".wav")
+def clip_info(audio_path, source=None):
+    info = sf.info(str(audio_path))
 
-        srt_split_wav(subtitle_path, audio_path, output_dir)
+    return {"clip_id": clip_id(audio_path.name), "duration": info.frames / info.samplerate, "sample_rate": info.samplerate, "source": source}
 
-    for mapping_list_path in splited_path.rglob("*.list"):
-        input_dir = mapping_list_path.parent
-        output_dir = merged_path / input_dir.parts[-1]
-        output_dir.mkdir(parents=True, exist_ok=True)
 
-        mapping_merge_wav(input_dir, mapping_list_path, output_dir)
+def check_speaker(speaker):
+    # The speaker names the output folder, it must not reach outside the output directory.
+    if speaker in ("", ".", "..") or "/" in speaker or "\\" in speaker or Path(speaker).name != speaker:
+        raise ValueError(f"说话人不能为空，也不能包含路径分隔符或 ..：{speaker}")
 
-    for mapping_list_path in merged_path.rglob("*.list"):
-        output_dir = output_path / speaker
-        output_dir.mkdir(parents=True, exist_ok=True)
+    return speaker
+
+
+def iter_pack_pairs(pairs, output_path, speaker, temp_path=None, langs=None, sample_rate=None, subtype="PCM_24", workers=1, rebuild=False, dedupe=None, queue=None, run=None):
+    if temp_path is None:
+        temp_path = Path(os.environ.get("TEMP", "temp"))
+    if run is None:
+        run = METRICS.run("integrator")
+    langs = tuple(langs) if langs else None
+    output_dir = output_path / check_speaker(speaker)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = output_dir / "build_manifest.json"
+    new_mapping_list_path = output_dir / "packed_mapping.list"
 
-        list_pack_wav(mapping_list_path, output_dir, speaker)
+    params = {"speaker": speaker, "langs": list(langs) if langs else None, "sample_rate": sample_rate, "subtype": subtype}
+    manifest = load_manifest(manifest_path)
+    if rebuild or manifest["params"] != params:
+        for entry in manifest["pairs"].values():
+            drop_pair_outputs(output_dir, entry)
+        manifest = {"params": params, "pairs": {}}
+    old_pairs = manifest["pairs"]
+
+    entries = {}
+    args = []
+    for pair_name, (subtitle_path, audio_path) in pairs.items():
+        previous = old_pairs.get(pair_name, {})
+        entry = {
+            "srt": file_state(subtitle_path, previous.get("srt")),
+            "wav": file_state(audio_path, previous.get("wav"))
+        }
+        entries[pair_name] = entry
+        if (
+            previous.get("srt", {}).get("sha256") == entry["srt"]["sha256"]
+            and previous.get("wav", {}).get("sha256") == entry["wav"]["sha256"]
+            and all(output_dir.joinpath(clip_name).exists() for clip_name in previous.get("clips", []))
+        ):
+            entry["clips"] = previous["clips"]
+            entry["lines"] = previous["lines"]
+            if "fingerprints" in previous:
+                entry["fingerprints"] = previous["fingerprints"]
+            continue
+
+        drop_pair_outputs(output_dir, previous)
+        # The pair name keeps identical re-uploads in different folders from sharing clip files.
+        clip_key = hashlib.sha256(f"{pair_name}|{entry['srt']['sha256']}|{entry['wav']['sha256']}".encode()).hexdigest()
+        args.append((subtitle_path, audio_path, pair_name, output_path, speaker, temp_path, langs, sample_rate, subtype, clip_key, dedupe is not None))
+
+    deleted_pairs = set(old_pairs) - set(entries)
+    for pair_name in deleted_pairs:
+        drop_pair_outputs(output_dir, old_pairs[pair_name])
+    print(f"打包中：复用 {len(entries) - len(args)} 组，处理 {len(args)} 组，删除 {len(deleted_pairs)} 组")
+    catalog_path = output_dir / CATALOG_NAME
+    with Catalog(catalog_path) as catalog:
+        # The catalog follows the manifest: anything it does not reuse as is gets dropped here and written again when packed.
+        catalog.drop_pairs(catalog.pairs() - {pair_name for pair_name, entry in entries.items() if "lines" in entry})
+    for pair_name, entry in entries.items():
+        if "lines" in entry:
+            yield pair_name, True
+
+    # Only finished pairs are recorded, so an interrupted run resumes where it stopped.
+    manifest["pairs"] = {pair_name: entry for pair_name, entry in entries.items() if "lines" in entry}
+    last_save = time.monotonic()
+
+    def finish(pair_name, fragment_path):
+        nonlocal last_save
+        with fragment_path.open('r', encoding="utf-8") as fragment:
+            lines = list(fragment)
+        entries[pair_name]["lines"] = lines
+        entries[pair_name]["clips"] = [line.split('|')[0].rsplit('/', 1)[-1] for line in lines]
+        if sidecar_path(fragment_path, "fingerprints").exists():
+            with sidecar_path(fragment_path, "fingerprints").open('r', encoding="utf-8") as f:
+                entries[pair_name]["fingerprints"] = json.load(f)
+        with sidecar_path(fragment_path, "clips").open('r', encoding="utf-8") as f:
+            clips = json.load(f)
+        with Catalog(catalog_path) as catalog:
+            catalog.replace_pair(pair_name, catalog_rows(lines, clips))
+        manifest["pairs"][pair_name] = entries[pair_name]
+        if time.monotonic() - last_save > 5.0:
+            save_manifest(manifest_path, manifest)
+            last_save = time.monotonic()
+
+    try:
+        if queue is not None and args:
+            # Pairs are handed to broker workers, possibly on other machines; this process only waits and merges.
+            task_queue = TaskQueue(queue)
+            task_ids = {task_queue.put("integrator", pair_task_args(arg)): arg[2] for arg in args}
+            print(f"已加入队列 {len(task_ids)} 组 -> {queue}")
+            try:
+                for task_id, state, data in task_queue.wait(list(task_ids)):
+                    if state == "failed":
+                        raise RuntimeError(f"{task_ids[task_id]}：{data['errors'][-1]}")
+                    for name, value in data["result"]["values"].items():
+                        run.add(name, value)
+                    finish(task_ids[task_id], write_fragment(temp_path, task_ids[task_id], data["result"]))
+                    yield task_ids[task_id], False
+            finally:
+                # Stopping early withdraws the pairs nobody has claimed; the ones in flight finish on their workers.
+                task_queue.cancel(list(task_ids))
+        elif workers > 1 and len(args) > 1:
+            # Spawned rather than forked: in the WebUI this runs next to server threads that may hold a lock at fork time.
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            try:
+                futures = {executor.submit(pair_pack_wav_in_worker, *arg): arg[2] for arg in args}
+                for future in as_completed(futures):
+                    fragment_path, values = future.result()
+                    for name, value in values.items():
+                        run.add(name, value)
+                    finish(futures[future], fragment_path)
+                    yield futures[future], False
+            finally:
+                # When the caller stops early, queued pairs are dropped and only the ones in flight are waited for.
+                executor.shutdown(wait=True, cancel_futures=True)
+        else:
+            for arg in args:
+                finish(arg[2], pair_pack_wav(*arg, run=run))
+                yield arg[2], False
+    except GeneratorExit:
+        save_manifest(manifest_path, manifest)
+        raise
+    except Exception:
+        run.add("failures")
+        raise
+
+    # Sorted so that the merged list does not depend on the file system or on the worker count.
+    manifest["pairs"] = {pair_name: entries[pair_name] for pair_name in sorted(entries)}
+    if dedupe is not None:
+        # Pairs packed before deduplication was turned on are fingerprinted once and keep the result in the manifest.
+        for entry in manifest["pairs"].values():
+            if "fingerprints" not in entry:
+                with run.time("analysis"):
+                    entry["fingerprints"] = fingerprint_files([output_dir / clip_name for clip_name in entry["clips"]], run)
+    save_manifest(manifest_path, manifest)
+    duplicates = write_mapping_list(new_mapping_list_path, list(manifest["pairs"].values()), dedupe, run)
+    with Catalog(catalog_path) as catalog:
+        # Pairs packed before the catalog existed are filled in from the clip headers, without their place in the source.
+        for pair_name in sorted(set(manifest["pairs"]) - catalog.pairs()):
+            entry = manifest["pairs"][pair_name]
+            clips = [clip_info(output_dir / clip_name, str(pairs[pair_name][1])) for clip_name in entry["clips"]]
+            catalog.replace_pair(pair_name, catalog_rows(entry["lines"], clips))
+        catalog.mark_duplicates(duplicates)
+
+
+@PROFILER("integrator")
+def srt_pack_wav(input_path, output_path, speaker, temp_path=None, langs=None, sample_rate=None, subtype="PCM_24", workers=1, rebuild=False, dedupe=None, queue=None):
+    pairs = {
+        subtitle_path.relative_to(input_path).with_suffix('').as_posix(): (subtitle_path, subtitle_path.with_suffix(".wav"))
+        for subtitle_path in input_path.rglob("*.srt")
+    }
+    run = METRICS.run("integrator")
+    for _ in iter_pack_pairs(pairs, output_path, speaker, temp_path, langs, sample_rate, subtype, workers, rebuild, dedupe, queue, run):
+        pass
+    run.close()
+    print(f"打包完毕：{run.summary()}")
+
+
+def srt_pack_shards(input_path, output_path, speaker, temp_path=None, langs=None, sample_rate=None, workers=1, shard_size=1 << 30, dedupe=None, queue=None):
+    if temp_path is None:
+        temp_path = Path(os.environ.get("TEMP", "temp"))
+    # Clips only live in the temp directory, the output gets the shards and their index.
+    wav_path = temp_path / "wav"
+    srt_pack_wav(input_path, wav_path, speaker, temp_path, langs, sample_rate, "PCM_24", workers, True, dedupe, queue)
+    list_pack_shards(wav_path / speaker / "packed_mapping.list", output_path / speaker, shard_size)
+    shutil.rmtree(wav_path, ignore_errors=True)
 
 
 def main():
@@ -165,16 +664,37 @@ def main():
     parser.add_argument("input", type=str, help="处理的目录")
     parser.add_argument("output", type=str, help="输出的目录")
     parser.add_argument("speaker", type=str, help="说话人")
+    parser.add_argument("--langs", type=str, nargs="+", default=None, help="限定识别的语言，例如：zh en ja ko")
+    parser.add_argument("--sample-rate", type=int, default=None, help="输出的采样率，默认保持原采样率")
+    parser.add_argument("--subtype", type=str, default="PCM_24", choices=["PCM_16", "PCM_24", "PCM_32", "FLOAT"], help="输出的 WAV 编码")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="并行处理的进程数")
+    parser.add_argument("--rebuild", action="store_true", help="忽略构建清单，重新打包全部数据")
+    parser.add_argument("--format", type=str, default="wav", choices=["wav", "shards"], help="输出格式：逐条 WAV 或分片（分片每次都会完整重新打包）")
+    parser.add_argument("--shard-size", type=int, default=1 << 30, help="单个分片的最大字节数")
+    parser.add_argument("--dedupe", type=str, default=None, choices=["report", "drop"], help="查找重复的音频：report 只写出 duplicates.list，drop 同时将其从列表中移除")
+    parser.add_argument("--queue", type=str, default=None, help="共享任务队列目录，指定后由 broker.py work 启动的进程（可在多台机器上）处理各组字幕与音频")
     args = parser.parse_args()
     input_path = Path(args.input)
     output_path = Path(args.output)
     speaker = args.speaker
+    langs = args.langs
+    sample_rate = args.sample_rate
+    subtype = args.subtype
+    workers = args.workers
+    rebuild = args.rebuild
+    output_format = args.format
+    shard_size = args.shard_size
+    dedupe = args.dedupe
+    queue = args.queue
 
     temp_path = Path(f"{uuid4()}")
     temp_path.mkdir(parents=True, exist_ok=True)
 
     with TempDir(temp_path):
-        srt_pack_wav(input_path, output_path, speaker, temp_path)
+        if output_format == "shards":
+            srt_pack_shards(input_path, output_path, speaker, temp_path, langs, sample_rate, workers, shard_size, dedupe, queue)
+        else:
+            srt_pack_wav(input_path, output_path, speaker, temp_path, langs, sample_rate, subtype, workers, rebuild, dedupe, queue)
 
 
 if __name__ == '__main__':
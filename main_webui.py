@@ -1,7 +1,11 @@
 import os
 import sys
+import uuid
 import shutil
+import threading
 from pathlib import Path
+from typing import Callable
+from typing import Iterable
 from typing import Optional
 from typing import Generator
 from subprocess import Popen
@@ -12,20 +16,33 @@ current_path = Path(__file__).parent
 current_path_str = str(current_path)
 sys.path.insert(0, current_path_str)
 
-temp_path = current_path / "temp"
+
+def remove_paths(paths: list[Path]) -> None:
+    for path in paths:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+temp_path = Path(os.environ.get("temp_dir", current_path / "temp"))
+# The old temp dir is only renamed here; deleting a large one would hold up the start, so that happens in the background.
+stale_paths = list(temp_path.parent.glob(f"{temp_path.name}.stale-*"))
 if temp_path.exists():
-    shutil.rmtree(temp_path)
+    stale_path = temp_path.with_name(f"{temp_path.name}.stale-{uuid.uuid4().hex}")
+    temp_path.rename(stale_path)
+    stale_paths.append(stale_path)
 temp_path.mkdir(parents=True, exist_ok=True)
 temp_path_str = str(temp_path)
 os.environ["TEMP"] = temp_path_str
+threading.Thread(target=remove_paths, args=(stale_paths,), daemon=True).start()
 
 from utils import Utils
 from config import Config
 from i18n import I18nAuto
-from slicer import Slicer
-from normalizer import Normalizer
-from merger import Merger
-from packer import Packer
+from metrics import METRICS
+from scanner import scan
+from scanner import check_pattern
+from scanner import resolve_dir
+from scheduler import Scheduler
+from canceller import CancelToken
 
 
 class MainWebUI(object):
@@ -34,9 +51,14 @@ class MainWebUI(object):
         self.cfg = Config()
         self.utils = Utils()
         self.i18n = I18nAuto()
-        self.norm = Normalizer()
-        self.merger = Merger()
-        self.packer = Packer()
+        # Stages, and the audio stacks behind them, are only loaded once a tab is first used.
+        self.stage_lock = threading.Lock()
+        self.stages = {}
+        self.reference_indexes = {}
+        self.reference_locks = {}
+        self.scheduler = Scheduler(self.cfg.sched_cpu_budget, self.cfg.sched_memory_budget)
+        self.cancel_lock = threading.Lock()
+        self.cancel_tokens = {}
 
         self.tran_webui_proc = None
 
@@ -53,54 +75,248 @@ class MainWebUI(object):
         self.transcriber_webui_path = "transcriber_webui.py"
         self.transcriber_webui_cmd = f"python {self.transcriber_webui_path}"
 
+    def _stage(self, name: str, factory: Callable[[], object]) -> object:
+        with self.stage_lock:
+            if name not in self.stages:
+                self.stages[name] = factory()
+            return self.stages[name]
+
+    def _user(self, request: Optional[gr.Request]) -> str:
+        # Logged-in users share one turn across their tabs; anonymous visitors are told apart by address.
+        if request is None:
+            return "local"
+        return request.username or (request.client.host if request.client else "local")
+
+    def _schedule(
+        self,
+        tab: str,
+        request: Optional[gr.Request],
+        stage: object,
+        job: Callable[[CancelToken], Generator[tuple[str, dict[str, str | bool]], None, None]]
+    ) -> Generator[tuple[str, dict[str, str | bool]], None, None]:
+        user = self._user(request)
+        cancel = CancelToken()
+        with self.cancel_lock:
+            self.cancel_tokens.setdefault((tab, user), set()).add(cancel)
+        try:
+            for res in self.scheduler(user, stage.cpu_cost, stage.memory_cost, lambda: job(cancel), cancel):
+                yield res
+        finally:
+            # A closed page also ends up here, and its ffmpeg children should not outlive it.
+            cancel.cancel()
+            with self.cancel_lock:
+                tokens = self.cancel_tokens[(tab, user)]
+                tokens.discard(cancel)
+                if not tokens:
+                    del self.cancel_tokens[(tab, user)]
+
+    def _stop(self, tab: str, request: Optional[gr.Request]) -> str:
+        with self.cancel_lock:
+            tokens = list(self.cancel_tokens.get((tab, self._user(request)), ()))
+        for cancel in tokens:
+            cancel.cancel()
+        stop_msg = self.i18n("停止中：正在等待当前文件处理完毕") if tokens else self.i18n("没有正在运行的任务。")
+        print(stop_msg)
+        return stop_msg
+
+    def _inputs(
+        self,
+        files: Optional[tuple[str]],
+        directory: str,
+        pattern: str,
+        ordered: bool = False
+    ) -> Optional[Iterable[str]]:
+        if not directory:
+            return files
+        # Files are read where they lie, nothing is uploaded through the browser or copied into Gradio's temp dir.
+        return scan(resolve_dir(directory, self.cfg.ingest_roots), check_pattern(pattern), ordered)
+
     def _open_slicer(
         self,
         input_path: Optional[tuple[str]],
+        input_dir: str,
+        input_glob: str,
         output_path: str,
         threshold: float,
         min_length: int,
         min_interval: int,
         hop_size: int,
-        max_sil_kept: int
+        max_sil_kept: int,
+        min_chunk_length: int,
+        max_clipping_ratio: float,
+        max_silence_ratio: float,
+        request: gr.Request
     ) -> Generator[tuple[str, dict[str, str | bool]], None, None]:
+        try:
+            input_path = self._inputs(input_path, input_dir, input_glob)
+        except ValueError as e:
+            error_msg = self.i18n(str(e))
+            print(error_msg)
+            yield error_msg, {"__type__": "update", "visible": True}
+            return
+        from slicer import Slicer
         slicer = Slicer(
             threshold,
             min_length,
             min_interval,
             hop_size,
-            max_sil_kept
+            max_sil_kept,
+            min_chunk_length,
+            max_clipping_ratio,
+            max_silence_ratio
         )
-        for res in slicer(input_path, output_path):
+        job = lambda cancel: slicer(input_path, output_path, cancel)
+        for res in self._schedule("slicer", request, slicer, job):
             yield res
 
     def _open_normalizer(
         self,
         input_path: Optional[tuple[str]],
+        input_dir: str,
+        input_glob: str,
         output_path: str,
         target_loud: float,
-        max_peak: float
+        max_peak: float,
+        use_true_peak: bool,
+        request: gr.Request
     ) -> Generator[tuple[str, dict[str, str | bool]], None, None]:
-        for res in self.norm(input_path, output_path, target_loud, max_peak):
+        try:
+            input_path = self._inputs(input_path, input_dir, input_glob)
+        except ValueError as e:
+            error_msg = self.i18n(str(e))
+            print(error_msg)
+            yield error_msg, {"__type__": "update", "visible": True}
+            return
+        from normalizer import Normalizer
+        norm = self._stage("normalizer", Normalizer)
+        job = lambda cancel: norm(input_path, output_path, target_loud, max_peak, use_true_peak, cancel)
+        for res in self._schedule("normalizer", request, norm, job):
             yield res
 
     def _open_merger(
         self,
         audio_input_path: Optional[tuple[str]],
+        audio_input_dir: str,
+        audio_input_glob: str,
         subtitle_input_path: Optional[tuple[str]],
-        output_path: str
+        subtitle_input_dir: str,
+        subtitle_input_glob: str,
+        output_path: str,
+        request: gr.Request
     ) -> Generator[tuple[str, dict[str, str | bool]], None, None]:
-        for res in self.merger(audio_input_path, subtitle_input_path, output_path):
+        try:
+            audio_input_path = self._inputs(audio_input_path, audio_input_dir, audio_input_glob, True)
+            subtitle_input_path = self._inputs(subtitle_input_path, subtitle_input_dir, subtitle_input_glob, True)
+        except ValueError as e:
+            error_msg = self.i18n(str(e))
+            print(error_msg)
+            yield error_msg, {"__type__": "update", "visible": True}
+            return
+        from merger import Merger
+        merger = self._stage("merger", Merger)
+        job = lambda cancel: merger(audio_input_path, subtitle_input_path, output_path, cancel)
+        for res in self._schedule("merger", request, merger, job):
             yield res
 
     def _open_packer(
         self,
         audio_input_path: Optional[tuple[str]],
+        audio_input_dir: str,
+        audio_input_glob: str,
         subtitle_input_path: Optional[tuple[str]],
-        output_path: str
+        subtitle_input_dir: str,
+        subtitle_input_glob: str,
+        output_path: str,
+        speaker: str,
+        dedupe: str,
+        request: gr.Request
     ) -> Generator[tuple[str, dict[str, str | bool]], None, None]:
-        for res in self.packer(audio_input_path, subtitle_input_path, output_path):
+        try:
+            audio_input_path = self._inputs(audio_input_path, audio_input_dir, audio_input_glob, True)
+            subtitle_input_path = self._inputs(subtitle_input_path, subtitle_input_dir, subtitle_input_glob, True)
+        except ValueError as e:
+            error_msg = self.i18n(str(e))
+            print(error_msg)
+            yield error_msg, {"__type__": "update", "visible": True}
+            return
+        from packer import Packer
+        # Half the scheduler's CPU budget, so a pack leaves room for the other tabs.
+        packer = self._stage("packer", lambda: Packer(max(1, self.cfg.sched_cpu_budget // 2)))
+        job = lambda cancel: packer(audio_input_path, subtitle_input_path, output_path, speaker, dedupe or None, cancel)
+        for res in self._schedule("packer", request, packer, job):
             yield res
 
+    def _select_reference(
+        self,
+        mapping_list_path: str,
+        speaker: str,
+        language: str,
+        min_seconds: float,
+        max_seconds: float,
+        limit: int,
+        request: gr.Request
+    ) -> Generator[tuple[str, list[list[str | float | int]] | dict[str, str]], None, None]:
+        from selector import ReferenceIndex
+        from selector import load_index
+        list_path = Path(mapping_list_path.strip()).expanduser()
+        try:
+            # The index is written next to the list, so the list has to lie under an ingest root like any other server-side input.
+            resolve_dir(str(list_path.parent), self.cfg.ingest_roots)
+        except ValueError as e:
+            error_msg = self.i18n(str(e))
+            print(error_msg)
+            yield error_msg, []
+            return
+        if not list_path.is_file():
+            error_msg = self.i18n(f"请输入存在的 packed_mapping.list 路径：{mapping_list_path}")
+            print(error_msg)
+            yield error_msg, []
+            return
+        list_path = list_path.resolve()
+        # The index stays in memory between queries and is only rebuilt once the list changes.
+        with self.stage_lock:
+            reference_index = self.reference_indexes.get(list_path)
+            index_lock = self.reference_locks.setdefault(list_path, threading.Lock())
+        if reference_index is None or not reference_index.is_current():
+            # A first build decodes every clip: it waits its turn in the scheduler and only holds this list's lock, not the stage lock.
+            def build(cancel: CancelToken) -> Generator[tuple[str, dict[str, str | bool]], None, None]:
+                with index_lock:
+                    current_index = self.reference_indexes.get(list_path)
+                    if current_index is None or not current_index.is_current():
+                        build_msg = self.i18n(f"建立索引中：{list_path}")
+                        print(build_msg)
+                        yield build_msg, {"__type__": "update", "visible": False}
+                        current_index = load_index(list_path)
+                        with self.stage_lock:
+                            self.reference_indexes[list_path] = current_index
+
+            for msg, _ in self._schedule("reference", request, reference_index or ReferenceIndex(list_path), build):
+                yield msg, {"__type__": "update"}
+            with self.stage_lock:
+                reference_index = self.reference_indexes.get(list_path)
+            if reference_index is None:
+                return
+        results = reference_index.query(speaker.strip(), language.strip().upper(), min_seconds, max_seconds, int(limit))
+        rows = [
+            [result["path"], result["duration"], result["loudness"], result["speech_ratio"], result["language"], result["text"]]
+            for result in results
+        ]
+        done_msg = self.i18n(f"筛选完毕：在 {len(reference_index)} 条音频中找到 {len(rows)} 条候选")
+        print(done_msg)
+        yield done_msg, rows
+
+    def _stop_slicer(self, request: gr.Request) -> str:
+        return self._stop("slicer", request)
+
+    def _stop_normalizer(self, request: gr.Request) -> str:
+        return self._stop("normalizer", request)
+
+    def _stop_merger(self, request: gr.Request) -> str:
+        return self._stop("merger", request)
+
+    def _stop_packer(self, request: gr.Request) -> str:
+        return self._stop("packer", request)
+
     def _open_transcriber_webui(self, tran_webui_chk: bool) -> Generator[str, None, None]:
         if tran_webui_chk is True and self.tran_webui_proc is None:
             self.tran_webui_proc = Popen(self.transcriber_webui_cmd, shell = True)
@@ -120,6 +336,7 @@ class MainWebUI(object):
             yield close_msg
 
     def __call__(self) -> None:
+        METRICS.serve()
         with gr.Blocks(title=self.gr_main_title, theme=self.gr_theme) as app:
             gr.Markdown("# HomePage - G-SoMapper WebUI")
             gr.Markdown(self.i18n("##### [This repository is under MIT LICENSE protection](https://github.com/HaTiWinter/G-SoMapper) | Please follow the steps to start building your [GPT-SoVITS](https://github.com/RVC-Boss/GPT-SoVITS) training dataset:"))
@@ -135,6 +352,9 @@ class MainWebUI(object):
                                     file_count="multiple",
                                     interactive=True
                                 )
+                                with gr.Group():
+                                    slicer_input_dir = gr.Textbox(label=self.i18n("或使用服务器上的目录"), interactive=True)
+                                    slicer_input_glob = gr.Textbox(label=self.i18n("匹配模式"), value="**/*", interactive=True)
                             with gr.Column():
                                 slicer_output_path = gr.Textbox(label=self.i18n("输出目录"), interactive=True)
                                 with gr.Group():
@@ -176,6 +396,31 @@ class MainWebUI(object):
                                             precision=0,
                                             interactive=True
                                         )
+                                with gr.Group():
+                                    with gr.Row():
+                                        slicer_min_chunk_length = gr.Number(
+                                            label=self.i18n("丢弃短于此时长的片段（毫秒）"),
+                                            value=0,
+                                            step=1,
+                                            precision=0,
+                                            interactive=True
+                                        )
+                                        slicer_max_clipping_ratio = gr.Number(
+                                            label=self.i18n("丢弃削波比例高于此值的片段"),
+                                            value=1.0,
+                                            minimum=0.0,
+                                            maximum=1.0,
+                                            step=0.001,
+                                            interactive=True
+                                        )
+                                        slicer_max_silence_ratio = gr.Number(
+                                            label=self.i18n("丢弃静音比例高于此值的片段"),
+                                            value=1.0,
+                                            minimum=0.0,
+                                            maximum=1.0,
+                                            step=0.01,
+                                            interactive=True
+                                        )
                                 with gr.Group():
                                     slicer_info = gr.Textbox(label=self.i18n("进程输出信息"), interactive=False)
                                     open_slicer_btn = gr.Button(
@@ -187,15 +432,26 @@ class MainWebUI(object):
                                         self._open_slicer,
                                         [
                                             slicer_input_path,
+                                            slicer_input_dir,
+                                            slicer_input_glob,
                                             slicer_output_path,
                                             slicer_threshold,
                                             slicer_min_length,
                                             slicer_min_interval,
                                             slicer_hop_size,
-                                            slicer_max_sil_kept
+                                            slicer_max_sil_kept,
+                                            slicer_min_chunk_length,
+                                            slicer_max_clipping_ratio,
+                                            slicer_max_silence_ratio
                                         ],
                                         [slicer_info, open_slicer_btn],
                                     )
+                                    stop_slicer_btn = gr.Button(
+                                        self.i18n("停止切分"),
+                                        variant="stop",
+                                        visible=True
+                                    )
+                                    stop_slicer_btn.click(self._stop_slicer, None, [slicer_info])
                     with gr.TabItem(self.i18n("1.2. 过滤音频")):
                         gr.Markdown(self.i18n("##### 过滤无关音频数据，优化音频质量。 | [点击此处下载最新的 UVR GUI 正式版](https://github.com/Anjok07/ultimatevocalremovergui/releases) | [点击此处下载最新的 UVR GUI 测试版](https://github.com/TRvlvr/model_repo/releases)"))
                         with gr.Group():
@@ -220,6 +476,9 @@ class MainWebUI(object):
                                     file_count="multiple",
                                     interactive=True
                                 )
+                                with gr.Group():
+                                    norm_input_dir = gr.Textbox(label=self.i18n("或使用服务器上的目录"), interactive=True)
+                                    norm_input_glob = gr.Textbox(label=self.i18n("匹配模式"), value="**/*.wav", interactive=True)
                             with gr.Column():
                                 norm_output_path = gr.Textbox(label=self.i18n("输出目录"), interactive=True)
                                 with gr.Group():
@@ -241,6 +500,12 @@ class MainWebUI(object):
                                             step=0.1,
                                             interactive=True
                                         )
+                                        norm_true_peak = gr.Checkbox(
+                                            label=self.i18n("按真峰值限制（4 倍过采样，计入采样点之间的峰值）"),
+                                            value=False,
+                                            show_label=True,
+                                            interactive=True
+                                        )
                                 with gr.Group():
                                     norm_info = gr.Textbox(label=self.i18n("进程输出信息"), interactive=False)
                                     open_norm_btn = gr.Button(
@@ -252,12 +517,21 @@ class MainWebUI(object):
                                         self._open_normalizer,
                                         [
                                             norm_input_path,
+                                            norm_input_dir,
+                                            norm_input_glob,
                                             norm_output_path,
                                             norm_target_loud,
-                                            norm_max_peak
+                                            norm_max_peak,
+                                            norm_true_peak
                                         ],
                                         [norm_info, open_norm_btn]
                                     )
+                                    stop_norm_btn = gr.Button(
+                                        self.i18n("停止归一化"),
+                                        variant="stop",
+                                        visible=True
+                                    )
+                                    stop_norm_btn.click(self._stop_normalizer, None, [norm_info])
                 with gr.TabItem(self.i18n("2. 准备标注")):
                     with gr.TabItem(self.i18n("2.1. 生成标注")):
                         gr.Markdown(self.i18n("##### 生成准确率较高的标注。"))
@@ -284,6 +558,9 @@ class MainWebUI(object):
                                     file_count="multiple",
                                     interactive=True
                                 )
+                                with gr.Group():
+                                    merger_audio_input_dir = gr.Textbox(label=self.i18n("或使用服务器上的目录"), interactive=True)
+                                    merger_audio_input_glob = gr.Textbox(label=self.i18n("匹配模式"), value="**/*.wav", interactive=True)
                             with gr.Column():
                                 merger_subtitle_input_path = gr.File(
                                     label=self.i18n("上传标注"),
@@ -291,6 +568,9 @@ class MainWebUI(object):
                                     file_count="multiple",
                                     interactive=True
                                 )
+                                with gr.Group():
+                                    merger_subtitle_input_dir = gr.Textbox(label=self.i18n("或使用服务器上的目录"), interactive=True)
+                                    merger_subtitle_input_glob = gr.Textbox(label=self.i18n("匹配模式"), value="**/*.srt", interactive=True)
                             with gr.Column():
                                 merger_output_path = gr.Textbox(label=self.i18n("输出目录"), interactive=True)
                                 with gr.Group():
@@ -304,11 +584,21 @@ class MainWebUI(object):
                                         self._open_merger,
                                         [
                                             merger_audio_input_path,
+                                            merger_audio_input_dir,
+                                            merger_audio_input_glob,
                                             merger_subtitle_input_path,
+                                            merger_subtitle_input_dir,
+                                            merger_subtitle_input_glob,
                                             merger_output_path
                                         ],
                                         [merger_info, open_merger_btn]
                                     )
+                                    stop_merger_btn = gr.Button(
+                                        self.i18n("停止合并"),
+                                        variant="stop",
+                                        visible=True
+                                    )
+                                    stop_merger_btn.click(self._stop_merger, None, [merger_info])
                     with gr.TabItem(self.i18n("2.3. 校对标注")):
                         gr.Markdown(self.i18n("##### 手动校对 Transcriber 生成的标注。 | [点击此处下载最新的 Aegisub 正式版](https://aegisub.org/downloads)"))
                         with gr.Group():
@@ -321,7 +611,7 @@ class MainWebUI(object):
                             gr.Markdown(self.i18n("6. **请尽量确保每个合并节点之间的持续时间在 3..10 秒之间。** 在参考音频的制作中，不在此范围内的段落将会被排除。"))
                             gr.Markdown(self.i18n("7. **点击此处查看更详细的 Aegisub 教程：[视频版](https://www.bilibili.com/video/BV1oK411T7kL/)**"))
                 with gr.TabItem(self.i18n("3. 打包数据")):
-                    gr.Markdown(self.i18n("##### 将归一化后的音频和校对后的标注打包成适用于 GPT-SoVITS 的训练数据集。请注意，上传顺序要相对应。"))
+                    gr.Markdown(self.i18n("##### 将归一化后的音频和校对后的标注打包成适用于 GPT-SoVITS 的训练数据集。请注意，音频和标注按文件名配对，需一一同名。"))
                     with gr.Row():
                             with gr.Column():
                                 packer_audio_input_path = gr.File(
@@ -330,6 +620,9 @@ class MainWebUI(object):
                                     file_count="multiple",
                                     interactive=True
                                 )
+                                with gr.Group():
+                                    packer_audio_input_dir = gr.Textbox(label=self.i18n("或使用服务器上的目录"), interactive=True)
+                                    packer_audio_input_glob = gr.Textbox(label=self.i18n("匹配模式"), value="**/*.wav", interactive=True)
                             with gr.Column():
                                 packer_subtitle_input_path = gr.File(
                                     label=self.i18n("上传标注"),
@@ -337,8 +630,18 @@ class MainWebUI(object):
                                     file_count="multiple",
                                     interactive=True
                                 )
+                                with gr.Group():
+                                    packer_subtitle_input_dir = gr.Textbox(label=self.i18n("或使用服务器上的目录"), interactive=True)
+                                    packer_subtitle_input_glob = gr.Textbox(label=self.i18n("匹配模式"), value="**/*.srt", interactive=True)
                             with gr.Column():
                                 packer_output_path = gr.Textbox(label=self.i18n("输出目录"), interactive=True)
+                                packer_speaker = gr.Textbox(label=self.i18n("说话人"), interactive=True)
+                                packer_dedupe = gr.Dropdown(
+                                    label=self.i18n("查找重复的音频"),
+                                    choices=[(self.i18n("不查找"), ""), (self.i18n("只写出 duplicates.list"), "report"), (self.i18n("从列表中移除重复"), "drop")],
+                                    value="",
+                                    interactive=True
+                                )
                                 with gr.Group():
                                     packer_info = gr.Textbox(label=self.i18n("进程输出信息"), interactive=False)
                                     open_packer_btn = gr.Button(
@@ -350,13 +653,83 @@ class MainWebUI(object):
                                         self._open_packer,
                                         [
                                             packer_audio_input_path,
+                                            packer_audio_input_dir,
+                                            packer_audio_input_glob,
                                             packer_subtitle_input_path,
-                                            packer_output_path
+                                            packer_subtitle_input_dir,
+                                            packer_subtitle_input_glob,
+                                            packer_output_path,
+                                            packer_speaker,
+                                            packer_dedupe
                                         ],
                                         [packer_info, open_packer_btn]
                                     )
+                                    stop_packer_btn = gr.Button(
+                                        self.i18n("停止打包"),
+                                        variant="stop",
+                                        visible=True
+                                    )
+                                    stop_packer_btn.click(self._stop_packer, None, [packer_info])
                 with gr.TabItem(self.i18n("4. 参考音频")):
-                    with gr.TabItem(self.i18n("4.1. 情感识别")):
+                    with gr.TabItem(self.i18n("4.1. 筛选参考音频")):
+                        gr.Markdown(self.i18n("##### 从打包后的数据集中筛选参考音频，按人声占比、响度和语速排序。首次筛选会为 packed_mapping.list 建立索引。"))
+                        with gr.Row():
+                            with gr.Column():
+                                reference_list_path = gr.Textbox(label=self.i18n("packed_mapping.list 路径"), interactive=True)
+                                with gr.Row():
+                                    reference_speaker = gr.Textbox(label=self.i18n("说话人"), interactive=True)
+                                    reference_language = gr.Textbox(label=self.i18n("语言（例如 ZH、EN、JA、KO）"), interactive=True)
+                                with gr.Row():
+                                    reference_min_seconds = gr.Number(
+                                        label=self.i18n("最短时长（秒）"),
+                                        value=3.0,
+                                        step=0.1,
+                                        interactive=True
+                                    )
+                                    reference_max_seconds = gr.Number(
+                                        label=self.i18n("最长时长（秒）"),
+                                        value=10.0,
+                                        step=0.1,
+                                        interactive=True
+                                    )
+                                    reference_limit = gr.Number(
+                                        label=self.i18n("候选数量"),
+                                        value=20,
+                                        step=1,
+                                        precision=0,
+                                        interactive=True
+                                    )
+                                with gr.Group():
+                                    reference_info = gr.Textbox(label=self.i18n("进程输出信息"), interactive=False)
+                                    select_reference_btn = gr.Button(
+                                        self.i18n("开始筛选"),
+                                        variant="primary",
+                                        visible=True
+                                    )
+                        reference_table = gr.Dataframe(
+                            headers=[
+                                self.i18n("音频"),
+                                self.i18n("时长（秒）"),
+                                self.i18n("响度（分贝）"),
+                                self.i18n("人声占比"),
+                                self.i18n("语言"),
+                                self.i18n("文本")
+                            ],
+                            interactive=False
+                        )
+                        select_reference_btn.click(
+                            self._select_reference,
+                            [
+                                reference_list_path,
+                                reference_speaker,
+                                reference_language,
+                                reference_min_seconds,
+                                reference_max_seconds,
+                                reference_limit
+                            ],
+                            [reference_info, reference_table]
+                        )
+                    with gr.TabItem(self.i18n("4.2. 情感识别")):
                         gr.Markdown(self.i18n("##### 施工中，请稍等……"))
             app.queue(max_size=self.gr_max_size, default_concurrency_limit=self.gr_default_concurrency_limit).launch(
                 inbrowser=self.gr_is_inbrowser,
@@ -2,18 +2,30 @@ import shutil
 from pathlib import Path
 from typing import Optional
 from typing import Generator
+from contextlib import closing
 
-import librosa
 import numpy as np
-import soundfile as sf
 
 from i18n import I18nAuto
+from canceller import CancelToken
+from codec import Pcm24Segment
+from codec import read_segment
+from codec import write_audio
+from codec import write_segments
+from metrics import METRICS
+from metrics import StageRun
+from prefetcher import PREFETCHER
+from profiler import PROFILER
+from store import STORE
 
 
 class Merger(object):
 
     def __init__(self) -> None:
         self.i18n = I18nAuto()
+        # Scheduler cost: every uploaded clip is buffered before writing.
+        self.cpu_cost = 1
+        self.memory_cost = 4096
 
     def _unformat_time(self, timestamp: str) -> int:
         h, m, s, ms = map(int, (timestamp[17:19], timestamp[20:22], timestamp[23:25], timestamp[26:29]))
@@ -27,11 +39,52 @@ class Merger(object):
 
         return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
 
+    def merge_subtitles(self, durations: list[int], text_list: list[str], start_time: int = 0) -> tuple[str, int]:
+        # Durations in ms; returns the SRT text and where the next one would start.
+        subtitle_data = ''
+        for i, (duration, text) in enumerate(zip(durations, text_list), start=1):
+            end_time = start_time + duration
+            subtitle_data += f"{i}\n{self._format_time(start_time)} --> {self._format_time(end_time)}\n{text}\n\n"
+            start_time = end_time
+
+        return subtitle_data, start_time
+
+    def merge_audio(self, audio_data_list: list[np.ndarray]) -> np.ndarray:
+        return np.concatenate([np.zeros((0,))] + list(audio_data_list))
+
+    def merge(
+        self,
+        audio_data_list: list[np.ndarray],
+        text_list: list[str],
+        sample_rate: int
+    ) -> tuple[np.ndarray, str]:
+        durations = [int(len(audio_data) / sample_rate * 1000) for audio_data in audio_data_list]
+        subtitle_data, _ = self.merge_subtitles(durations, text_list)
+
+        return self.merge_audio(audio_data_list), subtitle_data
+
+    def _load(self, audio_path: str, run: StageRun) -> tuple[Pcm24Segment | np.ndarray, float]:
+        run.read(audio_path)
+        with run.time("decode"):
+            return read_segment(audio_path)
+
+    def _write(self, output_audio_path: str, audio_data: np.ndarray, sample_rate: float, run: StageRun) -> None:
+        with run.time("encode"):
+            write_audio(output_audio_path, audio_data, sample_rate)
+        run.wrote(output_audio_path)
+
+    def _write_segments(self, output_audio_path: str, segments: list[Pcm24Segment], sample_rate: float, run: StageRun) -> None:
+        with run.time("encode"):
+            write_segments(output_audio_path, segments, sample_rate)
+        run.wrote(output_audio_path)
+
+    @PROFILER("merger")
     def __call__(
         self,
         file_input_a: Optional[tuple[str]],
         file_input_b: Optional[tuple[str]],
-        output: str
+        output: str,
+        cancel: Optional[CancelToken] = None
     ) -> Generator[tuple[str, dict[str, str | bool]], None, None]:
         if file_input_a is None or file_input_b is None:
             error_msg = self.i18n("请上传需要合并的同名的音频和字幕。")
@@ -41,6 +94,8 @@ class Merger(object):
         file_list_a = (Path(file_path) for file_path in file_input_a)
         file_list_b = (Path(file_path) for file_path in file_input_b)
         output_path = Path(output)
+        if cancel is None:
+            cancel = CancelToken()
 
         proc_count = 0
         success_count = 0
@@ -50,6 +105,7 @@ class Merger(object):
         subtitle_path_list = []
         audio_data_list = []
         buffer = {}
+        run = METRICS.run("merger")
 
         for file in file_list_a:
             type = file.suffix
@@ -81,78 +137,108 @@ class Merger(object):
         merging_msg = f"合并中：检测到总共有 {proc_count} 组文件"
         print(merging_msg)
         yield merging_msg, {"__type__": "update", "visible": False}
-        for i in range(audio_path_list_len):
-            audio_path = audio_path_list[i]
-            audio_path_str = str(audio_path)
-            subtitle_path = subtitle_path_list[i]
-            subtitle_path_str = str(subtitle_path)
-
-            audio_base_name_with_index = audio_path.stem
-            subtitle_base_name_with_index = subtitle_path.stem
-
-            audio_base_name = audio_base_name_with_index.split("_")[0] if audio_base_name_with_index == subtitle_base_name_with_index else audio_base_name_with_index.split("_")[0]
-
-            sub_path = output_path / f"{audio_base_name}_merged"
-            if sub_path.exists():
-                shutil.rmtree(sub_path)
-            sub_path.mkdir(parents=True, exist_ok=True)
-
-            audio_name_ext = f"{audio_base_name}.wav"
-            output_audio_path = sub_path / audio_name_ext
-            output_audio_path_str = str(output_audio_path)
-
-            output_subtitle_name_ext = f"{audio_base_name}.srt"
-            output_subtitle_path = sub_path / output_subtitle_name_ext
-            output_subtitle_path_str = str(output_subtitle_path)
-
-            audio_data, sr = librosa.load(audio_path_str, sr=None)
-
-            with open(subtitle_path_str, "r", encoding="utf-8") as f:
-                subtitle_data = f.readlines()
-                index = index + int(subtitle_data[0].strip())
-                timestamp = subtitle_data[1].strip()
-                subtitle_text = subtitle_data[2].strip()
-
-                end_time = self._unformat_time(timestamp)
-
-            buffer.setdefault(audio_base_name, {
-                "audio_data_list": [np.zeros((0,))],
-                "output_audio_path": '',
-                "output_subtitle_path": ''
-            }).setdefault(index, {
-                "end_time": 0,
-                "text": ''
-            })
-            buffer[audio_base_name]["audio_data_list"].append(audio_data)
-            buffer[audio_base_name]["output_audio_path"] = output_audio_path_str
-            buffer[audio_base_name]["output_subtitle_path"] = output_subtitle_path_str
-            buffer[audio_base_name][index]["end_time"] = end_time
-            buffer[audio_base_name][index]["text"] = subtitle_text
-        for key, value in buffer.items():
-            audio_data_list = value["audio_data_list"]
-            output_audio_path_str = value["output_audio_path"]
-            output_subtitle_path_str = value["output_subtitle_path"]
-
-            merged_audio_data = np.concatenate(audio_data_list)
-            sf.write(
-                output_audio_path_str,
-                merged_audio_data,
-                sr,
-                subtype="PCM_24",
-                endian="LITTLE",
-                format="WAV"
-            )
-
-            with open(output_subtitle_path_str, "w", encoding="utf-8") as f:
-                for i in range(audio_path_list_len):
-                    i += 1
-                    end_time = start_time + value[i]["end_time"]
-                    text = value[i]["text"]
-
-                    f.write(f"{i}\n{self._format_time(start_time)} --> {self._format_time(end_time)}\n{text}\n\n")
-
-                    start_time = end_time
-                    success_count += 1
-        done_msg = self.i18n(f"合并完毕：最终成功合并 {success_count} 个文件")
+
+        # Subtitle times run on across episodes, so the whole run is one artifact rather than one per file.
+        params = {"version": 1, "audio": [path.name for path in audio_path_list], "subtitles": [path.name for path in subtitle_path_list]}
+        artifact_key = STORE.key("merger", params, audio_path_list + subtitle_path_list)
+        if STORE.contains(artifact_key):
+            for sub_path in {output_path / f"{audio_path.stem.split('_')[0]}_merged" for audio_path in audio_path_list}:
+                shutil.rmtree(sub_path, ignore_errors=True)
+            if STORE.get(artifact_key, output_path) is not None:
+                run.add("cache_hits")
+                run.close()
+                done_msg = f"{self.i18n(f'合并完毕：复用已有的合并结果 -> {output_path}')}。{run.summary()}"
+                print(done_msg)
+                yield done_msg, {"__type__": "update", "visible": True}
+                return
+        reads = PREFETCHER.read(lambda audio_path: self._load(str(audio_path), run), audio_path_list, run)
+        with closing(reads):
+            for i, (audio_path, future) in enumerate(reads):
+                if cancel.cancelled:
+                    break
+                subtitle_path = subtitle_path_list[i]
+                subtitle_path_str = str(subtitle_path)
+
+                audio_base_name_with_index = audio_path.stem
+                subtitle_base_name_with_index = subtitle_path.stem
+
+                audio_base_name = audio_base_name_with_index.split("_")[0] if audio_base_name_with_index == subtitle_base_name_with_index else audio_base_name_with_index.split("_")[0]
+
+                sub_path = output_path / f"{audio_base_name}_merged"
+                if sub_path.exists():
+                    shutil.rmtree(sub_path)
+                sub_path.mkdir(parents=True, exist_ok=True)
+
+                audio_name_ext = f"{audio_base_name}.wav"
+                output_audio_path = sub_path / audio_name_ext
+                output_audio_path_str = str(output_audio_path)
+
+                output_subtitle_name_ext = f"{audio_base_name}.srt"
+                output_subtitle_path = sub_path / output_subtitle_name_ext
+                output_subtitle_path_str = str(output_subtitle_path)
+
+                audio_data, sr = future.result()
+
+                with open(subtitle_path_str, "r", encoding="utf-8") as f:
+                    subtitle_data = f.readlines()
+                    index = index + int(subtitle_data[0].strip())
+                    timestamp = subtitle_data[1].strip()
+                    subtitle_text = subtitle_data[2].strip()
+
+                    end_time = self._unformat_time(timestamp)
+
+                buffer.setdefault(audio_base_name, {
+                    "audio_data_list": [],
+                    "output_audio_path": '',
+                    "output_subtitle_path": ''
+                }).setdefault(index, {
+                    "end_time": 0,
+                    "text": ''
+                })
+                buffer[audio_base_name]["audio_data_list"].append(audio_data)
+                buffer[audio_base_name]["output_audio_path"] = output_audio_path_str
+                buffer[audio_base_name]["output_subtitle_path"] = output_subtitle_path_str
+                buffer[audio_base_name][index]["end_time"] = end_time
+                buffer[audio_base_name][index]["text"] = subtitle_text
+        with PREFETCHER.writer(run) as writer:
+            for key, value in buffer.items():
+                if cancel.cancelled:
+                    break
+                audio_data_list = value["audio_data_list"]
+                output_audio_path_str = value["output_audio_path"]
+                output_subtitle_path_str = value["output_subtitle_path"]
+
+                if all(isinstance(segment, Pcm24Segment) for segment in audio_data_list):
+                    # PCM_24 chunks are joined as raw bytes, the merged file never goes through float.
+                    writer.submit(self._write_segments, output_audio_path_str, audio_data_list, sr, run)
+                else:
+                    writer.submit(self._write, output_audio_path_str, self.merge_audio(audio_data_list), sr, run)
+                run.add("files")
+
+                # Same SRT layout as the pipeline, with each chunk's length taken from its own subtitle.
+                chunk_indices = range(1, audio_path_list_len + 1)
+                subtitle_data, start_time = self.merge_subtitles(
+                    [value[i]["end_time"] for i in chunk_indices],
+                    [value[i]["text"] for i in chunk_indices],
+                    start_time
+                )
+                with open(output_subtitle_path_str, "w", encoding="utf-8") as f:
+                    f.write(subtitle_data)
+                success_count += audio_path_list_len
+        if not cancel.cancelled:
+            output_paths = [Path(value[name]) for value in buffer.values() for name in ("output_audio_path", "output_subtitle_path")]
+            STORE.put(artifact_key, "merger", output_path, output_paths)
+        run.close()
+        if cancel.cancelled:
+            # A merged file is written in one go, so an interrupted episode only leaves its empty folder behind.
+            for value in buffer.values():
+                sub_path = Path(value["output_audio_path"]).parent
+                if sub_path.is_dir() and not Path(value["output_subtitle_path"]).exists():
+                    shutil.rmtree(sub_path)
+            stop_msg = self.i18n(f"合并已停止：最终成功合并 {success_count} 个文件，未完成的输出已删除")
+            print(stop_msg)
+            yield stop_msg, {"__type__": "update", "visible": True}
+            return
+        done_msg = f"{self.i18n(f'合并完毕：最终成功合并 {success_count} 个文件')}。{run.summary()}"
         print(done_msg)
         yield done_msg, {"__type__":"update","visible":True}
@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Generator
+from typing import Optional
+
+
+PHASES = ("decode", "analysis", "inference", "encode")
+PHASE_NAMES = {"decode": "解码", "analysis": "分析", "inference": "推理", "encode": "编码"}
+
+
+class StageRun(object):
+
+    def __init__(self, registry: "Metrics", stage: str) -> None:
+        self.registry = registry
+        self.stage = stage
+        self.values = defaultdict(float)
+        self.lock = threading.Lock()
+        self.start_time = time.perf_counter()
+
+    def add(self, name: str, value: float = 1.0) -> None:
+        # Read-ahead and write-behind threads report into the same run.
+        with self.lock:
+            self.values[name] += value
+        self.registry.add(self.stage, name, value)
+
+    def set(self, name: str, value: float) -> None:
+        self.registry.set(self.stage, name, value)
+
+    @contextmanager
+    def time(self, phase: str) -> Generator[None, None, None]:
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(f"{phase}_seconds", time.perf_counter() - start_time)
+
+    def read(self, path) -> None:
+        self.add("bytes_read", os.path.getsize(path))
+
+    def wrote(self, path) -> None:
+        self.add("bytes_written", os.path.getsize(path))
+
+    def summary(self) -> str:
+        parts = [f"{PHASE_NAMES[phase]} {self.values[f'{phase}_seconds']:.2f} s" for phase in PHASES if f"{phase}_seconds" in self.values]
+        parts.append(f"读取 {self.values['bytes_read'] / (1 << 20):.1f} MB")
+        parts.append(f"写入 {self.values['bytes_written'] / (1 << 20):.1f} MB")
+        parts.append(f"失败 {int(self.values['failures'])}")
+
+        return "，".join(parts)
+
+    def close(self) -> None:
+        self.registry.record(self.stage, dict(self.values), time.perf_counter() - self.start_time)
+
+
+class Metrics(object):
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.values = defaultdict(float)
+        self.gauges = {}
+        self.jsonl_path = os.environ.get("metrics_file")
+        self.port = int(os.environ.get("metrics_port", 0))
+        self.server = None
+
+    def run(self, stage: str) -> StageRun:
+        return StageRun(self, stage)
+
+    def add(self, stage: str, name: str, value: float = 1.0) -> None:
+        with self.lock:
+            self.values[(stage, name)] += value
+
+    def set(self, stage: str, name: str, value: float) -> None:
+        with self.lock:
+            self.gauges[(stage, name)] = value
+
+    def merge(self, snapshot: dict[str, dict[str, float]]) -> None:
+        for stage, values in snapshot.items():
+            for name, value in values.items():
+                self.add(stage, name, value)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.values.clear()
+            self.gauges.clear()
+
+    def snapshot(self) -> dict[str, dict[str, float]]:
+        snapshot = {}
+        with self.lock:
+            for (stage, name), value in self.values.items():
+                snapshot.setdefault(stage, {})[name] = value
+
+        return snapshot
+
+    def gauge_snapshot(self) -> dict[str, dict[str, float]]:
+        snapshot = {}
+        with self.lock:
+            for (stage, name), value in self.gauges.items():
+                snapshot.setdefault(stage, {})[name] = value
+
+        return snapshot
+
+    def record(self, stage: str, values: dict[str, float], elapsed: float) -> None:
+        if not self.jsonl_path:
+            return
+        line = json.dumps({"time": time.time(), "stage": stage, "elapsed_seconds": elapsed, **values}, ensure_ascii=False)
+        with self.lock, open(self.jsonl_path, 'a', encoding="utf-8") as f:
+            f.write(f"{line}\n")
+
+    def to_prometheus(self) -> str:
+        lines = []
+        for stage, values in sorted(self.snapshot().items()):
+            for name, value in sorted(values.items()):
+                lines.append(f'gsomapper_{name}_total{{stage="{stage}"}} {value}')
+        for stage, values in sorted(self.gauge_snapshot().items()):
+            for name, value in sorted(values.items()):
+                lines.append(f'gsomapper_{name}{{stage="{stage}"}} {value}')
+
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: Optional[int] = None) -> None:
+        port = self.port if port is None else port
+        if self.server is not None or not port:
+            return
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self) -> None:
+                if self.path == "/metrics":
+                    body = metrics.to_prometheus().encode("utf-8")
+                    content_type = "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body = json.dumps({"counters": metrics.snapshot(), "gauges": metrics.gauge_snapshot()}, ensure_ascii=False).encode("utf-8")
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+        # Bound to loopback only, the endpoint is meant for a local scraper.
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"Metrics: http://127.0.0.1:{port}/metrics")
+
+
+METRICS = Metrics()
@@ -2,28 +2,85 @@ import shutil
 from pathlib import Path
 from typing import Generator
 from typing import Optional
+from contextlib import closing
 
 import librosa
 import numpy as np
-import soundfile as sf
 from pyloudnorm import Meter
 
 from i18n import I18nAuto
+from canceller import CancelToken
+from codec import read_audio
+from codec import write_audio
+from metrics import METRICS
+from metrics import StageRun
+from prefetcher import PREFETCHER
+from profiler import PROFILER
+from store import STORE
+
+# ITU-R BS.1770-4 Annex 2: 4x oversampling through a 48-tap FIR, split into four phases of 12 taps.
+TRUE_PEAK_PHASES = np.array([
+    [0.0017089843750, 0.0109863281250, -0.0196533203125, 0.0332031250000, -0.0594482421875, 0.1373291015625, 0.9721679687500, -0.1022949218750, 0.0476074218750, -0.0266113281250, 0.0148925781250, -0.0083007812500],
+    [-0.0291748046875, 0.0292968750000, -0.0517578125000, 0.0891113281250, -0.1665039062500, 0.4650878906250, 0.7797851562500, -0.2003173828125, 0.1015625000000, -0.0582275390625, 0.0330810546875, -0.0189208984375],
+    [-0.0189208984375, 0.0330810546875, -0.0582275390625, 0.1015625000000, -0.2003173828125, 0.7797851562500, 0.4650878906250, -0.1665039062500, 0.0891113281250, -0.0517578125000, 0.0292968750000, -0.0291748046875],
+    [-0.0083007812500, 0.0148925781250, -0.0266113281250, 0.0476074218750, -0.1022949218750, 0.9721679687500, 0.1373291015625, -0.0594482421875, 0.0332031250000, -0.0196533203125, 0.0109863281250, 0.0017089843750]
+], dtype=np.float32)
+# Oversampled values are only computed for spans of this many samples that could still raise the peak, a batch of spans at a time.
+TRUE_PEAK_SPAN = 1024
+TRUE_PEAK_BATCH = 64
+# No interpolated value exceeds the largest input in its window by more than the largest phase's absolute tap sum.
+TRUE_PEAK_GAIN = float(np.abs(TRUE_PEAK_PHASES).sum(axis=1).max())
+
+
+def true_peak(audio_data: np.ndarray) -> float:
+    y = np.asarray(audio_data).reshape(-1)
+    if not len(y):
+        return 0.0
+    # Polyphase form: each phase is a 12-tap FIR over the original samples, so the 4x signal is never built.
+    taps = TRUE_PEAK_PHASES[:, ::-1].T
+    order = taps.shape[0] - 1
+    span_count = -(-(len(y) + order) // TRUE_PEAK_SPAN)
+    # Zeros before and after: the filter starts from silence and rings out past the last sample, where an overshoot can still land.
+    padded = np.zeros(order + span_count * TRUE_PEAK_SPAN, dtype=np.float32)
+    padded[order:order + len(y)] = y
+    span_peaks = np.abs(padded[order:]).reshape(span_count, TRUE_PEAK_SPAN).max(axis=1)
+    # The interpolator is not exact at the sample positions; the sample peak is the floor of the result.
+    peak = float(span_peaks.max())
+    # The windows of a span reach back into the one before it.
+    bounds = np.maximum(span_peaks, np.r_[0.0, span_peaks[:-1]]) * TRUE_PEAK_GAIN
+    candidates = np.flatnonzero(bounds > peak)
+    # Loudest first, so the peak rises early and the quiet spans left over are never filtered at all.
+    candidates = candidates[np.argsort(-bounds[candidates], kind="stable")]
+    offsets = np.arange(TRUE_PEAK_SPAN + order)
+    for start in range(0, len(candidates), TRUE_PEAK_BATCH):
+        batch = candidates[start:start + TRUE_PEAK_BATCH]
+        batch = batch[bounds[batch] > peak]
+        if not len(batch):
+            break
+        windows = np.lib.stride_tricks.sliding_window_view(padded[batch[:, None] * TRUE_PEAK_SPAN + offsets], order + 1, axis=1)
+        peak = max(peak, float(np.abs(windows @ taps).max()))
+
+    return peak
 
 
 class Normalizer(object):
 
     def __init__(self) -> None:
         self.i18n = I18nAuto()
+        # Scheduler cost: files are streamed, only the read-ahead and write-behind queues are held at once.
+        self.cpu_cost = 1
+        self.memory_cost = 512 * (1 + PREFETCHER.read_ahead + PREFETCHER.write_behind)
 
     def _normalize_loudness(
         self,
         audio_data: np.ndarray,
         input_loud: float,
         target_loud: float,
-        target_max_peak: float
+        target_max_peak: float,
+        use_true_peak: bool = False
     ) -> np.ndarray:
-        audio_max_peak = np.max(np.abs(audio_data))
+        # Sample peaks miss the overshoot between samples that a DAC or a later resample reconstructs.
+        audio_max_peak = true_peak(audio_data) if use_true_peak else np.max(np.abs(audio_data))
         target_max_peak = np.power(10.0, target_max_peak / 20.0)
 
         delta_loud = target_loud - input_loud
@@ -38,12 +95,52 @@ class Normalizer(object):
 
         return normalized_audio_data
 
+    def normalize(
+        self,
+        audio_data: np.ndarray,
+        sample_rate: int,
+        target_loud: float = -16.0,
+        max_peak: float = -1.0,
+        use_true_peak: bool = False
+    ) -> np.ndarray:
+        origin_loud = Meter(sample_rate).integrated_loudness(audio_data)
+        if use_true_peak:
+            # Resampled before limiting, so the ceiling holds on what is written, the resampler's own overshoot included.
+            resampled_audio_data = librosa.resample(audio_data, orig_sr=sample_rate, target_sr=48000.0)
+            return self._normalize_loudness(resampled_audio_data, origin_loud, target_loud, max_peak, True)
+        normalized_audio_data = self._normalize_loudness(
+            audio_data,
+            origin_loud,
+            target_loud,
+            max_peak
+        )
+        resampled_audio_data = librosa.resample(normalized_audio_data, orig_sr=sample_rate, target_sr=48000.0)
+
+        return resampled_audio_data
+
+    def _load(self, audio_path: str, params: dict[str, str | float], run: StageRun) -> tuple[Optional[str], Optional[np.ndarray], Optional[float]]:
+        key = STORE.key("normalizer", {**params, "name": Path(audio_path).name}, [audio_path])
+        # A stored result is linked into place later, there is nothing to decode.
+        if STORE.contains(key):
+            return key, None, None
+        run.read(audio_path)
+        with run.time("decode"):
+            return key, *read_audio(audio_path)
+
+    def _write(self, output_path: str, audio_data: np.ndarray, run: StageRun) -> None:
+        with run.time("encode"):
+            write_audio(output_path, audio_data, 48000)
+        run.wrote(output_path)
+
+    @PROFILER("normalizer")
     def __call__(
         self,
         input: Optional[tuple[str]],
         output: str,
         target_loud: float = -16.0,
-        max_peak: float = -1.0
+        max_peak: float = -1.0,
+        use_true_peak: bool = False,
+        cancel: Optional[CancelToken] = None
     ) -> Generator[tuple[str, dict[str, str | bool]], None, None]:
         if input is None:
             error_msg = self.i18n("请上传需要归一化的音频。")
@@ -52,74 +149,93 @@ class Normalizer(object):
             return
         file_list = (Path(file_path) for file_path in input)
         output_path = Path(output)
-
-        self.proc_count = 0
-        self.success_count = 0
-        self.audio_path_list = []
-        self.output_audio_path_list = []
-        self.buffer = {}
-
-        for file in file_list:
-            file_path = str(file)
-            type = file.suffix
-            if type == '' or not type == ".wav":
-                continue_msg = self.i18n(f"跳过：{file_path}。")
-                print(continue_msg)
-                yield continue_msg, {"__type__": "update", "visible": False}
-                continue
-            self.audio_path_list.append(str(file_path))
-            self.proc_count += 1
-
-            audio_name = file.stem.split("_")[0]
-            audio_name_ext = file.name
-            sub_path = output_path / f"{audio_name}_normalized"
-            if sub_path.exists():
-                shutil.rmtree(sub_path)
-            sub_path.mkdir(parents=True, exist_ok=True)
-            output_audio_path = sub_path / audio_name_ext
-            self.output_audio_path_list.append(str(output_audio_path))
-
-        normalizing_msg = self.i18n(f"归一化中：检测到总共有 {self.proc_count} 个文件")
+        if cancel is None:
+            cancel = CancelToken()
+
+        # One instance serves every request, so nothing about this run is kept on self.
+        proc_count = 0
+        success_count = 0
+        output_audio_path_list = []
+        prepared_paths = set()
+        stored = []
+        params = {"version": 1, "target_loud": target_loud, "max_peak": max_peak}
+        if use_true_peak:
+            # Only added when on, results stored by the sample-peak path keep their keys.
+            params["true_peak"] = True
+        run = METRICS.run("normalizer")
+
+        def audio_paths() -> Generator[tuple[str, str], None, None]:
+            nonlocal proc_count
+            for file in file_list:
+                file_path = str(file)
+                type = file.suffix
+                if type == '' or not type == ".wav":
+                    print(self.i18n(f"跳过：{file_path}。"))
+                    continue
+                proc_count += 1
+
+                audio_name = file.stem.split("_")[0]
+                audio_name_ext = file.name
+                sub_path = output_path / f"{audio_name}_normalized"
+                # Chunks of one episode share a folder, it is cleared only when the first of them comes by.
+                if sub_path not in prepared_paths:
+                    if sub_path.exists():
+                        shutil.rmtree(sub_path)
+                    sub_path.mkdir(parents=True, exist_ok=True)
+                    prepared_paths.add(sub_path)
+                output_audio_path = sub_path / audio_name_ext
+                output_audio_path_list.append(str(output_audio_path))
+                yield file_path, str(output_audio_path)
+
+        normalizing_msg = self.i18n("归一化中：正在逐个读取输入的音频")
         print(normalizing_msg)
         yield normalizing_msg, {"__type__": "update", "visible": False}
-        audio_path_list_len = len(self.audio_path_list)
-        for i in range(audio_path_list_len):
-            audio_path = self.audio_path_list[i]
-            output_audio_path = self.output_audio_path_list[i]
-
-            audio_data, sr = librosa.load(audio_path, sr=None)
-            audio_duration_s = librosa.get_duration(y=audio_data, sr=sr)
-            if audio_duration_s == 0:
-                error_msg = self.i18n(f"归一化失败：请确保输入音频不为空 -> {audio_path}")
-                print(error_msg)
-                yield error_msg, {"__type__": "update", "visible": False}
-                continue
-
-            self.buffer.setdefault(audio_path, {"audio_data": np.zeros((0,)), "sample_rate": 0.0, "output_path": ''})
-            self.buffer[audio_path]["audio_data"] = audio_data
-            self.buffer[audio_path]["sample_rate"] = sr
-            self.buffer[audio_path]["output_path"] = output_audio_path
-        for key, value in self.buffer.items():
-            audio_data = value["audio_data"]
-            sample_rate = value["sample_rate"]
-            output_path = value["output_path"]
-            origin_loud = Meter(sample_rate).integrated_loudness(audio_data)
-            normalized_audio_data = self._normalize_loudness(
-                audio_data,
-                origin_loud,
-                target_loud,
-                max_peak
-            )
-            resampled_audio_data = librosa.resample(normalized_audio_data, orig_sr=sample_rate, target_sr=48000.0)
-            sf.write(
-                output_path,
-                resampled_audio_data,
-                48000,
-                subtype="PCM_24",
-                endian="LITTLE",
-                format="WAV"
-            )
-            self.success_count += 1
-        done_msg = self.i18n(f"归一化完毕：最终成功归一化 {self.success_count} 个文件")
+        # Files are streamed one by one, so a directory with far more audio than memory can go through.
+        reads = PREFETCHER.read(lambda paths: self._load(paths[0], params, run), audio_paths(), run)
+        # Loudness of the next file is measured while the previous one is still being encoded.
+        with closing(reads), PREFETCHER.writer(run) as writer:
+            for (audio_path, output_audio_path), future in reads:
+                if cancel.cancelled:
+                    break
+
+                key, audio_data, sr = future.result()
+                if audio_data is None:
+                    if STORE.get(key, Path(output_audio_path).parent) is not None:
+                        run.add("cache_hits")
+                        run.add("files")
+                        success_count += 1
+                        continue
+                    # Evicted since it was looked up, so it is decoded after all.
+                    run.read(audio_path)
+                    with run.time("decode"):
+                        audio_data, sr = read_audio(audio_path)
+                audio_duration_s = librosa.get_duration(y=audio_data, sr=sr)
+                if audio_duration_s == 0:
+                    run.add("failures")
+                    error_msg = self.i18n(f"归一化失败：请确保输入音频不为空 -> {audio_path}")
+                    print(error_msg)
+                    yield error_msg, {"__type__": "update", "visible": False}
+                    continue
+
+                with run.time("analysis"):
+                    resampled_audio_data = self.normalize(audio_data, sr, target_loud, max_peak, use_true_peak)
+                writer.submit(self._write, output_audio_path, resampled_audio_data, run)
+                run.add("files")
+                success_count += 1
+                stored.append((key, output_audio_path))
+        # Only after the writer has flushed, an artifact must never be stored before its file is complete.
+        for key, output_audio_path in stored:
+            STORE.put(key, "normalizer", Path(output_audio_path).parent, [output_audio_path])
+        run.close()
+        if cancel.cancelled:
+            # Files are written whole, so only the folders that never got an output are left to remove.
+            for sub_path in {Path(path).parent for path in output_audio_path_list}:
+                if sub_path.is_dir() and not any(sub_path.iterdir()):
+                    sub_path.rmdir()
+            stop_msg = self.i18n(f"归一化已停止：最终成功归一化 {success_count} 个文件，未完成的输出已删除")
+            print(stop_msg)
+            yield stop_msg, {"__type__": "update", "visible": True}
+            return
+        done_msg = f"{self.i18n(f'归一化完毕：检测到总共有 {proc_count} 个文件，最终成功归一化 {success_count} 个文件')}。{run.summary()}"
         print(done_msg)
         yield done_msg, {"__type__":"update","visible":True}
@@ -1,28 +1,62 @@
+import os
+import time
 from pathlib import Path
 from typing import Optional
 from typing import Generator
+from uuid import uuid4
+from contextlib import closing
+
+import soundfile as sf
 
 from i18n import I18nAuto
+from canceller import CancelToken
+from integrator import TempDir
+from integrator import check_speaker
+from integrator import iter_pack_pairs
+from metrics import METRICS
 
 class Packer(object):
 
-    def __init__(self) -> None:
+    def __init__(self, workers: Optional[int] = None, langs: Optional[list[str]] = None) -> None:
         self.i18n = I18nAuto()
+        # Half the machine by default, a pack must not claim the whole scheduler budget and lock every other tab out.
+        self.workers = max(1, (os.cpu_count() or 1) // 2) if workers is None else max(1, workers)
+        self.langs = langs
+        # Scheduler cost: one process per worker, each holding one source file.
+        self.cpu_cost = self.workers
+        self.memory_cost = 1024 * self.workers
 
     def __call__(
         self,
         file_input_a: Optional[tuple[str]],
         file_input_b: Optional[tuple[str]],
-        output: str
+        output: str,
+        speaker: str,
+        dedupe: Optional[str] = None,
+        cancel: Optional[CancelToken] = None
     ) -> Generator[tuple[str, dict[str, str | bool]], None, None]:
         if file_input_a is None or file_input_b is None:
             error_msg = self.i18n("请上传需要合并的同名的音频和字幕。")
             print(error_msg)
             yield error_msg, {"__type__": "update", "visible": True}
             return
+        if not speaker:
+            error_msg = self.i18n("请输入说话人。")
+            print(error_msg)
+            yield error_msg, {"__type__": "update", "visible": True}
+            return
+        try:
+            check_speaker(speaker)
+        except ValueError as e:
+            error_msg = self.i18n(str(e))
+            print(error_msg)
+            yield error_msg, {"__type__": "update", "visible": True}
+            return
         file_list_a = (Path(file_path) for file_path in file_input_a)
         file_list_b = (Path(file_path) for file_path in file_input_b)
         output_path = Path(output)
+        if cancel is None:
+            cancel = CancelToken()
 
         proc_count = 0
         success_count = 0
@@ -47,16 +81,77 @@ class Packer(object):
                 continue
             subtitle_path = file
             subtitle_path_list.append(subtitle_path)
-        audio_path_list_len = len(audio_path_list)
-        subtitle_path_list_len = len(subtitle_path_list)
-        if audio_path_list_len != subtitle_path_list_len:
-            error_msg = "请确保上传的音频数量与字幕数量相匹配。"
+        # Paired by name like the integrator CLI, the two upload boxes do not keep a common order.
+        audio_paths = {}
+        subtitle_paths = {}
+        for paths, path_list in ((audio_paths, audio_path_list), (subtitle_paths, subtitle_path_list)):
+            for path in path_list:
+                if path.stem in paths:
+                    error_msg = self.i18n(f"请确保上传的文件没有重名：{path.name}")
+                    print(error_msg)
+                    yield error_msg, {"__type__": "update", "visible": True}
+                    return
+                paths[path.stem] = path
+        unmatched = sorted(audio_paths.keys() ^ subtitle_paths.keys())
+        if unmatched:
+            error_msg = self.i18n(f"请确保上传的音频与字幕一一同名，以下文件找不到对应的音频或字幕：{'，'.join(unmatched)}")
             print(error_msg)
             yield error_msg, {"__type__": "update", "visible": True}
             return
-        proc_count = audio_path_list_len
+        proc_count = len(audio_paths)
+
+        # Uploads land in separate temp folders, so pairs are named after the audio instead of their path.
+        pairs = {pair_name: (subtitle_paths[pair_name], audio_path) for pair_name, audio_path in audio_paths.items()}
 
         merging_msg = f"打包中：检测到总共有 {proc_count} 组文件"
         print(merging_msg)
         yield merging_msg, {"__type__": "update", "visible": False}
 
+        temp_path = Path(os.environ.get("TEMP", "temp")) / f"packer_{uuid4()}"
+        start_time = time.perf_counter()
+        packed_duration = 0.0
+        run = METRICS.run("packer")
+        pack_pairs = iter_pack_pairs(
+            pairs,
+            output_path,
+            speaker,
+            temp_path,
+            self.langs,
+            workers=self.workers,
+            dedupe=dedupe,
+            # Set to a directory on shared storage, the pairs are packed by broker workers instead of local processes.
+            queue=os.environ.get("queue_dir") or None,
+            run=run
+        )
+        with TempDir(temp_path), closing(pack_pairs):
+            try:
+                for pair_name, is_reused in pack_pairs:
+                    if cancel.cancelled:
+                        break
+                    success_count += 1
+                    if not is_reused:
+                        # Inside the try, an upload libsndfile cannot read ends the run with the same failure message as any pack error.
+                        packed_duration += sf.info(str(pairs[pair_name][1])).duration
+                    elapsed = time.perf_counter() - start_time
+                    speed = packed_duration / elapsed if elapsed > 0 else 0.0
+                    progress_msg = f"打包中：{success_count}/{proc_count} {pair_name}{'（复用）' if is_reused else ''}，速度 {speed:.1f} 秒音频/秒"
+                    print(progress_msg)
+                    yield progress_msg, {"__type__": "update", "visible": False}
+            except Exception as e:
+                run.close()
+                error_msg = f"打包失败：{e}"
+                print(error_msg)
+                yield error_msg, {"__type__": "update", "visible": True}
+                return
+
+        run.close()
+        if cancel.cancelled:
+            # Closing the generator above already saved the finished pairs, so the next run picks up from there.
+            stop_msg = self.i18n("打包已停止：已完成的文件会在下次打包时复用")
+            print(stop_msg)
+            yield stop_msg, {"__type__": "update", "visible": True}
+            return
+        new_mapping_list_path = output_path / speaker / "packed_mapping.list"
+        done_msg = f"{self.i18n(f'打包完毕：最终成功打包 {success_count} 组文件 -> {new_mapping_list_path}')}。{run.summary()}"
+        print(done_msg)
+        yield done_msg, {"__type__": "update", "visible": True}
@@ -0,0 +1,301 @@
+import os
+import shutil
+import mimetypes
+import threading
+from pathlib import Path
+from queue import Empty
+from queue import Queue
+from typing import Callable
+from typing import Iterable
+from typing import Generator
+from typing import Optional
+from argparse import ArgumentParser
+from uuid import uuid4
+
+import numpy as np
+
+from codec import write_audio
+from slicer import Slicer
+from normalizer import Normalizer
+from merger import Merger
+from integrator import TempDir
+from integrator import check_speaker
+from integrator import pair_pack_wav
+
+_STOP = object()
+
+
+class Stage(object):
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[dict], Iterable[dict]],
+        workers: int = 1
+    ) -> None:
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+
+
+class Pipeline(object):
+
+    def __init__(self, stages: list[Stage], queue_size: int = 8) -> None:
+        self.stages = stages
+        self.queue_size = queue_size
+        self.messages = Queue()
+
+    def _work(self, stage: Stage, input_queue: Queue, output_queue: Optional[Queue]) -> None:
+        while True:
+            item = input_queue.get()
+            if item is _STOP:
+                # Hand the sentinel on to the other workers of the same stage.
+                input_queue.put(_STOP)
+                return
+            try:
+                for output in stage.func(item):
+                    if output_queue is not None:
+                        output_queue.put(output)
+            except Exception as e:
+                self.messages.put(f"{stage.name} 失败：{item.get('name', '')}，{e}")
+
+    def _feed(self, items: Iterable[dict], input_queue: Queue) -> None:
+        for item in items:
+            input_queue.put(item)
+        input_queue.put(_STOP)
+
+    def _close(self, threads: list[threading.Thread], output_queue: Optional[Queue]) -> None:
+        for thread in threads:
+            thread.join()
+        if output_queue is not None:
+            output_queue.put(_STOP)
+
+    def __call__(self, items: Iterable[dict]) -> Generator[str, None, None]:
+        queues = [Queue(maxsize=self.queue_size) for _ in self.stages]
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0]), daemon=True)]
+        for i, stage in enumerate(self.stages):
+            output_queue = queues[i + 1] if i + 1 < len(queues) else None
+            workers = [
+                threading.Thread(target=self._work, args=(stage, queues[i], output_queue), daemon=True)
+                for _ in range(stage.workers)
+            ]
+            threads.extend(workers)
+            threads.append(threading.Thread(target=self._close, args=(workers, output_queue), daemon=True))
+        for thread in threads:
+            thread.start()
+
+        while any(thread.is_alive() for thread in threads):
+            try:
+                yield self.messages.get(timeout=0.1)
+            except Empty:
+                continue
+        while not self.messages.empty():
+            yield self.messages.get()
+
+
+class PipelineRunner(object):
+
+    def __init__(
+        self,
+        output: str,
+        speaker: str,
+        threshold: float = -16.0,
+        min_length: int = 5000,
+        min_interval: int = 100,
+        hop_size: int = 100,
+        max_sil_kept: int = 100,
+        target_loud: float = -16.0,
+        max_peak: float = -1.0,
+        use_true_peak: bool = False,
+        langs: Optional[list[str]] = None,
+        workers: Optional[dict[str, int]] = None,
+        queue_size: int = 8,
+        keep_intermediate: bool = False
+    ) -> None:
+        self.output_path = Path(output)
+        # Names the output folder and every clip, same rule as the packer and the integrator.
+        self.speaker = check_speaker(speaker)
+        self.target_loud = target_loud
+        self.max_peak = max_peak
+        self.use_true_peak = use_true_peak
+        self.langs = tuple(langs) if langs else None
+        # Normalization is mostly bound by the GIL (pyloudnorm, resampling), more threads than this only overlap its numpy parts.
+        self.workers = {"slice": 1, "normalize": 2, "transcribe": 1, "pack": 2}
+        self.workers.update(workers or {})
+        self.queue_size = queue_size
+        self.keep_intermediate = keep_intermediate
+
+        self.slicer = Slicer(threshold, min_length, min_interval, hop_size, max_sil_kept)
+        self.norm = Normalizer()
+        self.merger = Merger()
+        self.tran = None
+        self.sr = self.slicer.sr
+
+        self.intermediate_path = self.output_path / "intermediate"
+        self.temp_path = Path(os.environ.get("TEMP", "temp")) / f"pipeline_{uuid4()}"
+        self.messages = Queue()
+        self.chunk_buffer = {}
+        self.fragment_paths = {}
+
+    def _write_intermediate(self, sub_dir: str, name: str, audio_data: np.ndarray) -> None:
+        if not self.keep_intermediate:
+            return
+        sub_path = self.intermediate_path / sub_dir
+        sub_path.mkdir(parents=True, exist_ok=True)
+        write_audio(sub_path / f"{name}.wav", audio_data, self.sr)
+
+    def _slice(self, item: dict) -> Generator[dict, None, None]:
+        audio_data = self.slicer.decode(str(item["path"]))
+        chunks = self.slicer.slice(audio_data)
+        self.messages.put(f"切分完毕：{item['name']}，{len(chunks)} 段")
+        for i, chunk in enumerate(chunks, start=1):
+            # Same scale as reading back the PCM_24 file the slicer tab writes.
+            chunk = chunk.astype(np.float32) / np.float32(2 ** 31)
+            self._write_intermediate(f"{item['name']}_sliced", f"{Path(item['name']).name}_{i}", chunk)
+            yield {"name": item["name"], "index": i, "total": len(chunks), "audio_data": chunk}
+
+    def _normalize(self, item: dict) -> Generator[dict, None, None]:
+        item["audio_data"] = self.norm.normalize(item["audio_data"], self.sr, self.target_loud, self.max_peak, self.use_true_peak)
+        self._write_intermediate(f"{item['name']}_normalized", f"{Path(item['name']).name}_{item['index']}", item["audio_data"])
+        yield item
+
+    def _transcribe(self, item: dict) -> Generator[dict, None, None]:
+        item["text"] = self.tran.transcribe([item["audio_data"]], self.sr)[0]
+        yield item
+
+    def _merge(self, item: dict) -> Generator[dict, None, None]:
+        chunks = self.chunk_buffer.setdefault(item["name"], {})
+        chunks[item["index"]] = item
+        if len(chunks) < item["total"]:
+            return
+        del self.chunk_buffer[item["name"]]
+
+        ordered = [chunks[i] for i in sorted(chunks)]
+        merged_audio_data, subtitle_data = self.merger.merge(
+            [chunk["audio_data"] for chunk in ordered],
+            [chunk["text"] for chunk in ordered],
+            self.sr
+        )
+        yield {"name": item["name"], "audio_data": merged_audio_data, "subtitle_data": subtitle_data}
+
+    def _pack(self, item: dict) -> Generator[dict, None, None]:
+        if self.keep_intermediate:
+            sub_path = self.intermediate_path / f"{item['name']}_merged"
+        else:
+            sub_path = self.temp_path / "merged_pairs" / item["name"]
+        sub_path.mkdir(parents=True, exist_ok=True)
+        audio_path = sub_path / f"{Path(item['name']).name}.wav"
+        subtitle_path = sub_path / f"{Path(item['name']).name}.srt"
+        write_audio(audio_path, item["audio_data"], self.sr)
+        with subtitle_path.open("w", encoding="utf-8") as f:
+            f.write(item["subtitle_data"])
+
+        self.fragment_paths[item["name"]] = pair_pack_wav(
+            subtitle_path,
+            audio_path,
+            item["name"],
+            self.output_path,
+            self.speaker,
+            self.temp_path,
+            self.langs
+        )
+        self.messages.put(f"打包完毕：{item['name']}")
+        yield item
+
+    def __call__(self, input_paths: Iterable[Path], root: Optional[Path] = None) -> Generator[str, None, None]:
+        # Loaded here so that building a runner does not pull the ASR model into memory.
+        if self.tran is None:
+            from transcriber import Transcriber
+            self.tran = Transcriber(lang="auto")
+
+        items = []
+        names = set()
+        for path in input_paths:
+            type = mimetypes.guess_type(str(path))[0]
+            if type is None or not type.startswith(("video", "audio")):
+                continue
+            # Every per-file buffer is keyed by name, so it has to be unique: the path under root, or the stem numbered on a clash.
+            name = Path(path).relative_to(root).with_suffix('').as_posix() if root is not None else Path(path).stem
+            if name in names:
+                name = f"{name}_{len(items) + 1}"
+            names.add(name)
+            items.append({"name": name, "path": path})
+
+        pipeline = Pipeline(
+            [
+                Stage("切分", self._slice, self.workers["slice"]),
+                Stage("归一化", self._normalize, self.workers["normalize"]),
+                Stage("转写", self._transcribe, self.workers["transcribe"]),
+                # Merging collects the chunks of each file, so it has to stay on one worker.
+                Stage("合并", self._merge, 1),
+                Stage("打包", self._pack, self.workers["pack"])
+            ],
+            self.queue_size
+        )
+        self.messages = pipeline.messages
+        self.chunk_buffer = {}
+        self.fragment_paths = {}
+
+        start_msg = f"流水线运行中：检测到总共有 {len(items)} 个文件"
+        print(start_msg)
+        yield start_msg
+        with TempDir(self.temp_path):
+            for msg in pipeline(items):
+                print(msg)
+                yield msg
+            for name in self.chunk_buffer:
+                error_msg = f"合并失败：{name}，部分片段未能处理"
+                print(error_msg)
+                yield error_msg
+
+            output_dir = self.output_path / self.speaker
+            output_dir.mkdir(parents=True, exist_ok=True)
+            with output_dir.joinpath("packed_mapping.list").open("w", encoding="utf-8") as new_mapping_list:
+                for name in sorted(self.fragment_paths):
+                    with self.fragment_paths[name].open("r", encoding="utf-8") as fragment:
+                        shutil.copyfileobj(fragment, new_mapping_list)
+
+        done_msg = f"流水线完毕：最终成功处理 {len(self.fragment_paths)} 个文件 -> {output_dir / 'packed_mapping.list'}"
+        print(done_msg)
+        yield done_msg
+
+
+def main():
+    parser = ArgumentParser(description="从原始视频或音频一键生成 GPT-SoVITS 训练数据集")
+    parser.add_argument("input", type=str, help="处理的目录")
+    parser.add_argument("output", type=str, help="输出的目录")
+    parser.add_argument("speaker", type=str, help="说话人")
+    parser.add_argument("--langs", type=str, nargs="+", default=None, help="限定识别的语言，例如：zh en ja ko")
+    parser.add_argument("--slice-workers", type=int, default=1, help="切分的线程数")
+    parser.add_argument("--normalize-workers", type=int, default=2, help="归一化的线程数（大部分计算受 GIL 限制，线程更多收益有限）")
+    parser.add_argument("--transcribe-workers", type=int, default=1, help="转写的线程数")
+    parser.add_argument("--pack-workers", type=int, default=2, help="打包的线程数")
+    parser.add_argument("--queue-size", type=int, default=8, help="各阶段之间的队列长度")
+    parser.add_argument("--true-peak", action="store_true", help="归一化时按真峰值（4 倍过采样）限制最大振幅")
+    parser.add_argument("--keep-intermediate", action="store_true", help="保存各阶段的中间文件")
+    args = parser.parse_args()
+    try:
+        check_speaker(args.speaker)
+    except ValueError as e:
+        parser.error(str(e))
+
+    runner = PipelineRunner(
+        args.output,
+        args.speaker,
+        use_true_peak=args.true_peak,
+        langs=args.langs,
+        workers={
+            "slice": args.slice_workers,
+            "normalize": args.normalize_workers,
+            "transcribe": args.transcribe_workers,
+            "pack": args.pack_workers
+        },
+        queue_size=args.queue_size,
+        keep_intermediate=args.keep_intermediate
+    )
+    for _ in runner(sorted(path for path in Path(args.input).rglob("*") if path.is_file()), Path(args.input)):
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+import os
+import time
+import threading
+from queue import Queue
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from typing import Any
+from typing import Callable
+from typing import Iterable
+from typing import Generator
+from typing import Optional
+
+from metrics import StageRun
+from profiler import PROFILER
+
+_STOP = object()
+
+
+class WriteBehind(object):
+
+    def __init__(self, depth: int, run: Optional[StageRun] = None) -> None:
+        self.depth = depth
+        self.run = run
+        self.queue = Queue(maxsize=depth)
+        self.error = None
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+        if self.run is not None:
+            self.run.set("write_behind_depth", depth)
+
+    def _work(self) -> None:
+        while True:
+            task = self.queue.get()
+            if task is _STOP:
+                return
+            func, args, kwargs = task
+            # After the first failure the rest is drained unwritten, the error surfaces on the caller's side.
+            if self.error is None:
+                try:
+                    func(*args, **kwargs)
+                except BaseException as e:
+                    self.error = e
+            if self.run is not None:
+                self.run.set("write_behind_queued", self.queue.qsize())
+
+    def _raise(self) -> None:
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def submit(self, func: Callable, *args, **kwargs) -> None:
+        self._raise()
+        start_time = time.perf_counter()
+        self.queue.put((PROFILER.bind(func), args, kwargs))
+        if self.run is not None:
+            self.run.add("write_wait_seconds", time.perf_counter() - start_time)
+            self.run.set("write_behind_queued", self.queue.qsize())
+
+    def close(self) -> None:
+        if self.thread.is_alive():
+            self.queue.put(_STOP)
+            self.thread.join()
+        if self.run is not None:
+            self.run.set("write_behind_queued", 0)
+        self._raise()
+
+    def __enter__(self) -> "WriteBehind":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if exc_type is None:
+            self.close()
+            return
+        # The original exception wins over anything the writer hit afterwards.
+        try:
+            self.close()
+        except BaseException:
+            pass
+
+
+class Prefetcher(object):
+
+    def __init__(self) -> None:
+        self.read_ahead = max(1, int(os.environ.get("read_ahead", 2)))
+        self.write_behind = max(1, int(os.environ.get("write_behind", 8)))
+
+    def read(
+        self,
+        load: Callable[[Any], Any],
+        items: Iterable[Any],
+        run: Optional[StageRun] = None,
+        depth: Optional[int] = None
+    ) -> Generator[tuple[Any, Future], None, None]:
+        depth = self.read_ahead if depth is None else max(1, depth)
+        items = iter(items)
+        pending = deque()
+        executor = ThreadPoolExecutor(max_workers=depth)
+        if run is not None:
+            run.set("read_ahead_depth", depth)
+
+        def fill() -> None:
+            while len(pending) < depth:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+                pending.append((item, executor.submit(PROFILER.bind(load), item)))
+
+        try:
+            fill()
+            while pending:
+                item, future = pending.popleft()
+                fill()
+                start_time = time.perf_counter()
+                # Exceptions stay inside the future, so the caller decides per item whether to skip or abort.
+                wait((future,))
+                if run is not None:
+                    run.add("read_wait_seconds", time.perf_counter() - start_time)
+                    run.set("read_ahead_in_flight", len(pending))
+                yield item, future
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def writer(self, run: Optional[StageRun] = None, depth: Optional[int] = None) -> WriteBehind:
+        return WriteBehind(self.write_behind if depth is None else max(1, depth), run)
+
+
+PREFETCHER = Prefetcher()
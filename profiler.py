@@ -0,0 +1,140 @@
+import io
+import os
+import time
+import pstats
+import cProfile
+import inspect
+import threading
+import functools
+import tracemalloc
+from pathlib import Path
+from typing import Callable
+from typing import Optional
+from contextvars import ContextVar
+from uuid import uuid4
+
+# Profiles of the calls a run hands to read-ahead and write-behind threads, set only while one of its steps executes.
+_THREAD_PROFILES: ContextVar[Optional[list[cProfile.Profile]]] = ContextVar("thread_profiles", default=None)
+
+
+class Profiler(object):
+
+    def __init__(self) -> None:
+        self.enabled = True if os.environ.get("profile", "False").lower() == "true" else False
+        self.report_path = Path(os.environ.get("profile_dir", "profiles"))
+        self.top = int(os.environ.get("profile_top", 50))
+        # Runs of several tabs or workers overlap; tracing stops only when the last of them is done.
+        self.lock = threading.Lock()
+        self.tracers = 0
+        self.owns_tracing = False
+
+    def __call__(self, stage: str) -> Callable:
+        def decorator(func: Callable) -> Callable:
+            is_generator = inspect.isgeneratorfunction(func)
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                # Switched off, the only cost left is this attribute check.
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                if is_generator:
+                    return self._profile_generator(stage, func(*args, **kwargs))
+                return self._profile_call(stage, func, *args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def bind(self, func: Callable) -> Callable:
+        # Called where work is handed to another thread; cProfile only sees the thread it was enabled on.
+        thread_profiles = _THREAD_PROFILES.get()
+        if thread_profiles is None:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Newer Pythons allow one active profiler, and it already follows every thread.
+                return func(*args, **kwargs)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.disable()
+                # Added once finished, a call still in flight when the run ends is left out of its report.
+                thread_profiles.append(profile)
+
+        return wrapper
+
+    def _start(self) -> tuple[cProfile.Profile, list[cProfile.Profile]]:
+        with self.lock:
+            if self.tracers == 0:
+                self.owns_tracing = not tracemalloc.is_tracing()
+                if self.owns_tracing:
+                    tracemalloc.start(25)
+            self.tracers += 1
+            tracemalloc.reset_peak()
+
+        return cProfile.Profile(), []
+
+    def _stop(self, stage: str, profile: cProfile.Profile, thread_profiles: list[cProfile.Profile], elapsed: float) -> None:
+        with self.lock:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            self.tracers -= 1
+            if self.tracers == 0 and self.owns_tracing:
+                tracemalloc.stop()
+
+        report_dir = self.report_path / f"{time.strftime('%Y%m%d-%H%M%S')}_{stage}_{os.getpid()}_{uuid4().hex[:8]}"
+        report_dir.mkdir(parents=True, exist_ok=True)
+
+        stats_buffer = io.StringIO()
+        # Decoding and encoding run on the prefetcher's threads, their calls are part of the same report.
+        stats = pstats.Stats(profile, *thread_profiles, stream=stats_buffer)
+        stats.dump_stats(str(report_dir / "profile.pstats"))
+        stats.sort_stats("cumulative").print_stats(self.top)
+        stats.sort_stats("tottime").print_stats(self.top)
+        with report_dir.joinpath("profile.txt").open('w', encoding="utf-8") as f:
+            f.write(f"stage: {stage}\nelapsed: {elapsed:.3f} s\n\n")
+            f.write(stats_buffer.getvalue())
+
+        with report_dir.joinpath("allocations.txt").open('w', encoding="utf-8") as f:
+            f.write(f"stage: {stage}\ncurrent: {current / (1 << 20):.1f} MB\npeak: {peak / (1 << 20):.1f} MB\n\n")
+            for stat in snapshot.statistics("lineno")[:self.top]:
+                f.write(f"{stat}\n")
+        print(f"Profile: {report_dir}")
+
+    def _profile_call(self, stage: str, func: Callable, *args, **kwargs):
+        profile, thread_profiles = self._start()
+        start_time = time.perf_counter()
+        token = _THREAD_PROFILES.set(thread_profiles)
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            _THREAD_PROFILES.reset(token)
+            self._stop(stage, profile, thread_profiles, time.perf_counter() - start_time)
+
+    def _profile_generator(self, stage: str, generator):
+        profile, thread_profiles = self._start()
+        start_time = time.perf_counter()
+        try:
+            while True:
+                # Gradio may resume the generator from another thread, so the profiler follows each step.
+                token = _THREAD_PROFILES.set(thread_profiles)
+                profile.enable()
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    profile.disable()
+                    _THREAD_PROFILES.reset(token)
+                yield item
+        finally:
+            generator.close()
+            self._stop(stage, profile, thread_profiles, time.perf_counter() - start_time)
+
+
+PROFILER = Profiler()
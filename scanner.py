@@ -0,0 +1,69 @@
+import re
+import threading
+from pathlib import Path
+from queue import Queue
+from typing import Generator
+from typing import Optional
+
+_DONE = object()
+_DIGITS = re.compile(r"(\d+)")
+
+
+def natural_key(path: str) -> list[str | int]:
+    # ep001_2 before ep001_10, the order a file picker would hand the files over in.
+    return [int(part) if part.isdigit() else part.lower() for part in _DIGITS.split(str(path))]
+
+
+def resolve_dir(directory: str, roots: Optional[list[str]] = None) -> Path:
+    # No roots means no server-side directories at all, never every directory the server can see.
+    if not roots:
+        raise ValueError("未配置 ingest_roots，不能使用服务器上的目录")
+    path = Path(directory).expanduser().resolve()
+    if not path.is_dir():
+        raise ValueError(f"输入目录不存在：{directory}")
+    if not any(path.is_relative_to(Path(root).expanduser().resolve()) for root in roots):
+        raise ValueError(f"输入目录不在允许的范围内：{directory}")
+
+    return path
+
+
+def check_pattern(pattern: str) -> str:
+    # A pattern could otherwise climb out of the directory that was checked against the roots.
+    if Path(pattern).is_absolute() or ".." in Path(pattern).parts:
+        raise ValueError(f"匹配模式不能包含 .. 或绝对路径：{pattern}")
+
+    return pattern or "**/*"
+
+
+def scan(directory: Path, pattern: str = "**/*", ordered: bool = False) -> Generator[str, None, None]:
+    if ordered:
+        # Paired inputs are matched by position, which needs the whole listing in a stable order first.
+        yield from sorted(scan(directory, pattern), key=natural_key)
+        return
+    # The walk runs on its own thread, so the first files are processed while a large tree is still being listed.
+    queue = Queue()
+    stop = threading.Event()
+
+    def walk() -> None:
+        try:
+            for path in directory.glob(pattern):
+                if stop.is_set():
+                    return
+                if path.is_file():
+                    queue.put(str(path))
+        except BaseException as e:
+            queue.put(e)
+        finally:
+            queue.put(_DONE)
+
+    threading.Thread(target=walk, daemon=True).start()
+    try:
+        while True:
+            item = queue.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
@@ -0,0 +1,128 @@
+import threading
+import itertools
+from collections import deque
+from collections import Counter
+from collections import OrderedDict
+from typing import Callable
+from typing import Generator
+from typing import Optional
+
+from canceller import CancelToken
+
+
+class Ticket(object):
+
+    def __init__(self, user: str, cpu: int, memory: int) -> None:
+        self.user = user
+        self.cpu = cpu
+        self.memory = memory
+        self.admitted = False
+
+
+class Scheduler(object):
+
+    def __init__(self, cpu_budget: int, memory_budget: int) -> None:
+        self.cpu_budget = max(1, cpu_budget)
+        self.memory_budget = max(1, memory_budget)
+        self.cpu_used = 0
+        self.memory_used = 0
+        self.running = 0
+
+        self.cond = threading.Condition()
+        # One FIFO per user; users take turns, so one user's batch cannot starve the others.
+        self.waiting = OrderedDict()
+        self.active = Counter()
+
+    def _users(self) -> list[str]:
+        # Users with fewer running jobs go first; ties keep their turn order.
+        return sorted(self.waiting, key=lambda user: self.active[user])
+
+    def _order(self) -> list[Ticket]:
+        rounds = itertools.zip_longest(*(self.waiting[user] for user in self._users()))
+        return [ticket for tickets in rounds for ticket in tickets if ticket is not None]
+
+    def _fits(self, ticket: Ticket) -> bool:
+        if self.running == 0:
+            return True
+        return self.cpu_used + ticket.cpu <= self.cpu_budget and self.memory_used + ticket.memory <= self.memory_budget
+
+    def _dispatch(self) -> None:
+        while self.waiting:
+            user = self._users()[0]
+            tickets = self.waiting[user]
+            ticket = tickets[0]
+            # Strict turn order: a large job at the front waits for capacity instead of being overtaken forever.
+            if not self._fits(ticket):
+                break
+            tickets.popleft()
+            del self.waiting[user]
+            if tickets:
+                self.waiting[user] = tickets
+
+            ticket.admitted = True
+            self.cpu_used += ticket.cpu
+            self.memory_used += ticket.memory
+            self.running += 1
+            self.active[user] += 1
+        self.cond.notify_all()
+
+    def _enqueue(self, user: str, cpu: int, memory: int) -> Ticket:
+        ticket = Ticket(user, min(max(1, cpu), self.cpu_budget), min(max(0, memory), self.memory_budget))
+        with self.cond:
+            self.waiting.setdefault(user, deque()).append(ticket)
+            self._dispatch()
+
+        return ticket
+
+    def _finish(self, ticket: Ticket) -> None:
+        with self.cond:
+            if ticket.admitted:
+                self.cpu_used -= ticket.cpu
+                self.memory_used -= ticket.memory
+                self.running -= 1
+                self.active[ticket.user] -= 1
+                if not self.active[ticket.user]:
+                    del self.active[ticket.user]
+            elif ticket.user in self.waiting:
+                self.waiting[ticket.user].remove(ticket)
+                if not self.waiting[ticket.user]:
+                    del self.waiting[ticket.user]
+            self._dispatch()
+
+    def position(self, ticket: Ticket) -> int:
+        return self._order().index(ticket) + 1
+
+    def __call__(
+        self,
+        user: str,
+        cpu: int,
+        memory: int,
+        job: Callable[[], Generator[tuple[str, dict[str, str | bool]], None, None]],
+        cancel: Optional[CancelToken] = None
+    ) -> Generator[tuple[str, dict[str, str | bool]], None, None]:
+        ticket = self._enqueue(user, cpu, memory)
+        try:
+            last_position = None
+            while True:
+                if cancel is not None and cancel.cancelled:
+                    stop_msg = "已停止：任务在排队时被取消"
+                    print(stop_msg)
+                    yield stop_msg, {"__type__": "update", "visible": True}
+                    return
+                with self.cond:
+                    if not ticket.admitted and self.position(ticket) == last_position:
+                        self.cond.wait(timeout=1.0)
+                    if ticket.admitted:
+                        break
+                    position = self.position(ticket)
+                    cpu_used, memory_used = self.cpu_used, self.memory_used
+                if position != last_position:
+                    last_position = position
+                    queue_msg = f"排队中：第 {position} 位，CPU {cpu_used}/{self.cpu_budget} 核，内存 {memory_used}/{self.memory_budget} MB"
+                    print(queue_msg)
+                    yield queue_msg, {"__type__": "update", "visible": False}
+
+            for res in job():
+                yield res
+        finally:
+            self._finish(ticket)
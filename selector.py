@@ -0,0 +1,243 @@
+import os
+import json
+import time
+from pathlib import Path
+from typing import Optional
+from argparse import ArgumentParser
+from itertools import islice
+from contextlib import closing
+
+import numpy as np
+
+from codec import read_audio
+from metrics import METRICS
+from prefetcher import PREFETCHER
+
+INDEX_NAME = "reference_index.json"
+INDEX_COLUMNS = ("path", "speaker", "language", "text", "size", "mtime_ns", "duration", "loudness", "speech_ratio", "text_length")
+FEATURE_COLUMNS = ("duration", "loudness", "speech_ratio")
+FRAME_SECONDS = 0.02
+# A frame counts as speech when it is within this many dB of the clip's loudest frame and above the floor.
+SPEECH_RANGE_DB = 35.0
+SPEECH_FLOOR_DB = -60.0
+BATCH_SIZE = 256
+
+
+def clip_features(clips: list[np.ndarray], sample_rates: list[int]) -> dict[str, np.ndarray]:
+    # All clips of a batch are laid end to end and framed at once; reduceat keeps frames from crossing clip borders.
+    lengths = np.array([len(clip) for clip in clips], dtype=np.int64)
+    hops = np.maximum(1, (np.asarray(sample_rates) * FRAME_SECONDS).astype(np.int64))
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    frame_counts = np.maximum(1, -(-lengths // hops))
+    frame_clip = np.repeat(np.arange(len(clips)), frame_counts)
+    frame_first = np.concatenate(([0], np.cumsum(frame_counts)[:-1]))
+    frame_starts = offsets[frame_clip] + (np.arange(len(frame_clip)) - frame_first[frame_clip]) * hops[frame_clip]
+    frame_starts = np.minimum(frame_starts, max(0, lengths.sum() - 1))
+
+    y = np.concatenate([np.asarray(clip, dtype=np.float32) for clip in clips]) if lengths.sum() else np.zeros(1, dtype=np.float32)
+    power = np.square(y, dtype=np.float64)
+    frame_sums = np.add.reduceat(power, frame_starts)
+    # reduceat hands back a single sample for an empty range, an empty clip has no energy at all.
+    frame_sums[frame_first[lengths == 0]] = 0.0
+    frame_ends = np.append(frame_starts[1:], len(power))
+    frame_ends[np.append(frame_first[1:], len(frame_clip)) - 1] = offsets + lengths
+    frame_lengths = np.maximum(1, frame_ends - frame_starts)
+    frame_db = 10.0 * np.log10(np.maximum(frame_sums / frame_lengths, 1e-12))
+
+    peak_db = np.maximum.reduceat(frame_db, frame_first)
+    speech = frame_db > np.maximum(peak_db[frame_clip] - SPEECH_RANGE_DB, SPEECH_FLOOR_DB)
+    clip_power = np.bincount(frame_clip, weights=frame_sums, minlength=len(clips)) / np.maximum(1, lengths)
+
+    return {
+        "duration": lengths / np.asarray(sample_rates, dtype=np.float64),
+        "loudness": 10.0 * np.log10(np.maximum(clip_power, 1e-12)),
+        "speech_ratio": np.bincount(frame_clip, weights=speech, minlength=len(clips)) / frame_counts
+    }
+
+
+class ReferenceIndex(object):
+
+    def __init__(self, mapping_list_path: Path, index: Optional[dict[str, list]] = None) -> None:
+        self.mapping_list_path = Path(mapping_list_path)
+        self.index_path = self.mapping_list_path.with_name(INDEX_NAME)
+        index = {column: [] for column in INDEX_COLUMNS} if index is None else index
+        self.columns = {column: np.asarray(index[column]) for column in INDEX_COLUMNS}
+        self.list_state = None
+        # Scheduler cost of a build: clips are decoded on the read-ahead threads and featured a batch at a time.
+        self.cpu_cost = 1
+        self.memory_cost = 512 * (1 + PREFETCHER.read_ahead)
+
+    def __len__(self) -> int:
+        return len(self.columns["path"])
+
+    @staticmethod
+    def _list_state(mapping_list_path: Path) -> list[int]:
+        stat = mapping_list_path.stat()
+        return [stat.st_size, stat.st_mtime_ns]
+
+    @classmethod
+    def load(cls, mapping_list_path: Path) -> "ReferenceIndex":
+        mapping_list_path = Path(mapping_list_path)
+        index_path = mapping_list_path.with_name(INDEX_NAME)
+        if not index_path.exists():
+            return cls(mapping_list_path)
+        with index_path.open('r', encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("columns") != list(INDEX_COLUMNS):
+            return cls(mapping_list_path)
+        reference_index = cls(mapping_list_path, data["index"])
+        reference_index.list_state = data.get("list_state")
+
+        return reference_index
+
+    def is_current(self) -> bool:
+        return self.list_state == self._list_state(self.mapping_list_path)
+
+    def save(self) -> None:
+        data = {
+            "columns": list(INDEX_COLUMNS),
+            "list_state": self.list_state,
+            "index": {column: values.tolist() for column, values in self.columns.items()}
+        }
+        temp_path = self.index_path.with_suffix(".tmp")
+        with temp_path.open('w', encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(temp_path, self.index_path)
+
+    def build(self) -> "ReferenceIndex":
+        run = METRICS.run("selector")
+        list_state = self._list_state(self.mapping_list_path)
+        # Clips whose file has not changed keep their features, so re-indexing after another pack only reads the new ones.
+        known = {
+            path: (size, mtime_ns, *(self.columns[column][i] for column in FEATURE_COLUMNS))
+            for i, (path, size, mtime_ns) in enumerate(zip(self.columns["path"], self.columns["size"], self.columns["mtime_ns"]))
+        }
+        rows = []
+        with self.mapping_list_path.open('r', encoding="utf-8") as mapping_list:
+            for line in mapping_list:
+                parts = line.rstrip("\n").split('|', 3)
+                if len(parts) != 4:
+                    continue
+                audio_path, speaker, language, text = parts
+                source_audio_path = self.mapping_list_path.parent / Path(audio_path).name
+                if not source_audio_path.exists():
+                    run.add("failures")
+                    continue
+                stat = source_audio_path.stat()
+                rows.append([audio_path, speaker, language, text, stat.st_size, stat.st_mtime_ns, source_audio_path])
+
+        features = {}
+        stale = []
+        for row in rows:
+            cached = known.get(row[0])
+            if cached is not None and tuple(cached[:2]) == (row[4], row[5]):
+                features[row[0]] = dict(zip(FEATURE_COLUMNS, cached[2:]))
+            else:
+                stale.append(row)
+        reads = PREFETCHER.read(lambda row: read_audio(row[6]), stale, run)
+        with closing(reads):
+            while True:
+                batch = list(islice(reads, BATCH_SIZE))
+                if not batch:
+                    break
+                clips = []
+                sample_rates = []
+                for row, future in batch:
+                    run.read(row[6])
+                    with run.time("decode"):
+                        y, sr = future.result()
+                    clips.append(y)
+                    sample_rates.append(sr)
+                with run.time("analysis"):
+                    values = clip_features(clips, sample_rates)
+                for i, (row, _) in enumerate(batch):
+                    features[row[0]] = {column: float(values[column][i]) for column in FEATURE_COLUMNS}
+                run.add("files", len(batch))
+
+        index = {column: [] for column in INDEX_COLUMNS}
+        for audio_path, speaker, language, text, size, mtime_ns, _ in rows:
+            for column, value in zip(INDEX_COLUMNS[:6], (audio_path, speaker, language, text, size, mtime_ns)):
+                index[column].append(value)
+            for column in FEATURE_COLUMNS:
+                index[column].append(features[audio_path][column])
+            index["text_length"].append(len(text.strip()))
+        self.columns = {column: np.asarray(index[column]) for column in INDEX_COLUMNS}
+        self.list_state = list_state
+        run.close()
+
+        return self
+
+    def query(
+        self,
+        speaker: Optional[str] = None,
+        language: Optional[str] = None,
+        min_seconds: float = 3.0,
+        max_seconds: float = 10.0,
+        limit: int = 20
+    ) -> list[dict[str, str | float | int]]:
+        columns = self.columns
+        if not len(self):
+            return []
+        mask = (columns["duration"] >= min_seconds) & (columns["duration"] <= max_seconds)
+        if speaker:
+            mask &= columns["speaker"] == speaker
+        if language:
+            mask &= columns["language"] == language
+        candidates = np.flatnonzero(mask)
+        if not len(candidates):
+            return []
+
+        # Mostly speech first, then loudness close to the typical clip of the selection, then a natural speaking rate.
+        loudness = columns["loudness"][candidates]
+        rate = columns["text_length"][candidates] / columns["duration"][candidates]
+        score = (
+            columns["speech_ratio"][candidates]
+            - np.abs(loudness - np.median(loudness)) / 20.0
+            - np.abs(rate - np.median(rate)) / np.maximum(np.median(rate), 1.0) / 2.0
+        )
+        top = candidates[np.argsort(-score, kind="stable")[:limit]]
+
+        return [
+            {
+                "path": str(self.mapping_list_path.parent / Path(columns["path"][i]).name),
+                "speaker": str(columns["speaker"][i]),
+                "language": str(columns["language"][i]),
+                "text": str(columns["text"][i]),
+                "duration": round(float(columns["duration"][i]), 2),
+                "loudness": round(float(columns["loudness"][i]), 1),
+                "speech_ratio": round(float(columns["speech_ratio"][i]), 2),
+                "text_length": int(columns["text_length"][i])
+            }
+            for i in top
+        ]
+
+
+def load_index(mapping_list_path: Path) -> ReferenceIndex:
+    reference_index = ReferenceIndex.load(mapping_list_path)
+    if not reference_index.is_current():
+        reference_index.build().save()
+
+    return reference_index
+
+
+def main():
+    parser = ArgumentParser(description="从 packed_mapping.list 中筛选参考音频")
+    parser.add_argument("input", type=str, help="packed_mapping.list 的路径")
+    parser.add_argument("--speaker", type=str, default=None, help="说话人")
+    parser.add_argument("--language", type=str, default=None, help="语言，例如 ZH、EN、JA、KO")
+    parser.add_argument("--min-seconds", type=float, default=3.0, help="最短时长（秒）")
+    parser.add_argument("--max-seconds", type=float, default=10.0, help="最长时长（秒）")
+    parser.add_argument("--limit", type=int, default=20, help="返回的候选数量")
+    args = parser.parse_args()
+
+    reference_index = load_index(Path(args.input))
+    start_time = time.perf_counter()
+    results = reference_index.query(args.speaker, args.language, args.min_seconds, args.max_seconds, args.limit)
+    elapsed_ms = (time.perf_counter() - start_time) * 1000
+    for result in results:
+        print(f"{result['path']}|{result['duration']} s|{result['loudness']} dB|{result['speech_ratio']}|{result['text']}")
+    print(f"在 {len(reference_index)} 条音频中找到 {len(results)} 条候选，用时 {elapsed_ms:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+import os
+import json
+from pathlib import Path
+from argparse import ArgumentParser
+
+import numpy as np
+
+from codec import read_audio
+from codec import write_audio
+
+INDEX_NAME = "index.json"
+SHARD_DTYPE = np.dtype("<f4")
+INDEX_COLUMNS = ("id", "shard", "offset", "frames", "sample_rate", "speaker", "language", "text")
+
+
+class ShardWriter(object):
+
+    def __init__(self, output_dir: Path, shard_size: int = 1 << 30) -> None:
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.shard_size = shard_size
+
+        self.shards = []
+        self.index = {column: [] for column in INDEX_COLUMNS}
+        self.shard_file = None
+        self.offset = 0
+
+    def _open_shard(self) -> None:
+        if self.shard_file is not None:
+            self.shard_file.close()
+        shard_name = f"shard_{len(self.shards):05d}.bin"
+        self.shards.append(shard_name)
+        self.shard_file = self.output_dir.joinpath(shard_name).open("wb")
+        self.offset = 0
+
+    def add(
+        self,
+        clip_id: str,
+        audio_data: np.ndarray,
+        sample_rate: int,
+        speaker: str,
+        language: str,
+        text: str
+    ) -> None:
+        data = np.ascontiguousarray(audio_data, dtype=SHARD_DTYPE)
+        if self.shard_file is None or (self.offset > 0 and self.offset + data.nbytes > self.shard_size):
+            self._open_shard()
+        self.shard_file.write(data.tobytes())
+
+        for column, value in zip(
+            INDEX_COLUMNS,
+            (clip_id, len(self.shards) - 1, self.offset, len(data), sample_rate, speaker, language, text)
+        ):
+            self.index[column].append(value)
+        self.offset += data.nbytes
+
+    def close(self) -> None:
+        if self.shard_file is not None:
+            self.shard_file.close()
+            self.shard_file = None
+
+        index_path = self.output_dir / INDEX_NAME
+        temp_index_path = index_path.with_suffix(".tmp")
+        with temp_index_path.open('w', encoding="utf-8") as f:
+            json.dump({"dtype": SHARD_DTYPE.str, "shards": self.shards, "clips": self.index}, f, ensure_ascii=False)
+        os.replace(temp_index_path, index_path)
+
+    def __enter__(self) -> "ShardWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+
+class ShardReader(object):
+
+    def __init__(self, shard_dir: Path) -> None:
+        self.shard_dir = Path(shard_dir)
+        with self.shard_dir.joinpath(INDEX_NAME).open('r', encoding="utf-8") as f:
+            index = json.load(f)
+
+        self.dtype = np.dtype(index["dtype"])
+        self.clips = index["clips"]
+        self.shard = np.asarray(self.clips["shard"], dtype=np.int32)
+        self.offset = np.asarray(self.clips["offset"], dtype=np.int64)
+        self.frames = np.asarray(self.clips["frames"], dtype=np.int64)
+        self.sample_rate = np.asarray(self.clips["sample_rate"], dtype=np.int32)
+        self.maps = [
+            np.memmap(self.shard_dir / shard_name, dtype=self.dtype, mode='r') if self.shard_dir.joinpath(shard_name).stat().st_size > 0
+            else np.zeros((0,), dtype=self.dtype)
+            for shard_name in index["shards"]
+        ]
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def audio(self, i: int) -> np.ndarray:
+        start = self.offset[i] // self.dtype.itemsize
+
+        return self.maps[self.shard[i]][start:start + self.frames[i]]
+
+    def meta(self, i: int) -> dict[str, str | int]:
+        return {column: self.clips[column][i] for column in INDEX_COLUMNS}
+
+    def __getitem__(self, i: int) -> tuple[np.ndarray, dict[str, str | int]]:
+        return self.audio(i), self.meta(i)
+
+
+def list_pack_shards(mapping_list_path, output_dir, shard_size=1 << 30):
+    with mapping_list_path.open('r', encoding="utf-8") as mapping_list, ShardWriter(output_dir, shard_size) as writer:
+        for line in mapping_list:
+            audio_path, speaker, language, text = line.rstrip('\n').split('|', 3)
+            # Packed clips always sit next to their list, whatever prefix the list line carries.
+            source_audio_path = mapping_list_path.parent / Path(audio_path).name
+            y, sr = read_audio(source_audio_path)
+
+            writer.add(source_audio_path.stem, y, sr, speaker, language, text)
+
+
+def shards_export_list(shard_dir, output_dir):
+    reader = ShardReader(shard_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    with output_dir.joinpath("packed_mapping.list").open('w', encoding="utf-8") as new_mapping_list:
+        for i in range(len(reader)):
+            audio_data, meta = reader[i]
+            new_audio_file_name = f"{meta['id']}.wav"
+            new_mapping_list.write(f"./{output_dir.parts[-2]}/{output_dir.parts[-1]}/{new_audio_file_name}|{meta['speaker']}|{meta['language']}|{meta['text']}\n")
+
+            write_audio(output_dir / new_audio_file_name, audio_data, meta["sample_rate"])
+
+
+def main():
+    parser = ArgumentParser(description="将打包好的数据集转换为分片格式，或从分片格式导出")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    pack_parser = subparsers.add_parser("pack", help="将 packed_mapping.list 和音频写入分片")
+    pack_parser.add_argument("input", type=str, help="packed_mapping.list 的路径")
+    pack_parser.add_argument("output", type=str, help="输出的目录")
+    pack_parser.add_argument("--shard-size", type=int, default=1 << 30, help="单个分片的最大字节数")
+    export_parser = subparsers.add_parser("export", help="将分片导出为 packed_mapping.list 和音频")
+    export_parser.add_argument("input", type=str, help="分片所在的目录")
+    export_parser.add_argument("output", type=str, help="输出的目录")
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        list_pack_shards(Path(args.input), Path(args.output), args.shard_size)
+    else:
+        shards_export_list(Path(args.input), Path(args.output))
+
+
+if __name__ == '__main__':
+    main()
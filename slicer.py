@@ -1,17 +1,33 @@
+import json
 import shutil
-import subprocess as subp
 from pathlib import Path
-from subprocess import Popen
 from typing import Generator
 from typing import Optional
+from contextlib import closing
 
 import mimetypes
 import numpy as np
-import soundfile as sf
 from librosa.feature.spectral import rms as get_rms
 
 from i18n import I18nAuto
+from canceller import CancelToken
+from codec import ffmpeg_decode
+from codec import write_audio
+from metrics import METRICS
+from metrics import StageRun
+from prefetcher import PREFETCHER
+from profiler import PROFILER
+from store import STORE
 
+STATS_NAME = "chunk_stats.json"
+STATS_COLUMNS = (
+    "name", "kept", "reason", "start", "duration", "peak_db", "clipping_ratio",
+    "rms_p10_db", "rms_p50_db", "rms_p90_db", "silence_ratio"
+)
+# Decoded as int32, so full scale is 2 ** 31; samples this close to it count as clipped.
+FULL_SCALE = float(1 << 31)
+CLIP_LEVEL = 0.999
+SILENCE_DB = -50.0
 
 class Slicer(object):
 
@@ -21,11 +37,17 @@ class Slicer(object):
         min_length: int = 5000,
         min_interval: int = 100,
         hop_size: int = 100,
-        max_sil_kept: int = 100
+        max_sil_kept: int = 100,
+        min_chunk_length: int = 0,
+        max_clipping_ratio: float = 1.0,
+        max_silence_ratio: float = 1.0
     ) -> None:
         self.i18n = I18nAuto()
 
         self.sr = 48000
+        # Scheduler cost: ffmpeg plus one thread, with the current and the read-ahead files decoded in memory.
+        self.cpu_cost = 1
+        self.memory_cost = 2048 * (1 + PREFETCHER.read_ahead)
 
         if not min_length >= min_interval >= hop_size:
             raise ValueError("The following condition must be satisfied: min_length >= min_interval >= hop_size")
@@ -39,6 +61,15 @@ class Slicer(object):
         self.min_length = round(self.sr * min_length / 1000 / self.hop_size)
         self.min_interval = round(min_interval_s / self.hop_size)
         self.max_sil_kept = round(self.sr * max_sil_kept / 1000 / self.hop_size)
+        self.min_chunk_length = min_chunk_length / 1000
+        self.max_clipping_ratio = max_clipping_ratio
+        self.max_silence_ratio = max_silence_ratio
+        # Everything the chunks depend on besides the input itself, for the artifact store key.
+        self.params = {
+            "version": 1, "sr": self.sr, "threshold": threshold, "min_length": min_length, "min_interval": min_interval,
+            "hop_size": hop_size, "max_sil_kept": max_sil_kept, "min_chunk_length": min_chunk_length,
+            "max_clipping_ratio": max_clipping_ratio, "max_silence_ratio": max_silence_ratio
+        }
 
     def _apply_slice(
             self,
@@ -52,14 +83,20 @@ class Slicer(object):
             return waveform[begin * self.hop_size: min(waveform.shape[0], end * self.hop_size)]
 
     # @timeit
-    def _slice(self, waveform):
+    def slice(self, waveform: np.ndarray) -> list[np.ndarray]:
         if len(waveform.shape) > 1:
             samples = waveform.mean(axis=0)
         else:
             samples = waveform
-        if (samples.shape[0] + self.hop_size - 1) // self.hop_size <= self.min_length:
-            return [waveform]
+        _, ranges = self._slice_frames(samples)
+        return [self._apply_slice(waveform, begin, end) for begin, end in ranges]
+
+    def _slice_frames(self, samples):
+        # Chunk boundaries in frames, together with the RMS envelope they were found on.
         rms_list = get_rms(y=samples, frame_length=self.win_size, hop_length=self.hop_size).squeeze(0)
+        total_frames = rms_list.shape[0]
+        if (samples.shape[0] + self.hop_size - 1) // self.hop_size <= self.min_length:
+            return rms_list, [(0, total_frames)]
         sil_tags = []
         silence_start = None
         clip_start = 0
@@ -108,28 +145,82 @@ class Slicer(object):
                 clip_start = pos_r
             silence_start = None
         # Deal with trailing silence.
-        total_frames = rms_list.shape[0]
         if silence_start is not None and total_frames - silence_start >= self.min_interval:
             silence_end = min(total_frames, silence_start + self.max_sil_kept)
             pos = rms_list[silence_start: silence_end + 1].argmin() + silence_start
             sil_tags.append((pos, total_frames + 1))
-        # Apply and return slices.
+        # Return the ranges between the silences.
         if len(sil_tags) == 0:
-            return [waveform]
+            return rms_list, [(0, total_frames)]
         else:
-            chunks = []
+            ranges = []
             if sil_tags[0][0] > 0:
-                chunks.append(self._apply_slice(waveform, 0, sil_tags[0][0]))
+                ranges.append((0, sil_tags[0][0]))
             for i in range(len(sil_tags) - 1):
-                chunks.append(self._apply_slice(waveform, sil_tags[i][1], sil_tags[i + 1][0]))
+                ranges.append((sil_tags[i][1], sil_tags[i + 1][0]))
             if sil_tags[-1][1] < total_frames:
-                chunks.append(self._apply_slice(waveform, sil_tags[-1][1], total_frames))
-            return chunks
+                ranges.append((sil_tags[-1][1], total_frames))
+            return rms_list, ranges
+
+    def _chunk_stats(self, chunk, rms):
+        # Everything comes from the decoded samples and the envelope _slice_frames already has, no second pass over the file.
+        rms_db = 20.0 * np.log10(np.maximum(rms, 1.0) / FULL_SCALE)
+        peak = max(int(chunk.max()), -int(chunk.min())) if len(chunk) else 0
+        level = int(CLIP_LEVEL * FULL_SCALE)
+        clipped = np.count_nonzero(chunk >= level) + np.count_nonzero(chunk <= -level)
+        percentiles = np.percentile(rms_db, (10, 50, 90)) if len(rms_db) else (20.0 * np.log10(1.0 / FULL_SCALE),) * 3
+
+        return {
+            "duration": round(len(chunk) / self.sr, 3),
+            "peak_db": round(20.0 * np.log10(max(peak, 1) / FULL_SCALE), 2),
+            "clipping_ratio": round(clipped / max(1, len(chunk)), 6),
+            "rms_p10_db": round(float(percentiles[0]), 2),
+            "rms_p50_db": round(float(percentiles[1]), 2),
+            "rms_p90_db": round(float(percentiles[2]), 2),
+            "silence_ratio": round(float(np.mean(rms_db < SILENCE_DB)) if len(rms_db) else 1.0, 4)
+        }
+
+    def _reject(self, stats):
+        if stats["duration"] < self.min_chunk_length:
+            return "short"
+        if stats["clipping_ratio"] > self.max_clipping_ratio:
+            return "clipping"
+        if stats["silence_ratio"] > self.max_silence_ratio:
+            return "silence"
+        return ""
+
+    def _write_stats(self, stats_path, rows):
+        with open(stats_path, 'w', encoding="utf-8") as f:
+            json.dump({"columns": list(STATS_COLUMNS), "chunks": {column: [row[column] for row in rows] for column in STATS_COLUMNS}}, f, ensure_ascii=False)
 
+    def decode(self, file_path: str, cancel: Optional[CancelToken] = None) -> np.ndarray:
+        # Kept as int32, the silence threshold in slice is tuned to that scale.
+        return ffmpeg_decode(file_path, self.sr, "s32le", cancel)
+
+    def _load(self, file_path: str, cancel: CancelToken, run: StageRun) -> tuple[Optional[str], Optional[np.ndarray]]:
+        type = mimetypes.guess_type(file_path)[0]
+        if (type is None or not type.startswith(("video", "audio"))):
+            return None, None
+        # Chunk names come from the input name, so two copies of one file under different names are stored apart.
+        key = STORE.key("slicer", {**self.params, "name": Path(file_path).stem}, [file_path])
+        # Stored chunks are linked into place later, there is nothing to decode.
+        if STORE.contains(key):
+            return key, None
+        run.read(file_path)
+        with run.time("decode"):
+            return key, self.decode(file_path, cancel)
+
+    def _write(self, output_audio_path: str, chunk: np.ndarray, run: StageRun) -> None:
+        with run.time("encode"):
+            write_audio(output_audio_path, chunk, self.sr)
+        run.wrote(output_audio_path)
+
+    @PROFILER("slicer")
     def __call__(
         self,
         input: Optional[tuple[str]],
-        output: str
+        output: str,
+        cancel: Optional[CancelToken] = None
     ) -> Generator[tuple[str, dict[str, str | bool]], None, None]:
         if input is None:
             error_msg = self.i18n("请上传需要切分的视频或音频。")
@@ -138,63 +229,107 @@ class Slicer(object):
             return
         file_list = (Path(f) for f in input)
         output_path = Path(output)
+        if cancel is None:
+            cancel = CancelToken()
+        partial_path = None
 
         self.proc_count = 0
         self.success_count = 0
+        stored = []
+        run = METRICS.run("slicer")
 
-        for f in file_list:
-            file_path = str(f)
-            type = mimetypes.guess_type(file_path)[0]
-            if (type is None or not type.startswith(("video", "audio"))):
-                continue_msg = self.i18n(f"跳过：{file_path}。")
-                print(continue_msg)
-                yield continue_msg, {"__type__": "update", "visible": False}
-                continue
+        # The next files decode in the background while the current one is sliced and written out.
+        reads = PREFETCHER.read(lambda f: self._load(str(f), cancel, run), file_list, run)
+        with closing(reads), PREFETCHER.writer(run) as writer:
+            for f, future in reads:
+                if cancel.cancelled:
+                    break
+                file_path = str(f)
+                type = mimetypes.guess_type(file_path)[0]
+                if (type is None or not type.startswith(("video", "audio"))):
+                    continue_msg = self.i18n(f"跳过：{file_path}。")
+                    print(continue_msg)
+                    yield continue_msg, {"__type__": "update", "visible": False}
+                    continue
 
-            audio_name = f.stem
-            sub_path = output_path / f"{audio_name}_sliced"
-            if sub_path.exists():
-                shutil.rmtree(sub_path)
-            sub_path.mkdir(parents=True, exist_ok=True)
-
-            ffmpeg_cmd = f"ffmpeg -nostdin -hide_banner -loglevel error -i {file_path} -vn -acodec pcm_s32le -f s32le -ac 1 -ar {self.sr} pipe:1"
-
-            with open(file_path, "rb") as f:
-                with Popen(
-                    ffmpeg_cmd,
-                    stdin = f,
-                    stdout = subp.PIPE,
-                    stderr = subp.PIPE,
-                    shell = True
-                ) as proc:
-                    converting_msg = self.i18n(f"切分中：{file_path}")
-                    print(converting_msg)
-                    yield converting_msg, {"__type__": "update", "visible": False}
-                    self.proc_count += 1
-
-                    proc_out, proc_err = proc.communicate()
-                    if proc.returncode != 0:
-                        error_msg = self.i18n(f"切分失败：{file_path}，FFmpeg 错误")
-                        print(error_msg)
-                        print(str(proc_err))
-                        yield error_msg, {"__type__": "update", "visible": False}
+                audio_name = f.stem
+                sub_path = output_path / f"{audio_name}_sliced"
+                if sub_path.exists():
+                    shutil.rmtree(sub_path)
+                sub_path.mkdir(parents=True, exist_ok=True)
+                partial_path = sub_path
+
+                converting_msg = self.i18n(f"切分中：{file_path}")
+                print(converting_msg)
+                yield converting_msg, {"__type__": "update", "visible": False}
+                self.proc_count += 1
+
+                try:
+                    key, audio_data = future.result()
+                    if audio_data is None:
+                        if STORE.get(key, sub_path) is not None:
+                            run.add("cache_hits")
+                            run.add("files")
+                            self.success_count += 1
+                            partial_path = None
+                            reused_msg = self.i18n(f"复用：{file_path}")
+                            print(reused_msg)
+                            yield reused_msg, {"__type__": "update", "visible": False}
+                            continue
+                        # Evicted since it was looked up, so it is decoded after all.
+                        run.read(file_path)
+                        with run.time("decode"):
+                            audio_data = self.decode(file_path, cancel)
+                except RuntimeError as e:
+                    if cancel.cancelled:
+                        break
+                    run.add("failures")
+                    error_msg = self.i18n(f"切分失败：{file_path}，FFmpeg 错误")
+                    print(error_msg)
+                    print(str(e))
+                    yield error_msg, {"__type__": "update", "visible": False}
+                    continue
+
+                if cancel.cancelled:
+                    break
+                with run.time("analysis"):
+                    rms_list, ranges = self._slice_frames(audio_data)
+                rows = []
+                for i, (begin, end) in enumerate(ranges, start=1):
+                    if cancel.cancelled:
+                        break
+                    chunk = self._apply_slice(audio_data, begin, end)
+                    with run.time("analysis"):
+                        stats = self._chunk_stats(chunk, rms_list[begin:end])
+                    # Dropped chunks keep their number, so the names of the others do not depend on the thresholds.
+                    name = f"{audio_name}_{i}.wav"
+                    reason = self._reject(stats)
+                    rows.append({"name": name, "kept": not reason, "reason": reason, "start": round(begin * self.hop_size / self.sr, 3), **stats})
+                    if reason:
+                        run.add("dropped_chunks")
                         continue
+                    writer.submit(self._write, str(sub_path / name), chunk, run)
+                if cancel.cancelled:
+                    break
+                self._write_stats(sub_path / STATS_NAME, rows)
 
-                    audio_data = np.frombuffer(proc_out, dtype=np.int32)
-
-                    chunks = self._slice(audio_data)
-                    for i, chunk in enumerate(chunks, start=1):
-                        output_audio_path = str(sub_path / f"{audio_name}_{i}.wav")
-                        sf.write(
-                            output_audio_path,
-                            chunk,
-                            self.sr,
-                            subtype="PCM_24",
-                            endian="LITTLE",
-                            format="WAV"
-                        )
-
-                    self.success_count += 1
-        done_msg = self.i18n(f"切分完毕：检测到总共有 {self.proc_count} 个文件，最终成功切分 {self.success_count} 个文件")
+                run.add("files")
+                self.success_count += 1
+                partial_path = None
+                stored.append((key, sub_path, [sub_path / row["name"] for row in rows if row["kept"]] + [sub_path / STATS_NAME]))
+        # Only after the writer has flushed, an artifact must never be stored before its files are complete.
+        for key, sub_path, paths in stored:
+            STORE.put(key, "slicer", sub_path, paths)
+        run.close()
+        if cancel.cancelled:
+            # Chunks of the interrupted file would look like a complete but shorter slice, so they go.
+            if partial_path is not None:
+                shutil.rmtree(partial_path, ignore_errors=True)
+            stop_msg = self.i18n(f"切分已停止：最终成功切分 {self.success_count} 个文件，未完成的输出已删除")
+            print(stop_msg)
+            yield stop_msg, {"__type__": "update", "visible": True}
+            return
+        dropped_count = int(run.values["dropped_chunks"])
+        done_msg = f"{self.i18n(f'切分完毕：检测到总共有 {self.proc_count} 个文件，最终成功切分 {self.success_count} 个文件，按阈值丢弃 {dropped_count} 个片段')}。{run.summary()}"
         print(done_msg)
         yield done_msg, {"__type__": "update", "visible": True}
@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any
+from typing import Optional
+from uuid import uuid4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    key TEXT PRIMARY KEY,
+    stage TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS artifacts_last_used ON artifacts (last_used);
+CREATE TABLE IF NOT EXISTS files (
+    key TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    PRIMARY KEY (key, name)
+);
+CREATE TABLE IF NOT EXISTS hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+"""
+
+
+def link_or_copy(source_path, dest_path):
+    try:
+        os.link(source_path, dest_path)
+        return
+    except OSError:
+        pass
+
+    # copy_file_range lets the kernel reflink or copy in-place without a round trip through userspace.
+    with open(source_path, "rb") as source, open(dest_path, "wb") as dest:
+        remaining = os.fstat(source.fileno()).st_size
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(source.fileno(), dest.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+            return
+        except (AttributeError, OSError):
+            source.seek(0)
+            dest.seek(0)
+            dest.truncate()
+        shutil.copyfileobj(source, dest)
+
+
+class ArtifactStore(object):
+
+    def __init__(self, root: Optional[str] = None, max_bytes: Optional[int] = None) -> None:
+        root = os.environ.get("artifact_dir", "artifacts") if root is None else root
+        # An empty directory turns the store off, every stage then always recomputes.
+        self.root = Path(root).absolute() if root else None
+        self.max_bytes = int(float(os.environ.get("artifact_max_gb", 20)) * (1 << 30)) if max_bytes is None else max_bytes
+        self.local = threading.local()
+
+    @property
+    def enabled(self) -> bool:
+        return self.root is not None
+
+    def _db(self) -> sqlite3.Connection:
+        # Stages read ahead on their own threads, each of them gets its own connection.
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            (self.root / "objects").mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.root / "index.db", timeout=30.0)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            self.local.connection = connection
+
+        return connection
+
+    def _object_dir(self, key: str) -> Path:
+        return self.root / "objects" / key[:2] / key
+
+    def hash_file(self, path) -> str:
+        # Unchanged size and mtime: the recorded hash is used instead of reading the file again.
+        path = Path(path).absolute()
+        stat = path.stat()
+        db = self._db()
+        row = db.execute("SELECT size, mtime_ns, sha256 FROM hashes WHERE path = ?", (str(path),)).fetchone()
+        if row is not None and tuple(row[:2]) == (stat.st_size, stat.st_mtime_ns):
+            return row[2]
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha256.update(chunk)
+        with db:
+            db.execute("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?)", (str(path), stat.st_size, stat.st_mtime_ns, sha256.hexdigest()))
+
+        return sha256.hexdigest()
+
+    def key(self, stage: str, params: dict[str, Any], input_paths: list) -> Optional[str]:
+        if not self.enabled:
+            return None
+        digest = hashlib.sha256(json.dumps({"stage": stage, "params": params}, sort_keys=True).encode())
+        for input_path in input_paths:
+            digest.update(self.hash_file(input_path).encode())
+
+        return digest.hexdigest()
+
+    def contains(self, key: Optional[str]) -> bool:
+        if key is None:
+            return False
+        return self._db().execute("SELECT 1 FROM artifacts WHERE key = ?", (key,)).fetchone() is not None
+
+    def get(self, key: Optional[str], dest_dir: Path) -> Optional[list[Path]]:
+        if key is None:
+            return None
+        db = self._db()
+        files = db.execute("SELECT name, size, mtime_ns FROM files WHERE key = ?", (key,)).fetchall()
+        if not files or not self.contains(key):
+            return None
+        object_dir = self._object_dir(key)
+        for name, size, mtime_ns in files:
+            # A stored file edited in place through one of its links no longer matches what was recorded.
+            try:
+                stat = object_dir.joinpath(name).stat()
+            except FileNotFoundError:
+                stat = None
+            if stat is None or (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                self._remove(key)
+                return None
+
+        dest_paths = []
+        for name, _, _ in files:
+            dest_path = Path(dest_dir) / name
+            dest_path.parent.mkdir(parents=True, exist_ok=True)
+            dest_path.unlink(missing_ok=True)
+            link_or_copy(object_dir / name, dest_path)
+            dest_paths.append(dest_path)
+        with db:
+            db.execute("UPDATE artifacts SET last_used = ? WHERE key = ?", (time.time(), key))
+
+        return dest_paths
+
+    def put(self, key: Optional[str], stage: str, source_dir: Path, paths: list) -> None:
+        if key is None or self.contains(key):
+            return
+        # Linked into a private directory first and renamed into place, so a reader never sees half an artifact.
+        temp_dir = self.root / "tmp" / str(uuid4())
+        files = []
+        try:
+            for path in paths:
+                name = Path(path).relative_to(source_dir).as_posix()
+                temp_path = temp_dir / name
+                temp_path.parent.mkdir(parents=True, exist_ok=True)
+                link_or_copy(path, temp_path)
+                stat = temp_path.stat()
+                files.append((key, name, stat.st_size, stat.st_mtime_ns))
+            object_dir = self._object_dir(key)
+            object_dir.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.rename(temp_dir, object_dir)
+            except OSError:
+                # Another process stored the same artifact first.
+                return
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+        db = self._db()
+        with db:
+            db.execute("DELETE FROM files WHERE key = ?", (key,))
+            db.executemany("INSERT INTO files VALUES (?, ?, ?, ?)", files)
+            db.execute("INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?)", (key, stage, sum(file[2] for file in files), time.time()))
+        self.evict()
+
+    def _remove(self, key: str) -> None:
+        db = self._db()
+        with db:
+            db.execute("DELETE FROM artifacts WHERE key = ?", (key,))
+            db.execute("DELETE FROM files WHERE key = ?", (key,))
+        shutil.rmtree(self._object_dir(key), ignore_errors=True)
+
+    def evict(self) -> None:
+        # Least recently used first; outputs linked from an evicted artifact keep their own link and stay intact.
+        db = self._db()
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in db.execute("SELECT key, size FROM artifacts ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._remove(key)
+            total -= size
+
+
+STORE = ArtifactStore()
@@ -0,0 +1,21 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).absolute().parent.parent
+sys.path.insert(0, str(ROOT))
+# Set before the stages are imported: the store is off unless a test builds its own, and I18nAuto needs a locale.
+os.environ["artifact_dir"] = ""
+os.environ.setdefault("LANG", "zh_CN.UTF-8")
+# I18nAuto reads its locale files relative to the repository root.
+os.chdir(ROOT)
+
+from benchmark import make_corpus
+
+
+@pytest.fixture(scope="session")
+def corpus(tmp_path_factory):
+    # Small enough to pack in seconds, with merge points and several languages like the benchmark corpus.
+    return make_corpus(tmp_path_factory.mktemp("corpus"), episodes=3, episode_seconds=20.0, seed=0)
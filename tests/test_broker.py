@@ -0,0 +1,92 @@
+import os
+import threading
+
+from broker import TaskQueue
+from broker import work
+
+
+def expire(task):
+    # Back-dated instead of slept through: the lease is judged by mtime against the queue's clock file.
+    os.utime(task.path, (0, 0))
+
+
+def test_claim_complete_and_result(tmp_path):
+    queue = TaskQueue(str(tmp_path), lease_seconds=60, max_attempts=3)
+    first = queue.put("slicer", {"inputs": ["a.wav"]})
+    second = queue.put("normalizer", {"inputs": ["b.wav"]})
+
+    assert queue.claim("w1", ["normalizer"]).id == second
+    task = queue.claim("w1")
+    assert (task.id, task.stage, task.args) == (first, "slicer", {"inputs": ["a.wav"]})
+    assert queue.claim("w1") is None
+    assert queue.complete(task, {"message": "ok"})
+    state, data = queue.result(first)
+    assert (state, data["result"]) == ("done", {"message": "ok"})
+    assert queue.status() == {"pending": 0, "claimed": 1, "done": 1, "failed": 0}
+
+
+def test_expired_lease_is_reclaimed(tmp_path):
+    queue = TaskQueue(str(tmp_path), lease_seconds=60, max_attempts=3)
+    task_id = queue.put("slicer", {})
+    stale = queue.claim("w1")
+    expire(stale)
+
+    assert queue.reclaim() == 1
+    # The worker that lost its lease can neither keep nor finish the task.
+    assert not queue.heartbeat(stale)
+    assert not queue.complete(stale, {})
+    task = queue.claim("w2")
+    assert (task.id, task.attempts) == (task_id, 1)
+    assert task.errors == ["lease expired: w1"]
+    assert queue.complete(task, {})
+    assert queue.result(task_id)[0] == "done"
+
+
+def test_heartbeat_keeps_the_lease(tmp_path):
+    queue = TaskQueue(str(tmp_path), lease_seconds=60, max_attempts=3)
+    queue.put("slicer", {})
+    task = queue.claim("w1")
+    expire(task)
+
+    assert queue.heartbeat(task)
+    assert queue.reclaim() == 0
+    assert queue.complete(task, {})
+
+
+def test_task_fails_after_max_attempts(tmp_path):
+    queue = TaskQueue(str(tmp_path), lease_seconds=60, max_attempts=2)
+    task_id = queue.put("slicer", {})
+    assert queue.fail(queue.claim("w1"), "first")
+    expire(queue.claim("w2"))
+
+    assert queue.claim("w3") is None
+    state, data = next(queue.wait([task_id], poll=0.01))[1:]
+    assert (state, data["attempts"], data["errors"]) == ("failed", 2, ["first", "lease expired: w2"])
+
+
+def test_every_task_runs_once_across_workers(tmp_path):
+    queue = TaskQueue(str(tmp_path), lease_seconds=60, max_attempts=3)
+    task_ids = [queue.put("slicer", {"n": n}) for n in range(60)]
+    seen = []
+    lock = threading.Lock()
+
+    def handler(stage, args, instances):
+        with lock:
+            seen.append(args["n"])
+        if args["n"] == 7 and seen.count(7) == 1:
+            raise RuntimeError("flaky")
+        return {"n": args["n"]}
+
+    workers = [
+        threading.Thread(target=work, args=(TaskQueue(str(tmp_path), 60, 3), None, f"w{i}", True, 0.01, handler))
+        for i in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    # Only the task that failed once is run again.
+    assert sorted(seen) == sorted([*range(60), 7])
+    assert all(queue.result(task_id)[0] == "done" for task_id in task_ids)
+    assert queue.result(task_ids[7])[1]["attempts"] == 1
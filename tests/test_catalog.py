@@ -0,0 +1,52 @@
+from catalog import CATALOG_NAME
+from catalog import Catalog
+from catalog import clip_id
+from integrator import srt_pack_wav
+
+
+def row(name, speaker="spk", language="ZH", text="你好", duration=1.0):
+    return {
+        "clip_id": name, "path": f"./out/spk/{name}.wav", "speaker": speaker, "language": language, "text": text,
+        "text_length": len(text), "duration": duration, "sample_rate": 48000, "source": "ep.wav", "source_start": 0.0, "source_end": duration
+    }
+
+
+def test_catalog_round_trip(tmp_path):
+    with Catalog(tmp_path / CATALOG_NAME) as catalog:
+        catalog.replace_pair("b", [row("b1", language="EN", text="hello", duration=2.5)])
+        catalog.replace_pair("a", [row("a1"), row("a2", duration=0.5)])
+
+    # Reopened, the rows come back in list order: by pair, then by position within it.
+    with Catalog(tmp_path / CATALOG_NAME) as catalog:
+        clips = catalog.query()
+        assert [clip["clip_id"] for clip in clips] == ["a1", "a2", "b1"]
+        assert clips[1] == {**row("a2", duration=0.5), "pair": "a", "position": 1, "duplicate_of": None}
+        assert catalog.pairs() == {"a", "b"}
+        assert [clip["clip_id"] for clip in catalog.query(language="ZH", min_seconds=1.0)] == ["a1"]
+        assert catalog.totals() == [
+            {"speaker": "spk", "language": "EN", "clips": 1, "seconds": 2.5},
+            {"speaker": "spk", "language": "ZH", "clips": 2, "seconds": 1.5}
+        ]
+
+        catalog.mark_duplicates({"a2": "a1"})
+        assert [clip["clip_id"] for clip in catalog.query(skip_duplicates=True)] == ["a1", "b1"]
+        # Marks are replaced as a whole, a clip no longer reported is no longer a duplicate.
+        catalog.mark_duplicates({})
+        assert len(catalog.query(skip_duplicates=True)) == 3
+
+        catalog.replace_pair("a", [row("a3")])
+        catalog.drop_pairs({"b"})
+        assert [clip["clip_id"] for clip in catalog.query()] == ["a3"]
+
+
+def test_catalog_matches_packed_list(corpus, tmp_path):
+    srt_pack_wav(corpus / "episodes", tmp_path / "out", "spk", tmp_path / "temp")
+    output_dir = tmp_path / "out" / "spk"
+    packed_list = output_dir.joinpath("packed_mapping.list").read_text(encoding="utf-8")
+
+    with Catalog(output_dir / CATALOG_NAME) as catalog:
+        assert catalog.export_list(tmp_path / "exported.list") == len(packed_list.splitlines())
+        clips = catalog.query()
+    assert tmp_path.joinpath("exported.list").read_text(encoding="utf-8") == packed_list
+    assert [clip["clip_id"] for clip in clips] == [clip_id(line.split("|")[0]) for line in packed_list.splitlines()]
+    assert all(clip["duration"] > 0 and clip["sample_rate"] == 48000 and clip["source_end"] > clip["source_start"] for clip in clips)
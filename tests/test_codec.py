@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+import soundfile as sf
+
+from codec import open_pcm24
+from codec import read_audio
+from codec import write_segments
+
+SUBTYPES = ("PCM_16", "PCM_24", "PCM_32", "FLOAT", "DOUBLE")
+
+
+def write_noise(path, subtype, channels, frames=1001, seed=0):
+    y = np.random.default_rng(seed).uniform(-0.9, 0.9, (frames, channels)).astype(np.float32)
+    sf.write(str(path), y, 16000, subtype=subtype, endian="LITTLE", format="WAV")
+
+    return path
+
+
+def soundfile_mono(path, start=0, stop=None):
+    y, sr = sf.read(str(path), start=start, stop=stop, dtype="float32", always_2d=True)
+
+    return y.mean(axis=1, dtype=np.float32), sr
+
+
+@pytest.mark.parametrize("subtype", SUBTYPES)
+@pytest.mark.parametrize("channels", (1, 2))
+def test_read_audio_matches_soundfile(tmp_path, subtype, channels):
+    path = write_noise(tmp_path / "noise.wav", subtype, channels)
+    y, sr = read_audio(path)
+    expected, expected_sr = soundfile_mono(path)
+
+    assert sr == expected_sr
+    assert y.dtype == np.float32
+    assert np.array_equal(y, expected)
+
+
+@pytest.mark.parametrize("subtype", SUBTYPES)
+@pytest.mark.parametrize("cut", (1, 37, 1000))
+def test_truncated_wav_reads_what_is_there(tmp_path, subtype, cut):
+    raw = write_noise(tmp_path / "noise.wav", subtype, 2).read_bytes()
+    path = tmp_path / "truncated.wav"
+    path.write_bytes(raw[:-cut])
+    y, _ = read_audio(path)
+
+    assert np.array_equal(y, soundfile_mono(path)[0])
+    assert 0 < len(y) < 1001
+
+
+def test_pcm24_segments_match_soundfile(tmp_path):
+    path = write_noise(tmp_path / "noise.wav", "PCM_24", 1)
+    reader = open_pcm24(path)
+
+    assert len(reader) == 1001
+    for start, stop in ((0, 1001), (0, 1), (500, 777), (1000, 1001), (300, 300)):
+        assert np.array_equal(reader[start:stop].float32(), soundfile_mono(path, start, stop)[0])
+    assert np.array_equal(reader[:].int32(), sf.read(str(path), dtype="int32")[0] >> 8)
+    assert open_pcm24(write_noise(tmp_path / "noise16.wav", "PCM_16", 1)) is None
+
+
+def test_written_segments_read_back_with_soundfile(tmp_path):
+    # An odd number of 3-byte frames needs the pad byte after the data chunk.
+    paths = [write_noise(tmp_path / f"part{i}.wav", "PCM_24", 1, frames, seed=i) for i, frames in enumerate((101, 64, 7))]
+    output_path = tmp_path / "joined.wav"
+    write_segments(output_path, [open_pcm24(path)[:] for path in paths], 16000)
+    y, sr = sf.read(str(output_path), dtype="int32")
+
+    assert sr == 16000
+    assert sf.info(str(output_path)).subtype == "PCM_24"
+    assert np.array_equal(y, np.concatenate([sf.read(str(path), dtype="int32")[0] for path in paths]))
@@ -0,0 +1,56 @@
+import shutil
+
+from integrator import load_manifest
+from integrator import srt_pack_wav
+
+
+def pack(input_path, output_path, temp_path, workers=1):
+    srt_pack_wav(input_path, output_path, "spk", temp_path, workers=workers)
+    output_dir = output_path / "spk"
+
+    return output_dir.joinpath("packed_mapping.list").read_text(encoding="utf-8"), output_dir
+
+
+def clip_bytes(output_dir):
+    return {path.name: path.read_bytes() for path in output_dir.glob("*.wav")}
+
+
+def test_packed_list_does_not_depend_on_worker_count(corpus, tmp_path):
+    # Same final folder name, the list holds paths relative to it.
+    serial_list, serial_dir = pack(corpus / "episodes", tmp_path / "serial" / "out", tmp_path / "temp")
+    parallel_list, parallel_dir = pack(corpus / "episodes", tmp_path / "parallel" / "out", tmp_path / "temp", workers=2)
+
+    assert serial_list
+    assert parallel_list == serial_list
+    assert clip_bytes(parallel_dir) == clip_bytes(serial_dir)
+
+
+def test_repack_only_redoes_changed_pairs(corpus, tmp_path, capsys):
+    input_path = tmp_path / "episodes"
+    shutil.copytree(corpus / "episodes", input_path)
+    first_list, output_dir = pack(input_path, tmp_path / "incremental" / "out", tmp_path / "temp")
+    pair_clips = {pair_name: entry["clips"] for pair_name, entry in load_manifest(output_dir / "build_manifest.json")["pairs"].items()}
+    first_mtimes = {path.name: path.stat().st_mtime_ns for path in output_dir.glob("*.wav")}
+
+    capsys.readouterr()
+    assert pack(input_path, output_dir.parent, tmp_path / "temp")[0] == first_list
+    assert "复用 3 组，处理 0 组，删除 0 组" in capsys.readouterr().out
+    assert {path.name: path.stat().st_mtime_ns for path in output_dir.glob("*.wav")} == first_mtimes
+
+    # One pair edited, one removed, one left alone.
+    subtitle_path = input_path / "ep002.srt"
+    blocks = subtitle_path.read_text(encoding="utf-8").split("\n\n")
+    blocks[0] = blocks[0].rsplit("\n", 1)[0] + "\n改过的第一句。"
+    subtitle_path.write_text("\n\n".join(blocks), encoding="utf-8")
+    input_path.joinpath("ep003.srt").unlink()
+    input_path.joinpath("ep003.wav").unlink()
+    repacked_list = pack(input_path, output_dir.parent, tmp_path / "temp")[0]
+    assert "复用 1 组，处理 1 组，删除 1 组" in capsys.readouterr().out
+
+    assert all(output_dir.joinpath(name).stat().st_mtime_ns == first_mtimes[name] for name in pair_clips["ep001"])
+    assert not any(output_dir.joinpath(name).exists() for name in pair_clips["ep003"])
+    assert "改过的第一句。" in repacked_list
+    # Whatever was reused, the result is what a clean build of the same input gives.
+    fresh_list, fresh_dir = pack(input_path, tmp_path / "fresh" / "out", tmp_path / "temp")
+    assert repacked_list == fresh_list
+    assert clip_bytes(output_dir) == clip_bytes(fresh_dir)
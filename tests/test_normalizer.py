@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+import soundfile as sf
+from scipy.signal import upfirdn
+
+from codec import write_audio
+from normalizer import TRUE_PEAK_PHASES
+from normalizer import Normalizer
+from normalizer import true_peak
+
+
+def reference_true_peak(y):
+    # The whole 4x signal through the 48-tap filter, phases interleaved back into one impulse response.
+    y = np.asarray(y, dtype=np.float64)
+    oversampled = upfirdn(TRUE_PEAK_PHASES.T.reshape(-1).astype(np.float64), y, up=4)
+
+    return max(np.abs(oversampled).max(), np.abs(y).max())
+
+
+def signals():
+    rng = np.random.default_rng(0)
+    n = np.arange(48000)
+    # Loud spans are rare, so most of the signal is skipped by the pruning.
+    sparse = rng.standard_normal(200000) * 0.01
+    sparse[123456:123466] = [0.9, -0.9] * 5
+
+    return {
+        "noise": rng.standard_normal(50000) * 0.1,
+        "sparse": sparse,
+        "tail": np.r_[np.zeros(5000), [1.0, -1.0] * 3],
+        "quarter_rate": 0.5 * np.sin(2 * np.pi * n / 4 + np.pi / 4),
+        "single": np.array([0.5]),
+        "dc": np.full(3000, 0.2)
+    }
+
+
+@pytest.mark.parametrize("name", list(signals()))
+def test_true_peak_matches_full_oversampling(name):
+    y = signals()[name].astype(np.float32)
+
+    assert true_peak(y) == pytest.approx(reference_true_peak(y), rel=1e-6)
+
+
+def test_true_peak_finds_peaks_between_samples():
+    n = np.arange(48000)
+    y = (0.5 * np.sin(2 * np.pi * n / 4 + np.pi / 4)).astype(np.float32)
+
+    # Every sample sits 3 dB below the crest of the wave.
+    assert np.abs(y).max() == pytest.approx(0.5 / np.sqrt(2), rel=1e-6)
+    assert 20 * np.log10(true_peak(y) / 0.5) == pytest.approx(0.0, abs=0.1)
+    assert true_peak(np.zeros(0, dtype=np.float32)) == 0.0
+
+
+@pytest.mark.parametrize("sample_rate", (22050, 44100))
+def test_true_peak_ceiling_holds_on_written_file(tmp_path, sample_rate):
+    n = np.arange(3 * sample_rate)
+    y = (0.5 * np.sin(2 * np.pi * n / 4 + np.pi / 4)).astype(np.float32)
+    y[::997] *= 1.9
+    normalizer = Normalizer()
+
+    peaks = {}
+    for use_true_peak in (False, True):
+        output_path = tmp_path / f"{use_true_peak}.wav"
+        write_audio(output_path, normalizer.normalize(y, sample_rate, -3.0, -1.0, use_true_peak), 48000)
+        peaks[use_true_peak] = 20 * np.log10(reference_true_peak(sf.read(str(output_path), dtype="float32")[0]))
+
+    # Measured after the resample to 48 kHz, so neither the interpolation nor the resampler can push it over.
+    assert peaks[True] <= -1.0 + 1e-3
+    assert peaks[False] > -1.0
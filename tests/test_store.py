@@ -0,0 +1,85 @@
+import os
+
+from store import ArtifactStore
+
+
+def make_outputs(output_dir, contents):
+    paths = []
+    for name, data in contents.items():
+        path = output_dir / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        paths.append(path)
+
+    return paths
+
+
+def test_store_round_trip(tmp_path):
+    store = ArtifactStore(str(tmp_path / "artifacts"))
+    input_path = tmp_path / "input.wav"
+    input_path.write_bytes(b"input")
+    key = store.key("slicer", {"threshold": -40}, [input_path])
+
+    assert not store.contains(key)
+    assert store.get(key, tmp_path / "restored") is None
+    outputs = make_outputs(tmp_path / "output", {"ep_1.wav": b"one", "ep/ep_2.wav": b"two"})
+    store.put(key, "slicer", tmp_path / "output", outputs)
+    assert store.contains(key)
+
+    # A second instance over the same directory, as another process would open it.
+    restored = ArtifactStore(str(tmp_path / "artifacts")).get(key, tmp_path / "restored")
+    assert sorted(path.relative_to(tmp_path / "restored").as_posix() for path in restored) == ["ep/ep_2.wav", "ep_1.wav"]
+    assert tmp_path.joinpath("restored", "ep", "ep_2.wav").read_bytes() == b"two"
+
+
+def test_key_follows_params_and_content(tmp_path):
+    store = ArtifactStore(str(tmp_path / "artifacts"))
+    input_path = tmp_path / "input.wav"
+    input_path.write_bytes(b"input")
+    key = store.key("slicer", {"threshold": -40}, [input_path])
+
+    assert store.key("slicer", {"threshold": -40}, [input_path]) == key
+    assert store.key("slicer", {"threshold": -30}, [input_path]) != key
+    assert store.key("normalizer", {"threshold": -40}, [input_path]) != key
+    input_path.write_bytes(b"changed")
+    assert store.key("slicer", {"threshold": -40}, [input_path]) != key
+
+
+def test_edited_artifact_is_dropped(tmp_path):
+    store = ArtifactStore(str(tmp_path / "artifacts"))
+    key = "ab" + "0" * 62
+    outputs = make_outputs(tmp_path / "output", {"clip.wav": b"clip"})
+    store.put(key, "merger", tmp_path / "output", outputs)
+    stored_path = store._object_dir(key) / "clip.wav"
+    stat = stored_path.stat()
+    # Edited in place through a link: same size, newer mtime.
+    stored_path.write_bytes(b"edit")
+    os.utime(stored_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+    assert store.get(key, tmp_path / "restored") is None
+    assert not store.contains(key)
+
+
+def test_least_recently_used_is_evicted(tmp_path):
+    store = ArtifactStore(str(tmp_path / "artifacts"), max_bytes=10)
+    keys = [f"{i:02d}" + "0" * 62 for i in range(3)]
+    for i, key in enumerate(keys[:2]):
+        store.put(key, "slicer", tmp_path / f"output{i}", make_outputs(tmp_path / f"output{i}", {"clip.wav": b"12345"}))
+    # Used after being stored, so the first one is now the most recent.
+    assert store.get(keys[0], tmp_path / "restored") is not None
+    store.put(keys[2], "slicer", tmp_path / "output2", make_outputs(tmp_path / "output2", {"clip.wav": b"12345"}))
+
+    assert [store.contains(key) for key in keys] == [True, False, True]
+    assert tmp_path.joinpath("restored", "clip.wav").read_bytes() == b"12345"
+
+
+def test_disabled_store_keeps_nothing(tmp_path):
+    store = ArtifactStore("")
+    outputs = make_outputs(tmp_path / "output", {"clip.wav": b"clip"})
+    key = store.key("slicer", {}, outputs)
+
+    assert not store.enabled
+    assert key is None
+    store.put(key, "slicer", tmp_path / "output", outputs)
+    assert not store.contains(key)
+    assert store.get(key, tmp_path / "restored") is None
@@ -1,14 +1,19 @@
 import re
 import psutil
 from pathlib import Path
+from concurrent.futures import wait
 from typing import Generator
 from typing import Optional
 
 import torch
-import librosa
+import numpy as np
 from funasr import AutoModel
 
 from i18n import I18nAuto
+from batcher import Batcher
+from codec import audio_duration
+from metrics import METRICS
+from profiler import PROFILER
 
 
 class Transcriber(object):
@@ -35,6 +40,8 @@ class Transcriber(object):
             trust_remote_code=False,
             use_itn=False
         )
+        # Requests from every WebUI user share this queue, so concurrent jobs are folded into common generate calls.
+        self.batcher = Batcher(self._generate, "transcriber")
 
     def _get_device(self) -> tuple[str, int]:
         if torch.cuda.is_available():
@@ -52,6 +59,17 @@ class Transcriber(object):
 
         return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
 
+    def _generate(self, audio_path_list: list[str]) -> list[str]:
+        res = self.funasr_model.generate(audio_path_list)
+
+        return [re.sub(self.pattern, '', r["text"]) for r in res]
+
+    def transcribe(self, audio_data_list: list[np.ndarray], sample_rate: int) -> list[str]:
+        res = self.funasr_model.generate(input=audio_data_list, fs=sample_rate)
+
+        return [re.sub(self.pattern, '', r["text"]) for r in res]
+
+    @PROFILER("transcriber")
     def Transcriber(
         self,
         input: Optional[tuple[str]],
@@ -65,13 +83,15 @@ class Transcriber(object):
         file_list = (Path(file_path) for file_path in input)
         output_path = Path(output)
 
-        self.proc_count = 0
-        self.success_count = 0
-        self.audio_path_list = []
-        self.output_subtitle_path_list = []
-        self.audio_end_time_list = []
-        self.text_list = []
-        self.content_buf = {}
+        # Kept local: the handler runs concurrently for several users on one Transcriber.
+        proc_count = 0
+        success_count = 0
+        audio_path_list = []
+        audio_duration_list = []
+        output_subtitle_path_list = []
+        audio_end_time_list = []
+        content_buf = {}
+        run = METRICS.run("transcriber")
 
         for file in file_list:
             file_path = str(file)
@@ -81,7 +101,7 @@ class Transcriber(object):
                 print(continue_msg)
                 yield continue_msg, {"__type__": "update", "visible": False}
                 continue
-            self.proc_count += 1
+            proc_count += 1
 
             audio_path = file_path
             audio_base_name = file.stem.split("_")[0]
@@ -90,34 +110,46 @@ class Transcriber(object):
             output_subtitle_name_ext = file.with_suffix(".srt").name
             output_subtitle_path = str(sub_path / output_subtitle_name_ext)
 
-            audio_data, sr = librosa.load(audio_path)
-            audio_duration_s = librosa.get_duration(y=audio_data, sr=sr)
+            run.read(audio_path)
+            # Only the length is needed here, funasr decodes the file itself.
+            with run.time("decode"):
+                audio_duration_s = audio_duration(audio_path)
             audio_duration_ms = int(audio_duration_s * 1000)
             audio_end_time = self._format_time(audio_duration_ms)
 
-            self.audio_path_list.append(audio_path)
-            self.output_subtitle_path_list.append(output_subtitle_path)
-            self.audio_end_time_list.append(audio_end_time)
+            audio_path_list.append(audio_path)
+            audio_duration_list.append(audio_duration_s)
+            output_subtitle_path_list.append(output_subtitle_path)
+            audio_end_time_list.append(audio_end_time)
 
-        transcribing_msg = self.i18n(f"转写中：检测到总共有 {self.proc_count} 个文件")
+        transcribing_msg = self.i18n(f"转写中：检测到总共有 {proc_count} 个文件")
         print(transcribing_msg)
         yield transcribing_msg, {"__type__": "update", "visible": False}
-        res = self.funasr_model.generate(self.audio_path_list)
-        for i in range(len(res)):
-            text = re.sub(self.pattern, '', res[i]["text"])
-            self.text_list.append(text)
-        for i, subtitle_path in enumerate(self.output_subtitle_path_list):
-            text = self.text_list[i]
-            end_time = self.audio_end_time_list[i]
+        futures = self.batcher.submit(list(zip(audio_path_list, audio_duration_list)))
+        try:
+            with run.time("inference"):
+                wait(futures)
+            text_list = [future.result() for future in futures]
+        finally:
+            # A request that is dropped half way gives its queued clips back instead of leaving them to be transcribed for nobody.
+            for future in futures:
+                future.cancel()
+        for i, subtitle_path in enumerate(output_subtitle_path_list):
+            text = text_list[i]
+            end_time = audio_end_time_list[i]
             subtitle_text = f"1\n00:00:00,000 --> {end_time}\n{text}\n\n"
-            if subtitle_path not in self.content_buf:
-                self.content_buf[subtitle_path] = ''
-            self.content_buf[subtitle_path] += subtitle_text
-        if self.content_buf != {}:
-            for file_path, content in self.content_buf.items():
-                with open(file_path, "w", encoding="utf-8") as f:
-                    f.write(content)
-                self.success_count += 1
-        done_msg = self.i18n(f"转写完毕：最终成功转写 {self.success_count} 个文件")
+            if subtitle_path not in content_buf:
+                content_buf[subtitle_path] = ''
+            content_buf[subtitle_path] += subtitle_text
+        if content_buf != {}:
+            for file_path, content in content_buf.items():
+                with run.time("encode"):
+                    with open(file_path, "w", encoding="utf-8") as f:
+                        f.write(content)
+                run.wrote(file_path)
+                run.add("files")
+                success_count += 1
+        run.close()
+        done_msg = f"{self.i18n(f'转写完毕：最终成功转写 {success_count} 个文件')}。{run.summary()}"
         print(done_msg)
         yield done_msg, {"__type__": "update", "visible": True}
@@ -1,6 +1,8 @@
 import os
 import sys
 from pathlib import Path
+from typing import Optional
+from typing import Generator
 
 import gradio as gr
 
@@ -11,6 +13,10 @@ sys.path.insert(0, current_path_str)
 
 from config import Config
 from i18n import I18nAuto
+from metrics import METRICS
+from scanner import scan
+from scanner import check_pattern
+from scanner import resolve_dir
 from transcriber import Transcriber
 
 
@@ -32,7 +38,26 @@ class TranscriberWebUI(object):
         self.gr_server_name = self.cfg.gr_server_name
         self.gr_transcriber_webui_port = int(os.environ.get("transcriber_webui_port", 23334))
 
+    def _open_transcriber(
+        self,
+        input_path: Optional[tuple[str]],
+        input_dir: str,
+        input_glob: str,
+        output_path: str
+    ) -> Generator[tuple[str, dict[str, str | bool]], None, None]:
+        if input_dir:
+            try:
+                input_path = scan(resolve_dir(input_dir, self.cfg.ingest_roots), check_pattern(input_glob))
+            except ValueError as e:
+                error_msg = self.i18n(str(e))
+                print(error_msg)
+                yield error_msg, {"__type__": "update", "visible": True}
+                return
+        for res in self.tran.Transcriber(input_path, output_path):
+            yield res
+
     def __call__(self) -> None:
+        METRICS.serve()
         with gr.Blocks(title=self.gr_transcriber_title, theme=self.gr_theme) as app:
             gr.Markdown("# Transcriber - G-SoMapper WebUI")
             gr.Markdown(self.i18n("##### [此项目受 MIT LICENSE 保护](https://github.com/HaTiWinter/G-SoMapper) | 及时关闭 Transcriber WebUI 可以减少显存占用："))
@@ -44,14 +69,17 @@ class TranscriberWebUI(object):
                         file_count="multiple",
                         interactive=True,
                     )
+                    with gr.Group():
+                        tran_input_dir = gr.Textbox(label=self.i18n("或使用服务器上的目录"), interactive=True)
+                        tran_input_glob = gr.Textbox(label=self.i18n("匹配模式"), value="**/*.wav", interactive=True)
                 with gr.Column():
                     tran_output_path = gr.Textbox(label=self.i18n("输出目录"), interactive=True)
                     with gr.Group():
                         tran_info = gr.Textbox(label=self.i18n("进程输出信息"), interactive=False)
                         open_tran_btn = gr.Button(self.i18n("开始生成"), variant="primary", visible=True)
                         open_tran_btn.click(
-                            self.tran.Transcriber,
-                            [tran_input_path, tran_output_path],
+                            self._open_transcriber,
+                            [tran_input_path, tran_input_dir, tran_input_glob, tran_output_path],
                             [tran_info, open_tran_btn]
                         )
             app.queue(max_size=self.gr_max_size, default_concurrency_limit=self.gr_default_concurrency_limit,).launch(
@@ -1,7 +1,5 @@
-import subprocess as subp
-from subprocess import Popen
-
 from config import Config
+from canceller import terminate_tree
 
 
 class Utils(object):
@@ -10,32 +8,16 @@ class Utils(object):
         self.cfg = Config()
         self.os_name = self.cfg.os_name
 
-    def _run_kill_cmd(
-        self,
-        cmd: str,
-        pid: int
-    ) -> str:
-        with Popen(
-            cmd,
-            stdout = subp.PIPE,
-            stderr = subp.PIPE,
-            shell = True
-        ) as proc:
-            _, proc_err = proc.communicate()
-            if proc.returncode != 0:
-                raise RuntimeError(f'Failed to terminated process: {pid}\n{proc_err.decode("utf-8")}')
-
-        return ''
-
     def kill_proc(
         self,
-        pid: int
+        pid: int,
+        timeout: float = 5.0
     ) -> str:
-        if self.os_name == "win32":
-            kill_proc_cmd_win = f"taskkill /F /T /PID {pid}"
-            return self._run_kill_cmd(kill_proc_cmd_win, pid)
-        elif self.os_name == "linux" or self.os_name == "darwin":
-            kill_proc_cmd_linux_and_macos = f"kill -9 {pid}"
-            return self._run_kill_cmd(kill_proc_cmd_linux_and_macos, pid)
-        else:
+        if self.os_name not in ("win32", "linux", "darwin"):
             raise OSError(f"Unsupported OS: {self.os_name}")
+        try:
+            terminate_tree(pid, timeout)
+        except Exception as e:
+            raise RuntimeError(f'Failed to terminated process: {pid}\n{e}')
+
+        return ''